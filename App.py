@@ -1,9 +1,15 @@
 import streamlit as st
 import pandas as pd
-import seaborn as sns
-import matplotlib.pyplot as plt
-import plotly.express as px
-from utils import load_data_from_db, clean_data, convert_df_to_excel
+from utils import COLUMNS, get_dataset, get_incremental_loader, iter_listings, memory_report, start_rerun, show_rerun_stats
+from export import EXPORT_FORMATS, CHUNK_ROWS, export_bytes, frame_chunks
+from rollups import frame_summary, get_rollup
+from dedup import get_duplicates
+from charts import show_chart
+from sketches import draw_boxplot
+from lod import FORCE_EXACT, draw_histogram
+from instrumentation import section
+
+rerun = start_rerun("App")
 
 # Title
 st.title("Welcome Car Price Analysis Data Overview for cars v1.0 29-Sep-2025")
@@ -11,17 +17,30 @@ st.title("Welcome Car Price Analysis Data Overview for cars v1.0 29-Sep-2025")
 # Data Overview
 st.header("Number of Rows available")
 
-# Load and clean the data
-data = load_data_from_db()
+# Load and clean the data (only rows changed since the last refresh are read and cleaned).
+# This is a view of the frame shared by all sessions, 'date_int' is precomputed there.
+with section("load") as timing:
+    dataset = get_dataset()
+    data = dataset.view()
+    timing.output(data)
 
-st.write("All Data:",data.shape[0])
+st.write("All Data:",get_incremental_loader().raw.shape[0])
 
-data = clean_data(data)
-# Convert the datetime column to an integer (number of days since 1970-01-01)
-data['date_int'] = (data['date'] - pd.Timestamp('1970-01-01')) // pd.Timedelta('1D')
 
 st.write("Cleaned Data:",data.shape[0])
 
+# The same car posted again under a new link counts once (see dedup.py)
+deduplicated = st.sidebar.checkbox("Deduplicated", value=False, help="Keep only the latest listing of each group of near-duplicate listings")
+if deduplicated:
+    with section("deduplicate", data) as timing:
+        data = data.take(get_duplicates(dataset).kept)
+        timing.output(data)
+    st.write("Deduplicated Data:", data.shape[0])
+
+# Memory used by each column of the shared cleaned data (see utils.apply_schema)
+with st.expander("Memory usage per column"):
+    st.write(memory_report(data))
+
 
 # Add a date range filter using Streamlit's date_input
 st.sidebar.subheader("Select Date Range")
@@ -29,11 +48,16 @@ st.sidebar.subheader("Select Date Range")
 start = st.sidebar.date_input("From:", data['date'].max() - pd.DateOffset(months=1),min_value=data['date'].min(),max_value=data['date'].max())
 end = st.sidebar.date_input("To:", data['date'].max(),start,max_value=data['date'].max())
 
-data= data[data['date'] >= f"{start}"]
-data= data[data['date'] <= f"{end}"]
+with section("date filter", data) as timing:
+    data= data[data['date'] >= f"{start}"]
+    data= data[data['date'] <= f"{end}"]
+    timing.output(data)
 
 st.write("Filtred Data per Posting Year:",data.shape[0])
 
+# Large selections are charted from binned counts unless exact charts are asked for (see lod.py)
+exact_charts = st.sidebar.checkbox("Exact charts", value=FORCE_EXACT, help="Draw every listing, even for large selections (slower)")
+
 # ---------------------------------------------------------------------
 # Price range filter
 st.subheader("Select Price Range")
@@ -50,92 +74,105 @@ price_range = st.slider(
 )
 
 # Apply the filter
-data = data[(data['price'] >= price_range[0]) & (data['price'] <= price_range[1])]
+with section("price filter", data) as timing:
+    data = data[(data['price'] >= price_range[0]) & (data['price'] <= price_range[1])]
+    timing.output(data)
 
 st.write("Filtered Data after Date & Price Range:", data.shape[0])
 
+# Describes the filtered data to the quantile sketches, which large selections
+# use instead of sorting every value (see sketches.draw_boxplot).
+# A price window can only be applied to the price sketches.
+price_window = None if price_range == (min_price, max_price) else price_range
+price_query = dict(version=dataset.version, date_range=(start, end), price_range=price_window)
+year_query = dict(version=dataset.version, date_range=(start, end)) if price_window is None else None
+if deduplicated:
+    # The sketches count every listing
+    price_query = year_query = None
+
 # ---------------------------------------------------------------------
 
 st.header("Statistical Summary")
 
-st.write(data.describe().drop(columns=['wilaya']))
+with section("statistical summary", data):
+    st.write(data.describe().drop(columns=['wilaya']))
 
-# Get the describe output for object columns
-object_stats = data.drop(columns=['link', 'paper']).describe(include=['object'])
+    # Get the describe output for the text columns
+    object_stats = data.drop(columns=['link', 'paper']).describe(include=['object', 'category', 'string'])
 
-# Compute custom stats for 'wilaya'
-wilaya_stats = {
-    'count': data['wilaya'].count(),
-    'unique': data['wilaya'].nunique(),
-    'top': data['wilaya'].mode()[0] if not data['wilaya'].mode().empty else None,
-    'freq': data['wilaya'].value_counts().iloc[0] if not data['wilaya'].value_counts().empty else 0,
-}
+    # Compute custom stats for 'wilaya' from the listings per wilaya, answered
+    # from the rollup (which counts every listing) unless deduplicated
+    if deduplicated:
+        wilaya_counts = data['wilaya'].value_counts()
+    else:
+        wilaya_counts = get_rollup(dataset).aggregate('wilaya', date_range=(start, end), price_range=price_range)['count']
+    # Most listings first, the lowest code first among ties (as mode() does)
+    wilaya_counts = wilaya_counts[wilaya_counts > 0].sort_index().sort_values(ascending=False, kind='stable')
+    wilaya_stats = {
+        'count': wilaya_counts.sum(),
+        'unique': len(wilaya_counts),
+        'top': wilaya_counts.index[0] if not wilaya_counts.empty else None,
+        'freq': wilaya_counts.iloc[0] if not wilaya_counts.empty else 0,
+    }
 
-# Convert wilaya_stats into a DataFrame for consistency
-wilaya_df = pd.DataFrame(wilaya_stats, index=['wilaya']).T
+    # Convert wilaya_stats into a DataFrame for consistency
+    wilaya_df = pd.DataFrame(wilaya_stats, index=['wilaya']).T
 
-# Concatenate the two DataFrames
-final_stats = pd.concat([object_stats, wilaya_df], axis=1)
+    # Concatenate the two DataFrames
+    final_stats = pd.concat([object_stats, wilaya_df], axis=1)
 
-# Display the result with Streamlit
-st.write(final_stats)
+    # Display the result with Streamlit
+    st.write(final_stats)
 
 # st.write(data.describe(include=['object']).drop(columns=['link', 'paper']))
 # ------------------------------------------------------------------------
-# Count of occurrences per brand
-brand_counts = data['brand'].value_counts().reset_index()
-brand_counts.columns = ['brand', 'count']  # Rename columns for clarity
-
-# Pivot table for average price per brand
-brand_avg_price = data.pivot_table(index='brand', values='price', aggfunc='mean').reset_index()
-
-brand_avg_price.columns =['brand', 'Average Price']
-
-# Merge the two tables on the 'brand' column
-merged_data = pd.merge(brand_counts, brand_avg_price, on='brand')
-
-# Display the result
-st.write(merged_data)
+# Count of occurrences and average price per brand, answered from the rollup
+# (which counts every listing) unless deduplicated
+with section("brand table") as timing:
+    if deduplicated:
+        brand_summary = frame_summary(data, 'brand')
+    else:
+        brand_summary = get_rollup(dataset).summary('brand', date_range=(start, end), price_range=price_range)
+    timing.output(brand_summary)
+
+    # Display the result
+    st.write(brand_summary)
 
 # -------------------------------------------------
-# Count of occurrences per model
-model_counts = data['model'].value_counts().reset_index()
-model_counts.columns = ['model', 'count']  # Rename columns for clarity
-
-# Pivot table for average price per model
-model_avg_price = data.pivot_table(index='model', values='price', aggfunc='mean').reset_index()
-
-model_avg_price.columns =['model', 'Average Price']
-
-# Merge the two tables on the 'model' column
-merged_data = pd.merge(model_counts, model_avg_price, on='model')
-
-# Display the result
-st.write(merged_data)
+# Count of occurrences and average price per model
+with section("model table") as timing:
+    if deduplicated:
+        model_summary = frame_summary(data, 'model')
+    else:
+        model_summary = get_rollup(dataset).summary('model', date_range=(start, end), price_range=price_range)
+    timing.output(model_summary)
+
+    # Display the result
+    st.write(model_summary)
 # ---------------------------------------
 
 ## Price Distribution
 st.subheader("Price Distribution")
 st.write("Histogram of Car Prices:")
-fig, ax = plt.subplots()
-sns.histplot(data['price'], kde=True, ax=ax, color='blue')
-ax.set_title("Price Distribution")
-st.pyplot(fig)
 
-sns.boxplot(x=data['price'])
+# Each chart is drawn by a function of its inputs and cached on them (see charts.py)
+def price_histogram(ax, prices, exact):
+    draw_histogram(ax, prices, exact, color='blue')
+    ax.set_title("Price Distribution")
+
+show_chart(price_histogram, data['price'], exact_charts)
 
-fig, ax = plt.subplots()  # Create a matplotlib figure and axis
-sns.boxplot(x=data['price'], ax=ax)  # Create a boxplot with seaborn
-ax.set_title('Price Distribution')  # Add a title to the plot
+def price_boxplot(ax, data, query, exact):
+    draw_boxplot(ax, data, 'price', query=query, exact=exact)  # Create a boxplot
+    ax.set_title('Price Distribution')  # Add a title to the plot
 
-# Display the plot in Streamlit
-st.pyplot(fig)
+show_chart(price_boxplot, data[['price']], price_query, exact_charts)
 
 # ----------------------------------------------------------------------
 
 st.header("Price Distribution by Brand")
 
-top_brands = data['brand'].value_counts().head(5).index.tolist()
+top_brands = brand_summary['brand'].head(5).tolist()
 
 # Filter data to avoid clutter if there are too many brands
 selected_brands = st.sidebar.multiselect(
@@ -144,22 +181,19 @@ selected_brands = st.sidebar.multiselect(
     default=top_brands  # Default to the first 5 brands
 )
 
+def grouped_boxplot(ax, data, y, x, query, exact, title):
+    draw_boxplot(ax, data, y, x, query=query, exact=exact)
+    ax.set_title(title)
+    ax.set_xticklabels(ax.get_xticklabels(), rotation=45)  # Rotate labels for readability
+
 # Filter data based on selected brands
-filtered_data = data[data['brand'].isin(selected_brands)]
+with section("brand filter", data) as timing:
+    filtered_data = data[data['brand'].isin(selected_brands)]
+    timing.output(filtered_data)
 
 if not filtered_data.empty:
-    # Create a matplotlib figure
-    fig, ax = plt.subplots(figsize=(12, 6))  # Adjust size as needed
-
-    # Plot the boxplot
-    sns.boxplot(x='brand', y='price', data=filtered_data, ax=ax)
-    
-    # Customize the plot
-    ax.set_title("Price Distribution by Brand")
-    ax.set_xticklabels(ax.get_xticklabels(), rotation=45)  # Rotate brand labels for readability
-
-    # Display the plot in Streamlit
-    st.pyplot(fig)
+    show_chart(grouped_boxplot, filtered_data[['brand', 'price']], 'price', 'brand',
+               None if price_query is None else dict(price_query, brand=selected_brands), exact_charts, "Price Distribution by Brand", figsize=(12, 6), name="price by brand")
 else:
     st.write("No data available for the selected brands.")
 
@@ -167,23 +201,9 @@ else:
 
 st.header("Year Distribution by Brand")
 
-
-# Filter data based on selected brands
-filtered_data = data[data['brand'].isin(selected_brands)]
-
 if not filtered_data.empty:
-    # Create a matplotlib figure
-    fig, ax = plt.subplots(figsize=(12, 6))  # Adjust size as needed
-
-    # Plot the boxplot
-    sns.boxplot(x='brand', y='year', data=filtered_data, ax=ax)
-    
-    # Customize the plot
-    ax.set_title("Year Distribution by Brand")
-    ax.set_xticklabels(ax.get_xticklabels(), rotation=45)  # Rotate brand labels for readability
-
-    # Display the plot in Streamlit
-    st.pyplot(fig)
+    show_chart(grouped_boxplot, filtered_data[['brand', 'year']], 'year', 'brand',
+               None if year_query is None else dict(year_query, brand=selected_brands), exact_charts, "Year Distribution by Brand", figsize=(12, 6), name="year by brand")
 else:
     st.write("No data available for the selected brands.")
 
@@ -192,7 +212,7 @@ else:
 
 st.header("Price Distribution by model")
 
-top_models = data['model'].value_counts().head(5).index.tolist()
+top_models = model_summary['model'].head(5).tolist()
 
 # Filter data to avoid clutter if there are too many models
 selected_models = st.sidebar.multiselect(
@@ -202,21 +222,13 @@ selected_models = st.sidebar.multiselect(
 )
 
 # Filter data based on selected models
-filtered_data = data[data['model'].isin(selected_models)]
+with section("model filter", data) as timing:
+    filtered_data = data[data['model'].isin(selected_models)]
+    timing.output(filtered_data)
 
 if not filtered_data.empty:
-    # Create a matplotlib figure
-    fig, ax = plt.subplots(figsize=(12, 6))  # Adjust size as needed
-
-    # Plot the boxplot
-    sns.boxplot(x='model', y='price', data=filtered_data, ax=ax)
-    
-    # Customize the plot
-    ax.set_title("Price Distribution by model")
-    ax.set_xticklabels(ax.get_xticklabels(), rotation=45)  # Rotate model labels for readability
-
-    # Display the plot in Streamlit
-    st.pyplot(fig)
+    show_chart(grouped_boxplot, filtered_data[['model', 'price']], 'price', 'model',
+               None if price_query is None else dict(price_query, model=selected_models), exact_charts, "Price Distribution by model", figsize=(12, 6), name="price by model")
 else:
     st.write("No data available for the selected models.")
 
@@ -224,38 +236,35 @@ else:
 
 st.header("Year Distribution by model")
 
-
-# Filter data based on selected models
-filtered_data = data[data['model'].isin(selected_models)]
-
 if not filtered_data.empty:
-    # Create a matplotlib figure
-    fig, ax = plt.subplots(figsize=(12, 6))  # Adjust size as needed
-
-    # Plot the boxplot
-    sns.boxplot(x='model', y='year', data=filtered_data, ax=ax)
-    
-    # Customize the plot
-    ax.set_title("Year Distribution by model")
-    ax.set_xticklabels(ax.get_xticklabels(), rotation=45)  # Rotate model labels for readability
-
-    # Display the plot in Streamlit
-    st.pyplot(fig)
+    show_chart(grouped_boxplot, filtered_data[['model', 'year']], 'year', 'model',
+               None if year_query is None else dict(year_query, model=selected_models), exact_charts, "Year Distribution by model", figsize=(12, 6), name="year by model")
 else:
     st.write("No data available for the selected models.")
 
 
 # --------------------------------------------------------------
-# Provide an option to download the cleaned data
+# Provide an option to download the cleaned data. The listings of the date
+# and price range are streamed from SQLite in chunks (see export.py); the
+# deduplicated ones are only known to the page, they are exported from it
 st.header("Export Data")
-if st.button("Download Cleaned Data as Excel"):
-    excel_data = convert_df_to_excel(data)
+export_format = st.selectbox("Format", list(EXPORT_FORMATS))
+if st.button("Download Cleaned Data"):
+    extension, mime = EXPORT_FORMATS[export_format]
+    with section("export"):
+        if deduplicated:
+            chunks = frame_chunks(data[COLUMNS], CHUNK_ROWS)
+        else:
+            chunks = iter_listings(CHUNK_ROWS, date_range=(start, end), price_range=price_range)
+        export_data = export_bytes(chunks, export_format)
     st.download_button(
-        label="Download Excel",
-        data=excel_data,
-        file_name="cleaned_car_data.xlsx",
-        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+        label=f"Download {extension.upper()}",
+        data=export_data,
+        file_name=f"cleaned_car_data.{extension}",
+        mime=mime
     )
 
 # Footer
 st.write("Built with ❤️ using Streamlit!")
+
+show_rerun_stats(rerun, globals())
@@ -0,0 +1,330 @@
+"""
+Headless JSON API over the numbers the dashboard shows, for other tools.
+
+It runs next to the dashboard (in its own process, from the same directory)
+on the same incremental loader, rollup and sketches, so a query costs what
+the same widget costs in the dashboard. Responses are kept in an LRU cache
+with a time to live, keyed on the endpoint, the normalized query parameters
+and the dataset version: a write to the database changes the version, so
+older responses are never served again. Every response carries an ETag (a
+hash of its body) and a request whose If-None-Match matches it gets an empty
+304. Concurrent requests for the same key wait for one computation, which
+runs in a thread pool so the event loop keeps serving cached responses.
+
+Usage:
+    python api.py [--host 127.0.0.1] [--port 8600] [--cache-entries 1024] [--ttl 60]
+
+Endpoints (GET, JSON):
+    /version
+    /summary?by=brand|model [&from=YYYY-MM-DD&to=YYYY-MM-DD] [&min_price=&max_price=]
+    /quantiles?[brand=][&model=][&year=] [&metric=price|mileage] [&q=0.25,0.5,0.75]
+    /listings?[brand=][&model=][&year=] [&from=&to=] [&min_price=&max_price=] [&limit=100][&offset=0]
+"""
+import argparse
+import asyncio
+import concurrent.futures
+import hashlib
+import json
+import logging
+import time
+import cachetools
+import numpy as np
+import pandas as pd
+import tornado.web
+
+from rollups import get_rollup
+from sketches import quantiles
+from utils import DB_PATH, db_mtime, get_dataset, get_incremental_loader, query_listings, query_stats
+
+# Responses kept, and seconds each one is served for
+CACHE_ENTRIES = 1024
+CACHE_TTL = 60
+
+# Threads computing responses (the loader, rollup and sketches have their own locks)
+WORKERS = 4
+
+# Listings returned per page, at most
+MAX_LIMIT = 1000
+
+SUMMARY_BY = ("brand", "model")
+QUANTILE_METRICS = ("price", "mileage")
+DEFAULT_QUANTILES = (0.1, 0.25, 0.5, 0.75, 0.9)
+
+class BadRequest(Exception):
+    pass
+
+class ResponseCache:
+    """
+    Bodies and ETags of computed responses, by (endpoint, parameters, version),
+    least recently used first out, each for `ttl` seconds. `hits` and `misses`
+    count the lookups.
+    """
+
+    def __init__(self, max_entries=CACHE_ENTRIES, ttl=CACHE_TTL):
+        self._entries = cachetools.TTLCache(maxsize=max_entries, ttl=ttl) if max_entries > 0 else None
+        self._pending = {}
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, key, compute):
+        """
+        The (body, etag) of `key`, from `compute()` (run in the executor) when
+        it is not cached; concurrent callers of one key share one computation.
+        """
+        if self._entries is not None and key in self._entries:
+            self.hits += 1
+            return self._entries[key]
+        self.misses += 1
+        pending = self._pending.get(key)
+        if pending is None:
+            pending = self._pending[key] = asyncio.ensure_future(_run(compute))
+            pending.add_done_callback(lambda _: self._pending.pop(key, None))
+        # A cancelled caller must not cancel the computation the others wait for
+        response = await asyncio.shield(pending)
+        if self._entries is not None:
+            self._entries[key] = response
+        return response
+
+_executor = concurrent.futures.ThreadPoolExecutor(WORKERS, thread_name_prefix="api")
+
+async def _run(fn):
+    body = await asyncio.get_running_loop().run_in_executor(_executor, fn)
+    return body, '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+
+class QueryHandler(tornado.web.RequestHandler):
+    """
+    GET handler of one endpoint: `normalize` turns the query arguments into a
+    sorted tuple of parameters (raising BadRequest), `compute` turns them into
+    a JSON-serializable payload.
+    """
+
+    def initialize(self, endpoint, normalize, compute, cache):
+        self.endpoint = endpoint
+        self.normalize = normalize
+        self.compute = compute
+        self.cache = cache
+
+    async def get(self):
+        try:
+            params = self.normalize({name: self.get_query_argument(name) for name in self.request.query_arguments})
+        except BadRequest as error:
+            self.set_status(400)
+            self.finish({"error": str(error)})
+            return
+        version = await _current_version()
+        body, etag = await self.cache.get((self.endpoint, params, version), lambda: _encode(self.compute(version, dict(params))))
+        self.set_header("ETag", etag)
+        self.set_header("Cache-Control", f"max-age={self.cache.ttl:.0f}")
+        if etag in _etags(self.request.headers.get("If-None-Match", "")):
+            self.set_status(304)
+            self.finish()
+            return
+        self.set_header("Content-Type", "application/json")
+        self.finish(body)
+
+# Modification time of the database when the version was last read, and when that was
+_seen = {"mtime": None, "version": None, "at": 0.0}
+
+async def _current_version():
+    # The dataset version, read again (in the executor: the loader may read
+    # the database) when the database changed, or CACHE_TTL seconds after the
+    # last read (the version also changes with the year)
+    mtime = db_mtime(DB_PATH)
+    if mtime is None or mtime != _seen["mtime"] or time.monotonic() - _seen["at"] > CACHE_TTL:
+        version = await asyncio.get_running_loop().run_in_executor(_executor, _refresh)
+        _seen.update(mtime=mtime, version=version, at=time.monotonic())
+    return _seen["version"]
+
+def _refresh():
+    loader = get_incremental_loader()
+    loader.refresh()
+    return loader.version
+
+def _etags(header):
+    return {tag.strip().removeprefix("W/") for tag in header.split(",")}
+
+def _encode(payload):
+    return json.dumps(payload, default=_json_default, separators=(",", ":")).encode()
+
+def _json_default(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"not JSON serializable: {type(value).__name__}")
+
+def _records(frame):
+    # Rows of a frame as JSON-ready dicts, missing values as null
+    return json.loads(frame.to_json(orient="records"))
+
+# ---------------------------------------------------------------------
+# Parameters: every endpoint's arguments normalized to a sorted tuple, so
+# equivalent queries share their cache entry
+
+def _normalize(args, allowed, defaults=None):
+    unknown = set(args) - set(allowed)
+    if unknown:
+        raise BadRequest(f"unknown parameters: {', '.join(sorted(unknown))} (expected {', '.join(allowed)})")
+    params = dict(defaults or {})
+    for name, value in args.items():
+        value = value.strip()
+        if value:
+            params[name] = allowed[name](name, value)
+    if ("from" in params) != ("to" in params):
+        raise BadRequest("'from' and 'to' go together")
+    if ("min_price" in params) != ("max_price" in params):
+        raise BadRequest("'min_price' and 'max_price' go together")
+    return tuple(sorted(params.items()))
+
+def _text(name, value):
+    return value
+
+def _upper(name, value):
+    # Models are shown, and matched, in uppercase
+    return value.upper()
+
+def _integer(name, value):
+    try:
+        return int(value)
+    except ValueError:
+        raise BadRequest(f"'{name}' is not an integer: {value}") from None
+
+def _day(name, value):
+    try:
+        return pd.Timestamp(value).strftime("%Y-%m-%d")
+    except ValueError:
+        raise BadRequest(f"'{name}' is not a date: {value}") from None
+
+def _choice(*choices):
+    def parse(name, value):
+        if value not in choices:
+            raise BadRequest(f"'{name}' must be one of {', '.join(choices)}")
+        return value
+    return parse
+
+def _quantile_list(name, value):
+    try:
+        qs = sorted({float(q) for q in value.split(",")})
+    except ValueError:
+        raise BadRequest(f"'{name}' is not a list of numbers: {value}") from None
+    if not all(0 <= q <= 1 for q in qs):
+        raise BadRequest(f"'{name}' must be between 0 and 1")
+    return tuple(qs)
+
+WINDOW = {"from": _day, "to": _day, "min_price": _integer, "max_price": _integer}
+SELECTION = {"brand": _text, "model": _upper, "year": _integer}
+
+def normalize_summary(args):
+    params = _normalize(args, {"by": _choice(*SUMMARY_BY), **WINDOW})
+    if "by" not in dict(params):
+        raise BadRequest(f"'by' is required ({' or '.join(SUMMARY_BY)})")
+    return params
+
+def normalize_quantiles(args):
+    return _normalize(args, {**SELECTION, "metric": _choice(*QUANTILE_METRICS), "q": _quantile_list},
+                      {"metric": "price", "q": DEFAULT_QUANTILES})
+
+def normalize_listings(args):
+    params = _normalize(args, {**SELECTION, **WINDOW, "limit": _integer, "offset": _integer}, {"limit": 100, "offset": 0})
+    if not 0 <= dict(params)["limit"] <= MAX_LIMIT or dict(params)["offset"] < 0:
+        raise BadRequest(f"'limit' must be between 0 and {MAX_LIMIT}, 'offset' at least 0")
+    return params
+
+def _windows(params):
+    date_range = (params["from"], params["to"]) if "from" in params else None
+    price_range = (params["min_price"], params["max_price"]) if "min_price" in params else None
+    return date_range, price_range
+
+# ---------------------------------------------------------------------
+# Endpoints
+
+def normalize_version(args):
+    return _normalize(args, {})
+
+def version_payload(version, params):
+    return {"version": version}
+
+def summary_payload(version, params):
+    """
+    Count and average price per brand or model, as App.py's tables.
+    """
+    date_range, price_range = _windows(params)
+    summary = get_rollup().summary(params["by"], date_range=date_range, price_range=price_range)
+    return {"version": version, "by": params["by"], "rows": _records(summary.rename(columns={"Average Price": "average_price"}))}
+
+def quantiles_payload(version, params):
+    """
+    Quantiles of the price (or mileage) of the listings of a brand, model
+    and/or year: exact for small selections, from the sketches otherwise.
+    """
+    dataset = get_dataset()
+    frame = dataset.frame
+    keep = np.ones(len(frame), dtype=bool)
+    query = {"version": dataset.version}
+    for column in SELECTION:
+        if column in params:
+            keep &= (frame[column] == params[column]).to_numpy(dtype=bool, na_value=False)
+            query[column] = params[column]
+    selected = frame.loc[keep, [params["metric"]]]
+    values = quantiles(selected, params["metric"], params["q"], query) if len(selected) else [None] * len(params["q"])
+    return {
+        "version": version,
+        "metric": params["metric"],
+        "count": len(selected),
+        "quantiles": {str(q): None if value is None or np.isnan(value) else float(value) for q, value in zip(params["q"], values)},
+    }
+
+def listings_payload(version, params):
+    """
+    A page of the cleaned listings matching the filters, in database order.
+    Only the page is read from SQLite; the total is a COUNT of the same query.
+    """
+    date_range, price_range = _windows(params)
+    filters = dict(
+        date_range=date_range, price_range=price_range,
+        brand=params.get("brand"), model=params.get("model"),
+        years=[params["year"]] if "year" in params else None,
+    )
+    page = query_listings(limit=params["limit"], offset=params["offset"], **filters)
+    page = page.assign(date=page["date"].dt.strftime("%Y-%m-%d"))
+    return {"version": version, "total": query_stats(**filters)["count"], "offset": params["offset"], "rows": _records(page)}
+
+ENDPOINTS = {
+    "version": (normalize_version, version_payload),
+    "summary": (normalize_summary, summary_payload),
+    "quantiles": (normalize_quantiles, quantiles_payload),
+    "listings": (normalize_listings, listings_payload),
+}
+
+def make_app(cache):
+    return tornado.web.Application([
+        (f"/{endpoint}", QueryHandler, dict(endpoint=endpoint, normalize=normalize, compute=compute, cache=cache))
+        for endpoint, (normalize, compute) in ENDPOINTS.items()
+    ])
+
+async def serve(host, port, cache_entries=CACHE_ENTRIES, ttl=CACHE_TTL):
+    # The cached stores warn on every call from outside a Streamlit session
+    # (once the config is parsed, which resets the log levels)
+    import streamlit.config
+
+    streamlit.config.get_config_options()
+    logging.getLogger("streamlit.runtime.scriptrunner_utils.script_run_context").setLevel(logging.ERROR)
+    logging.getLogger("streamlit.runtime.caching.cache_data_api").setLevel(logging.ERROR)
+
+    # Loaded before the first request is accepted
+    await _current_version()
+    app = make_app(ResponseCache(cache_entries, ttl))
+    app.listen(port, host)
+    print(f"serving on http://{host}:{port}", flush=True)
+    await asyncio.Event().wait()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8600)
+    parser.add_argument("--cache-entries", type=int, default=CACHE_ENTRIES, help="0 disables the response cache")
+    parser.add_argument("--ttl", type=float, default=CACHE_TTL)
+    args = parser.parse_args()
+    asyncio.run(serve(args.host, args.port, args.cache_entries, args.ttl))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,685 @@
+"""
+Performance benchmarks of the dashboard as a whole: cold start, reads under
+concurrent writes, the aggregate API under load, the background warm-up,
+startup of each page in a fresh process and the suite of every page. The
+benchmarks of each feature's data structures are pytest-benchmark tests in
+tests/benchmarks/.
+
+Usage:
+    python benchmark.py cold-start [--db cars_db.sqlite] [--repeat 5]
+    python benchmark.py sqlite-stress [--rows 100000] [--readers 8] [--seconds 10]
+    python benchmark.py api [--rows 100000] [--clients 16] [--seconds 10]
+    python benchmark.py warmup [--rows 100000] [--repeat 3]
+    python benchmark.py startup [--rows 100000] [--repeat 5]
+    python benchmark.py suite [--rows 100000 1000000] [--repeat 3] [--output suite.json] [--compare baseline.json]
+"""
+import argparse
+import datetime
+import glob
+import json
+import platform
+import os
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+import utils
+from synthetic import iter_synthetic, synthetic_frame, write_synthetic_db
+
+# Entry points of the dashboard, relative to this directory
+ENTRY_POINTS = ["App.py", "pages/1_📈_Models.py", "pages/2_💰_Price_Analysis.py", "pages/3_🔎_Deals.py", "pages/4_📉_Market_Trends.py", "pages/5_📍_Locations.py", "pages/6_🔗_Correlations.py"]
+
+# Startup budget of each entry point in a fresh process, in seconds:
+# (modules imported by its first run, whole first run), measured with
+# "startup --rows 100000" plus 25% headroom
+STARTUP_BUDGET = {
+    "App.py": (1.8, 4.8),
+    "pages/1_📈_Models.py": (1.1, 1.6),
+    "pages/2_💰_Price_Analysis.py": (2.5, 3.9),
+    "pages/3_🔎_Deals.py": (0.9, 1.4),
+    "pages/4_📉_Market_Trends.py": (1.3, 3.3),
+    "pages/5_📍_Locations.py": (2.4, 3.2),
+    "pages/6_🔗_Correlations.py": (1.6, 3.3),
+}
+
+# A suite step slower than this many times its baseline is a regression
+SUITE_TOLERANCE = 1.25
+
+# Runs one entry point in AppTest; its imports are the ones logged after the marker
+STARTUP_PROBE = """
+import sys, time
+from streamlit.testing.v1 import AppTest
+test = AppTest.from_file(sys.argv[1], default_timeout=600)
+sys.stderr.write("startup-probe: first run\\n")
+sys.stderr.flush()
+start = time.perf_counter()
+test.run()
+print(time.perf_counter() - start, len(test.exception))
+"""
+
+# Writer of the SQLite stress test, in its own process: upserts batches of
+# listings into the Cars table like the scraper until the time is up, then
+# prints the batches committed and the batches that failed on a locked database
+STRESS_WRITER = """
+import sqlite3, sys, time
+from synthetic import synthetic_frame
+from utils import COLUMNS
+path, seconds, batch = sys.argv[1], float(sys.argv[2]), int(sys.argv[3])
+rows = synthetic_frame(batch, seed=1).astype(object).where(lambda frame: frame.notna(), None)
+columns = COLUMNS + ["createdAt", "updatedAt"]
+upsert = (f"INSERT INTO Cars ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))}) "
+          "ON CONFLICT(link) DO UPDATE SET price = excluded.price, updatedAt = excluded.updatedAt")
+conn = sqlite3.connect(path)
+committed = failed = 0
+end = time.perf_counter() + seconds
+while time.perf_counter() < end:
+    stamp = time.strftime("%Y-%m-%d %H:%M:%S.000 +00:00", time.gmtime())
+    links = [f"stress-{committed + failed}-{i}" for i in range(batch)]
+    values = [[link, *row[1:], stamp, stamp] for link, row in zip(links, rows[COLUMNS].itertuples(index=False))]
+    try:
+        with conn:
+            conn.executemany(upsert, values)
+        committed += 1
+    except sqlite3.OperationalError:
+        failed += 1
+print(committed, failed)
+"""
+
+
+def timed(fn, repeat):
+    """
+    Run fn `repeat` times and return the median wall time in seconds.
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def bench_cold_start(db_path, repeat):
+    """
+    Compare a cold start through pd.read_sql + clean_data with a cold start
+    from the memory-mapped Arrow snapshot.
+    """
+    def from_sqlite():
+        conn = sqlite3.connect(db_path)
+        data = pd.read_sql(f"SELECT {', '.join(utils.COLUMNS)} FROM cars", conn)
+        conn.close()
+        return utils.clean_data(data)
+
+    def from_snapshot():
+        return utils.IncrementalLoader(db_path).refresh()
+
+    # Make sure the snapshot exists and is up to date before timing it
+    from_snapshot()
+
+    results = {
+        "sqlite + clean_data": timed(from_sqlite, repeat),
+        "arrow snapshot": timed(from_snapshot, repeat),
+    }
+    for name, seconds in results.items():
+        print(f"{name:<24} {seconds * 1000:10.1f} ms")
+    return results
+
+
+def bench_sqlite_stress(rows, readers, seconds):
+    """
+    Read latency of the dashboard's queries from `readers` threads while a
+    writer process upserts listings continuously, with the previous read path
+    (rollback journal, a new connection per read) and with db.py's (WAL,
+    pooled read-only connections, retried when busy). Fails when a read
+    fails with db.py's path.
+    """
+    import logging
+    import shutil
+    import threading
+    import db
+
+    # The pool's cache warns on every read from a thread outside a Streamlit session
+    logging.getLogger("streamlit.runtime.scriptrunner_utils.script_run_context").setLevel(logging.ERROR)
+    here = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [here, os.environ.get("PYTHONPATH")])))
+
+    def new_connection(path, sql, params):
+        conn = sqlite3.connect(path)
+        try:
+            return conn.execute(sql, params).fetchall()
+        finally:
+            conn.close()
+
+    with tempfile.TemporaryDirectory() as directory:
+        base = os.path.join(directory, "base.sqlite")
+        write_synthetic_db(base, iter_synthetic(rows))
+        utils.ensure_indexes.__wrapped__(base)
+        paths = {name: os.path.join(directory, f"{name}.sqlite") for name in ["rollback", "wal"]}
+        for path in paths.values():
+            shutil.copy(base, path)
+
+        # The queries of the pages and of the incremental loader
+        data = utils.clean_data(pd.read_sql(f"SELECT {', '.join(utils.COLUMNS)} FROM cars", sqlite3.connect(base)))
+        brand = data["brand"].value_counts().index[0]
+        model = data.loc[data["brand"] == brand, "model"].value_counts().index[0]
+        eligible = utils.eligible_values.__wrapped__(paths["wal"], None)
+        queries = []
+        for filters in [dict(brand=brand, model=model), dict(brand=brand), dict(date_range=(data["date"].max() - pd.Timedelta(days=30), data["date"].max()))]:
+            where, params = utils.build_where(eligible, **filters)
+            queries.append((f"SELECT COUNT(*), MIN(date), MAX(date), MIN(price), MAX(price) FROM cars WHERE {where}", params))
+            queries.append((f"SELECT DISTINCT year FROM cars WHERE {where}", params))
+        where, params = utils.build_where(eligible, brand=brand, model=model)
+        queries.append((f"SELECT {', '.join(utils.COLUMNS)} FROM cars WHERE {where} ORDER BY id", params))
+        # The loader's refresh: the rows written since the run started
+        watermark = time.strftime("%Y-%m-%d %H:%M:%S.000 +00:00", time.gmtime())
+        queries.append((f"SELECT {', '.join(utils.COLUMNS)}, updatedAt FROM cars WHERE updatedAt >= ?", [watermark]))
+
+        modes = [
+            ("rollback journal, new connection per read", paths["rollback"], new_connection),
+            ("WAL, pooled read-only connections", paths["wal"], db.fetch_all),
+        ]
+        for name, path, run in modes:
+            if run is db.fetch_all:
+                db.enable_wal(path)
+            writer = subprocess.Popen([sys.executable, "-c", STRESS_WRITER, path, str(seconds), "200"], cwd=directory, env=env,
+                                      stdout=subprocess.PIPE, text=True)
+            latencies, errors = [], []
+            lock = threading.Lock()
+            end = time.perf_counter() + seconds
+
+            def reader(number):
+                done, failed = [], []
+                while time.perf_counter() < end:
+                    sql, params = queries[(number + len(done) + len(failed)) % len(queries)]
+                    started = time.perf_counter()
+                    try:
+                        run(path, sql, params)
+                        done.append(time.perf_counter() - started)
+                    except sqlite3.OperationalError as error:
+                        failed.append(str(error))
+                with lock:
+                    latencies.extend(done)
+                    errors.extend(failed)
+
+            threads = [threading.Thread(target=reader, args=(number,)) for number in range(readers)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            committed, failed = map(int, writer.communicate()[0].split())
+            p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) * 1000 if latencies else (np.nan,) * 3
+            print(f"{name:<44} {len(latencies):>6} reads  p50 {p50:7.1f} ms  p95 {p95:7.1f} ms  p99 {p99:7.1f} ms  "
+                  f"max {max(latencies, default=np.nan) * 1000:7.1f} ms  {len(errors)} failed reads  "
+                  f"writer: {committed} batches committed, {failed} failed")
+            if errors:
+                print(f"{'':<44} {errors[0]}")
+            if run is db.fetch_all and errors:
+                raise AssertionError(f"{len(errors)} reads failed with the pooled WAL read path: {errors[0]}")
+        db.get_pool(paths["wal"]).close()
+
+
+def bench_api(rows, clients, seconds):
+    """
+    Load test of api.py on a synthetic database of `rows` listings: requests
+    per second and latency of `clients` concurrent clients cycling through a
+    mix of summary, quantile and listing queries for `seconds`, without the
+    response cache, with it, and with conditional requests (If-None-Match).
+    Fails when a cached response differs from the computed one, when a
+    matching ETag does not get a 304, or when a write to the database does not
+    change the responses.
+    """
+    import asyncio
+    import socket
+    import tornado.httpclient
+    import ingest
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [here, os.environ.get("PYTHONPATH")])))
+
+    def start(directory, *options):
+        with socket.socket() as probe:
+            probe.bind(("127.0.0.1", 0))
+            port = probe.getsockname()[1]
+        server = subprocess.Popen([sys.executable, os.path.join(here, "api.py"), "--port", str(port), *options], cwd=directory, env=env,
+                                  stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+        # Printed once the dataset is loaded
+        if "serving on" not in server.stdout.readline():
+            server.kill()
+            raise AssertionError("api.py did not start")
+        return server, f"http://127.0.0.1:{port}"
+
+    async def load(base, paths, conditional):
+        client = tornado.httpclient.AsyncHTTPClient(force_instance=True, max_clients=clients)
+        etags, latencies, statuses = {}, [], {}
+        end = time.perf_counter() + seconds
+
+        async def run(number):
+            count = 0
+            while time.perf_counter() < end:
+                path = paths[(number * 7 + count) % len(paths)]
+                count += 1
+                headers = {"If-None-Match": etags[path]} if conditional and path in etags else {}
+                started = time.perf_counter()
+                response = await client.fetch(base + path, headers=headers, raise_error=False)
+                latencies.append(time.perf_counter() - started)
+                statuses[response.code] = statuses.get(response.code, 0) + 1
+                if response.code == 200:
+                    etags[path] = response.headers["ETag"]
+
+        started = time.perf_counter()
+        await asyncio.gather(*[run(number) for number in range(clients)])
+        elapsed = time.perf_counter() - started
+        client.close()
+        return len(latencies) / elapsed, np.percentile(latencies, [50, 99]) * 1000, statuses
+
+    async def fetch_all(base, paths, headers=None):
+        client = tornado.httpclient.AsyncHTTPClient(force_instance=True)
+        try:
+            return {path: await client.fetch(base + path, headers=headers or {}, raise_error=False) for path in paths}
+        finally:
+            client.close()
+
+    with tempfile.TemporaryDirectory() as directory:
+        frame = synthetic_frame(rows)
+        write_synthetic_db(os.path.join(directory, utils.DB_PATH), frame)
+        cleaned = utils.clean_data(frame)
+        top = cleaned.groupby(["brand", "model"], observed=True).size().nlargest(6).index
+        last = cleaned["date"].max()
+        paths = ["/version", "/summary?by=brand", "/summary?by=model"]
+        for days in [7, 30, 90, 365]:
+            start_day = (last - pd.Timedelta(days=days)).strftime("%Y-%m-%d")
+            paths += [f"/summary?by=brand&from={start_day}&to={last:%Y-%m-%d}", f"/summary?by=model&from={start_day}&to={last:%Y-%m-%d}&min_price=100&max_price=900"]
+        for brand, model in top:
+            paths += [f"/quantiles?brand={brand}", f"/quantiles?model={model}", f"/quantiles?model={model}&year=2018&metric=mileage",
+                      f"/listings?brand={brand}&model={model}&limit=50", f"/listings?model={model}&min_price=100&max_price=500&offset=50&limit=50"]
+
+        servers = {}
+        try:
+            servers["no cache"] = start(directory, "--cache-entries", "0")
+            servers["cache"] = start(directory)
+            computed = asyncio.run(fetch_all(servers["no cache"][1], paths))
+            for path, response in computed.items():
+                if response.code != 200:
+                    raise AssertionError(f"{path}: HTTP {response.code} {response.body[:200]!r}")
+            # Fills the cache: the cached runs measure warm responses
+            asyncio.run(fetch_all(servers["cache"][1], paths))
+            cached = asyncio.run(fetch_all(servers["cache"][1], paths))
+            for path in paths:
+                if cached[path].body != computed[path].body or cached[path].headers["ETag"] != computed[path].headers["ETag"]:
+                    raise AssertionError(f"{path}: the cached response differs from the computed one")
+
+            for name, conditional in [("no cache", False), ("cache", False), ("cache", True)]:
+                rate, (p50, p99), statuses = asyncio.run(load(servers[name][1], paths, conditional))
+                label = f"{name}{', If-None-Match' if conditional else ''}"
+                print(f"{rows:>10} rows  {label:<22} {rate:8.1f} requests/s  p50 {p50:7.1f} ms  p99 {p99:7.1f} ms  "
+                      f"{', '.join(f'{count} x {code}' for code, count in sorted(statuses.items()))}")
+
+            revalidated = asyncio.run(fetch_all(servers["cache"][1], paths[:1], {"If-None-Match": cached[paths[0]].headers["ETag"]}))
+            if revalidated[paths[0]].code != 304 or revalidated[paths[0]].body:
+                raise AssertionError(f"a matching ETag got HTTP {revalidated[paths[0]].code}")
+
+            # A write gives a new version: new responses and ETags
+            repriced = frame[frame["link"].isin(cleaned["link"])].head(100).assign(price=lambda listings: listings["price"] + 10)
+            ingest.ingest_frame(repriced, os.path.join(directory, utils.DB_PATH))
+            updated = asyncio.run(fetch_all(servers["cache"][1], ["/version", "/summary?by=brand"]))
+            for path, response in updated.items():
+                if response.headers["ETag"] == cached[path].headers["ETag"]:
+                    raise AssertionError(f"{path}: still served after a write to the database")
+        finally:
+            for server, _ in servers.values():
+                server.kill()
+                server.wait()
+
+
+def bench_warmup(rows, repeat):
+    """
+    Time to first render after a data refresh, with the background warm-up
+    off, then on. A running server (App.py rendered once) gets 1% of its
+    listings repriced, then a new session opens App.py and drills down to
+    the most listed model of the last month on the Models page; with the
+    warm-up on, the session arrives once the warm-up of the new version is
+    done. Also checks that a new version cancels the tasks still queued for
+    the previous one and that no task starts past the budget. Fails when the
+    warmed session misses the chart cache or the summary tables, or is not
+    faster than without warm-up.
+    """
+    import streamlit as st
+    from streamlit.testing.v1 import AppTest
+    import ingest
+    import warmup
+
+    here = os.path.dirname(os.path.abspath(__file__))
+
+    def wait_for(condition, timeout, what):
+        deadline = time.perf_counter() + timeout
+        while not condition():
+            if time.perf_counter() > deadline:
+                raise AssertionError(f"timed out waiting for {what}")
+            time.sleep(0.05)
+
+    def run(entry, *selections):
+        test = AppTest.from_file(os.path.join(here, entry), default_timeout=600).run()
+        for position, value in enumerate(selections):
+            test.selectbox[position].select(value).run()
+        if test.exception:
+            raise AssertionError(f"{entry}: {test.exception[0].message}")
+
+    def session(enabled, round_number, frame):
+        # Seconds of App.py and of the Models page drill-down for a session
+        # arriving after a refresh, and the cache counters of each
+        st.cache_resource.clear()
+        st.cache_data.clear()
+        warmup.stop_warmup()
+        warmup.WARMUP = enabled
+        run(ENTRY_POINTS[0])
+        data = utils.get_dataset().frame
+        last = data["date"].max()
+        window = data[data["date"] >= last - pd.DateOffset(months=1)]
+        brand, model = window.groupby(["brand", "model"], observed=True).size().sort_values(ascending=False, kind="stable").index[0]
+        if enabled:
+            warm = warmup.start_warmup()
+            wait_for(lambda: warm.runs and warm.idle(), warmup.WARMUP_POLL + warmup.WARMUP_BUDGET + 60, "the first warm-up")
+            before = warm.runs[-1]["version"]
+        # Prices no earlier session wrote: unchanged listings are not written, so there would be no new version
+        increase = round_number + 1 + (repeat if enabled else 0)
+        repriced = frame.sample(frac=0.01, random_state=round_number).assign(price=lambda listings: listings["price"] + increase)
+        ingest.ingest_frame(repriced, utils.DB_PATH)
+        if enabled:
+            wait_for(lambda: warm.runs[-1]["version"] != before and warm.idle(), warmup.WARMUP_POLL + warmup.WARMUP_BUDGET + 60,
+                     "the warm-up of the new version")
+        seconds, counts = {}, {}
+        for name, entry, selections in [("App", ENTRY_POINTS[0], ()), ("Models", ENTRY_POINTS[1], (brand, model))]:
+            start_counts = warmup.cache_counts()
+            started = time.perf_counter()
+            run(entry, *selections)
+            seconds[name] = time.perf_counter() - started
+            end_counts = warmup.cache_counts()
+            counts[name] = {key: end_counts[key] - start_counts[key] for key in end_counts}
+        return seconds, counts, f"{brand} {model}"
+
+    cwd = os.getcwd()
+    saved = warmup.WARMUP, warmup.WARMUP_POLL
+    with tempfile.TemporaryDirectory() as directory:
+        frame = synthetic_frame(rows)
+        write_synthetic_db(os.path.join(directory, utils.DB_PATH), frame)
+        os.chdir(directory)
+        try:
+            warmup.WARMUP_POLL = 0.2
+            results = {}
+            for enabled in [False, True]:
+                rounds = [session(enabled, number, frame) for number in range(repeat)]
+                results[enabled] = rounds
+                label = "warm-up on" if enabled else "warm-up off"
+                for name in ["App", "Models"]:
+                    median = statistics.median(seconds[name] for seconds, _, _ in rounds)
+                    counts = {key: sum(round_counts[name][key] for _, round_counts, _ in rounds) for key in rounds[0][1][name]}
+                    print(f"{rows:>10} rows  {label:<12} {name:<7} first render {median * 1000:8.1f} ms  "
+                          f"chart hits {counts['chart hits']:>3} / misses {counts['chart misses']:>3}  "
+                          f"summary hits {counts['summary hits']:>3} / misses {counts['summary misses']:>3}"
+                          + (f"  ({rounds[0][2]})" if name == "Models" else ""))
+            # The metrics of the last warmed session's process, as the debug panel shows them
+            runs, report = warmup.start_warmup().report()
+            print(runs.to_string(index=False))
+            print(report.to_string())
+
+            for seconds, counts, model in results[True]:
+                if counts["Models"]["chart misses"] or counts["App"]["summary misses"]:
+                    raise AssertionError(f"the session after the warm-up missed the caches: {counts}")
+            for name in ["App", "Models"]:
+                off = statistics.median(seconds[name] for seconds, _, _ in results[False])
+                on = statistics.median(seconds[name] for seconds, _, _ in results[True])
+                if on >= off:
+                    raise AssertionError(f"{name}: first render takes {on * 1000:.0f} ms with the warm-up, {off * 1000:.0f} ms without")
+
+            # Cancellation and budget, on warm-ups of their own (polling every hour)
+            warmup.stop_warmup()
+            cancelled = warmup.Warmup(workers=1, poll=3600)
+            cancelled.start()
+            first, second = cancelled.schedule("first"), cancelled.schedule("second")
+            wait_for(cancelled.idle, warmup.WARMUP_BUDGET + 60, "the cancellation test")
+            if first["cancelled"] == 0 or first["done"] > 1 or second["done"] != second["tasks"]:
+                raise AssertionError(f"a new version did not cancel the queued tasks: {first}, {second}")
+            cancelled.stop()
+            over = warmup.Warmup(workers=1, budget=0, poll=3600)
+            over.start()
+            exhausted = over.schedule("over budget")
+            wait_for(over.idle, 60, "the budget test")
+            if exhausted["done"] or exhausted["over budget"] != exhausted["tasks"]:
+                raise AssertionError(f"tasks started past the budget: {exhausted}")
+            over.stop()
+            print(f"{rows:>10} rows  a new version cancelled {first['cancelled']} of {first['tasks']} queued tasks; "
+                  f"a zero budget started none of {exhausted['tasks']}")
+        finally:
+            warmup.stop_warmup()
+            warmup.WARMUP, warmup.WARMUP_POLL = saved
+            os.chdir(cwd)
+            st.cache_resource.clear()
+
+
+def bench_startup(rows, repeat):
+    """
+    First run of each entry point in a fresh Python process (as a new worker
+    serves it), on a synthetic database of `rows` listings whose snapshots are
+    already written: seconds spent importing modules, from
+    `python -X importtime`, and seconds of the whole first run. Fails when
+    either median is over STARTUP_BUDGET.
+    """
+    here = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [here, os.environ.get("PYTHONPATH")])))
+
+    def first_run(entry, directory):
+        result = subprocess.run([sys.executable, "-X", "importtime", "-c", STARTUP_PROBE, os.path.join(here, entry)],
+                                cwd=directory, env=env, capture_output=True, text=True, check=True)
+        seconds, exceptions = result.stdout.split()[-2:]
+        if int(exceptions):
+            raise AssertionError(f"{entry} raised an exception on its first run")
+        log = result.stderr.split("startup-probe: first run\n", 1)[1]
+        # Top-level imports only: their cumulative time includes the nested ones
+        imports = []
+        for line in log.splitlines():
+            if line.startswith("import time:") and not line.startswith("import time: self"):
+                _, cumulative, name = line[len("import time:"):].split("|")
+                if not name.startswith("  "):
+                    imports.append((int(cumulative) / 1e6, name.strip()))
+        return float(seconds), imports
+
+    breaches = []
+    with tempfile.TemporaryDirectory() as directory:
+        write_synthetic_db(os.path.join(directory, utils.DB_PATH), iter_synthetic(rows))
+        for entry in ENTRY_POINTS:
+            # Writes the snapshots, as the previous worker would have
+            first_run(entry, directory)
+            runs = [first_run(entry, directory) for _ in range(repeat)]
+            render = statistics.median(seconds for seconds, _ in runs)
+            imported = statistics.median(sum(cost for cost, _ in imports) for _, imports in runs)
+            heaviest = sorted(runs[-1][1], reverse=True)[:3]
+            import_budget, render_budget = STARTUP_BUDGET[entry]
+            print(f"{entry:<32} imports {imported:6.2f} s (budget {import_budget:.1f})  first run {render:6.2f} s (budget {render_budget:.1f})")
+            print(f"{'':<32} heaviest: {', '.join(f'{name} {cost:.2f} s' for cost, name in heaviest)}")
+            if imported > import_budget:
+                breaches.append(f"{entry}: imports take {imported:.2f} s, budget is {import_budget} s")
+            if render > render_budget:
+                breaches.append(f"{entry}: first run takes {render:.2f} s, budget is {render_budget} s")
+    if breaches:
+        raise AssertionError("startup budget exceeded:\n" + "\n".join(breaches))
+
+
+def bench_suite(row_counts, repeat, output, compare):
+    """
+    The data path and every page on a synthetic database of each size:
+    loading (from SQLite, then from the snapshots), clean_data, the rollup and
+    its summary tables, then each page's first run and filter chain in
+    AppTest with empty caches. The median of each step is written to
+    `output` as JSON; with `compare`, a step more than SUITE_TOLERANCE times
+    slower than in that earlier result fails the suite.
+    """
+    import streamlit as st
+    from streamlit.testing.v1 import AppTest
+    import rollups
+    import warmup
+
+    # Every step starts from empty caches, which a background warm-up would fill
+    warmup.WARMUP = False
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    results = []
+
+    def record(rows, step, seconds):
+        results.append({"rows": rows, "step": step, "seconds": seconds})
+        print(f"{rows:>10} rows  {step:<36} {seconds * 1000:10.1f} ms")
+
+    def pages(top_brand, top_model):
+        # One pass over every page, with the process-wide caches emptied first
+        st.cache_resource.clear()
+        st.cache_data.clear()
+        steps = {}
+
+        def step(name, run):
+            start = time.perf_counter()
+            test = run()
+            steps[name] = time.perf_counter() - start
+            if test.exception:
+                raise AssertionError(f"{name}: {test.exception[0].message}")
+            return test
+
+        app = step("App: first run", lambda: AppTest.from_file(os.path.join(here, ENTRY_POINTS[0]), default_timeout=600).run())
+        step("App: rerun", app.run)
+        first_day = app.sidebar.date_input[0].value
+        step("App: date range", lambda: app.sidebar.date_input[0].set_value(first_day - datetime.timedelta(days=365)).run())
+        models = step("Models: first run", lambda: AppTest.from_file(os.path.join(here, ENTRY_POINTS[1]), default_timeout=600).run())
+        step("Models: brand", lambda: models.selectbox[0].select(top_brand).run())
+        step("Models: model", lambda: models.selectbox[1].select(top_model).run())
+        price = step("Price Analysis: first run", lambda: AppTest.from_file(os.path.join(here, ENTRY_POINTS[2]), default_timeout=600).run())
+        low, high = price.sidebar.slider[0].value
+        step("Price Analysis: price range", lambda: price.sidebar.slider[0].set_value((low + (high - low) // 10, high - (high - low) // 2)).run())
+        deals = step("Deals: first run", lambda: AppTest.from_file(os.path.join(here, ENTRY_POINTS[3]), default_timeout=600).run())
+        step("Deals: brand", lambda: deals.sidebar.selectbox[0].select(top_brand).run())
+        step("Deals: model", lambda: deals.sidebar.selectbox[1].select(top_model).run())
+        step("Deals: deduplicated", lambda: deals.sidebar.checkbox[0].check().run())
+        trends = step("Market Trends: first run", lambda: AppTest.from_file(os.path.join(here, ENTRY_POINTS[4]), default_timeout=600).run())
+        step("Market Trends: model level", lambda: trends.sidebar.radio[0].set_value("Model").run())
+        step("Market Trends: brand", lambda: trends.sidebar.selectbox[0].select(top_brand).run())
+        step("Market Trends: model", lambda: trends.sidebar.selectbox[1].select(top_model).run())
+        step("Market Trends: weekly", lambda: trends.sidebar.radio[1].set_value("Weekly").run())
+        locations = step("Locations: first run", lambda: AppTest.from_file(os.path.join(here, ENTRY_POINTS[5]), default_timeout=600).run())
+        step("Locations: brand", lambda: locations.sidebar.selectbox[0].select(top_brand).run())
+        step("Locations: deduplicated", lambda: locations.sidebar.checkbox[0].check().run())
+        correlations = step("Correlations: first run", lambda: AppTest.from_file(os.path.join(here, ENTRY_POINTS[6]), default_timeout=600).run())
+        step("Correlations: brand", lambda: correlations.sidebar.selectbox[0].select(top_brand).run())
+        step("Correlations: model", lambda: correlations.sidebar.selectbox[1].select(top_model).run())
+        step("Correlations: deduplicated", lambda: correlations.sidebar.checkbox[0].check().run())
+        return steps
+
+    for rows in row_counts:
+        with tempfile.TemporaryDirectory() as directory:
+            db_path = os.path.join(directory, utils.DB_PATH)
+            write_synthetic_db(db_path, iter_synthetic(rows))
+
+            def from_sqlite():
+                for path in glob.glob(os.path.join(directory, "*.arrow")):
+                    os.remove(path)
+                return utils.IncrementalLoader(db_path).refresh()
+
+            record(rows, "load: SQLite", timed(from_sqlite, repeat))
+            record(rows, "load: snapshot", timed(lambda: utils.IncrementalLoader(db_path).refresh(), repeat))
+            conn = sqlite3.connect(db_path)
+            raw = pd.read_sql(f"SELECT {', '.join(utils.COLUMNS)} FROM cars", conn)
+            conn.close()
+            record(rows, "clean_data", timed(lambda: utils.clean_data(raw), repeat))
+            cleaned = utils.IncrementalLoader(db_path).refresh()
+
+            def build_rollup():
+                # Without its cache of summary tables, which the table steps time
+                rollup = rollups.Rollup(summary_entries=0)
+                rollup.update(cleaned, "suite")
+                return rollup
+
+            record(rows, "rollup: build", timed(build_rollup, repeat))
+            rollup = build_rollup()
+            for by in rollups.SUMMARY_BY:
+                record(rows, f"rollup: {by} table", timed(lambda: rollup.summary(by), repeat))
+
+            top_brand = cleaned["brand"].value_counts().index[0]
+            top_model = cleaned.loc[cleaned["brand"] == top_brand, "model"].value_counts().index[0]
+            cwd = os.getcwd()
+            os.chdir(directory)
+            try:
+                if rows == row_counts[0]:
+                    # Imports the pages' modules, which "startup" measures
+                    pages(top_brand, top_model)
+                passes = [pages(top_brand, top_model) for _ in range(repeat)]
+            finally:
+                os.chdir(cwd)
+                st.cache_resource.clear()
+            for name in passes[0]:
+                record(rows, name, statistics.median(steps[name] for steps in passes))
+
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=here, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    with open(output, "w") as file:
+        json.dump({
+            "commit": commit,
+            "created": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "repeat": repeat,
+            "results": results,
+        }, file, indent=1)
+    print(f"results written to {output}")
+
+    if compare is not None:
+        with open(compare) as file:
+            baseline = json.load(file)
+        before = {(result["rows"], result["step"]): result["seconds"] for result in baseline["results"]}
+        regressions = []
+        print(f"compared with {compare} (commit {baseline.get('commit')})")
+        for result in results:
+            old = before.get((result["rows"], result["step"]))
+            if old is None:
+                continue
+            ratio = result["seconds"] / old if old else float("inf")
+            print(f"{result['rows']:>10} rows  {result['step']:<36} x{ratio:5.2f}")
+            if ratio > SUITE_TOLERANCE:
+                regressions.append(f"{result['step']} at {result['rows']} rows: {old * 1000:.1f} ms -> {result['seconds'] * 1000:.1f} ms")
+        if regressions:
+            raise AssertionError("slower than the baseline:\n" + "\n".join(regressions))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("benchmark", choices=["cold-start", "sqlite-stress", "api", "warmup", "startup", "suite"])
+    parser.add_argument("--db", default=utils.DB_PATH)
+    parser.add_argument("--rows", type=int, nargs="+", default=[100_000, 1_000_000, 5_000_000])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--readers", type=int, default=8, help="sqlite-stress: reader threads")
+    parser.add_argument("--seconds", type=float, default=10, help="sqlite-stress, api: duration of each run")
+    parser.add_argument("--clients", type=int, default=16, help="api: concurrent clients")
+    parser.add_argument("--output", default="suite.json", help="suite: JSON file of the results")
+    parser.add_argument("--compare", help="suite: earlier JSON results to compare with")
+    args = parser.parse_args()
+
+    if args.benchmark == "cold-start":
+        if not os.path.exists(args.db):
+            parser.error(f"database not found: {args.db}")
+        bench_cold_start(args.db, args.repeat)
+    elif args.benchmark == "sqlite-stress":
+        bench_sqlite_stress(args.rows[0], args.readers, args.seconds)
+    elif args.benchmark == "api":
+        bench_api(args.rows[0], args.clients, args.seconds)
+    elif args.benchmark == "warmup":
+        bench_warmup(args.rows[0], args.repeat)
+    elif args.benchmark == "startup":
+        bench_startup(args.rows[0], args.repeat)
+    elif args.benchmark == "suite":
+        bench_suite(args.rows, args.repeat, args.output, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""
+Cached rendering of the matplotlib/seaborn charts.
+
+A chart is drawn by a function `draw(ax, *args, **kwargs)`; its PNG is cached
+under a fingerprint of the function, of its arguments (DataFrames and Series
+are hashed by content) and of the figure size. A rerun in which a chart's
+inputs did not change serves the cached PNG without drawing anything. The cache
+is shared by all sessions and evicts the least recently used charts beyond
+CHART_CACHE_BYTES. Figures are created without pyplot, so no global figure is
+left open (or shared between the sessions' threads) after rendering, and
+matplotlib is only imported once a chart has to be drawn.
+"""
+import hashlib
+import io
+import threading
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from instrumentation import section
+
+# Memory budget of the rendered charts
+CHART_CACHE_BYTES = 64 * 2**20
+
+# Same rendering as st.pyplot
+CHART_DPI = 200
+
+# Widest image st.image displays as is (streamlit's MAXIMUM_CONTENT_WIDTH):
+# wider charts would be scaled down and encoded again on every rerun
+CHART_MAX_WIDTH = 1460
+
+def show_chart(draw, *args, figsize=None, name=None, **kwargs):
+    """
+    Display the chart drawn by draw(ax, *args, **kwargs), from the cache when
+    the same chart was already rendered. Everything the chart depends on must
+    be passed as an argument (pass only the columns it uses: they are hashed).
+    The rendering is timed as the section `name` (default: the function's name).
+    """
+    rows = next((arg for arg in args if isinstance(arg, (pd.DataFrame, pd.Series))), None)
+    with section(f"chart: {name or draw.__name__}", rows):
+        st.image(render_chart(draw, *args, figsize=figsize, **kwargs), use_container_width=True)
+
+def render_chart(draw, *args, figsize=None, **kwargs):
+    """
+    PNG bytes of the chart drawn by draw(ax, *args, **kwargs) (see show_chart).
+    """
+    cache = _chart_cache()
+    key = fingerprint(_function_key(draw), figsize, args, kwargs)
+    png = cache.get(key)
+    if png is None:
+        from matplotlib.figure import Figure
+
+        fig = Figure(figsize=figsize)
+        draw(fig.subplots(), *args, **kwargs)
+        buffer = io.BytesIO()
+        dpi = min(CHART_DPI, CHART_MAX_WIDTH / fig.get_figwidth())
+        fig.savefig(buffer, format="png", dpi=dpi, bbox_inches="tight")
+        png = buffer.getvalue()
+        cache.put(key, png)
+    return png
+
+def _function_key(draw):
+    # Pages re-execute on every rerun and may define functions with the same
+    # name: identify a draw function by its file, name and compiled code
+    code = getattr(draw, "__code__", None)
+    if code is None:
+        return f"{draw.__module__}.{draw.__qualname__}"
+    return (code.co_filename, draw.__qualname__, code.co_code, code.co_consts)
+
+def fingerprint(*values):
+    """
+    Hash of nested values: DataFrames, Series and arrays by content, the
+    other values by their repr.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    _feed(digest, values)
+    return digest.hexdigest()
+
+def _feed(digest, value):
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        digest.update(repr((type(value).__name__, list(value.dtypes.astype(str)) if isinstance(value, pd.DataFrame) else str(value.dtype),
+                            list(value.columns) if isinstance(value, pd.DataFrame) else value.name, len(value))).encode())
+        digest.update(pd.util.hash_pandas_object(value, index=False).to_numpy().tobytes())
+    elif isinstance(value, np.ndarray):
+        digest.update(repr((value.dtype.str, value.shape)).encode())
+        digest.update(np.ascontiguousarray(value).tobytes())
+    elif isinstance(value, dict):
+        digest.update(b"{")
+        for key in sorted(value, key=repr):
+            _feed(digest, key)
+            _feed(digest, value[key])
+        digest.update(b"}")
+    elif isinstance(value, (list, tuple)):
+        digest.update(b"(")
+        for item in value:
+            _feed(digest, item)
+        digest.update(b")")
+    else:
+        digest.update(repr(value).encode())
+        digest.update(b",")
+
+@st.cache_resource
+def _chart_cache():
+    return ChartCache(CHART_CACHE_BYTES)
+
+class ChartCache:
+    """
+    LRU cache of rendered charts, bounded by the total size of the PNGs.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._charts = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            png = self._charts.get(key)
+            if png is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._charts.move_to_end(key)
+            return png
+
+    def put(self, key, png):
+        with self._lock:
+            if key in self._charts:
+                return
+            self._charts[key] = png
+            self.size += len(png)
+            while self.size > self.max_bytes and len(self._charts) > 1:
+                _, evicted = self._charts.popitem(last=False)
+                self.size -= len(evicted)
+
+    def __len__(self):
+        return len(self._charts)
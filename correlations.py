@@ -0,0 +1,333 @@
+"""
+Correlations between the numeric columns of the listings and associations
+between their categorical columns, for the Correlations page.
+
+The listings are grouped in buckets (brand x model x month x price band) and
+every bucket keeps mergeable sufficient statistics: for each pair of NUMERIC
+columns, the count, sums, sums of squares and sum of products of its listings
+where both values are known, and the count of each combination of CATEGORICAL
+values (combinations are numbered as they appear, so a column can have any
+number of distinct values). These are integer sums (prices, mileages, years
+and displacements in cc are whole numbers, taken from a fixed reference
+value), so when the dataset version changes only the added, removed and
+modified listings are added to or subtracted from their buckets, exactly. A
+date/price window is answered from the buckets lying fully inside it plus the
+listings of its partially covered months and price bands (as the rollup does),
+and Pearson's r and Cramér's V follow from the merged sums: no query groups
+or sorts the listings.
+
+`engine` is parsed into a displacement once per distinct value.
+"""
+import itertools
+import re
+import threading
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from utils import factorize, get_dataset, get_incremental_loader, row_multiset_diff
+from dedup import get_duplicates
+
+NUMERIC = ["price", "mileage", "year", "displacement"]
+
+# Year is also a category, for its association with e.g. the gearbox
+CATEGORICAL = ["gearbox", "fuel", "paper", "color", "year"]
+
+# Price bands grow geometrically: BANDS_PER_OCTAVE bands per doubling of the price
+BANDS_PER_OCTAVE = 4
+BAND_EDGES = np.unique(np.ceil(2.0 ** (np.arange(40 * BANDS_PER_OCTAVE) / BANDS_PER_OCTAVE))).astype(np.int64)
+
+# Bits of the combination number in a (bucket, combination) key
+COMBINATION_BITS = 32
+
+# Sums kept for each pair of NUMERIC columns (x, y), a column with itself
+# being the pair of its known values
+PAIRS = list(itertools.combinations_with_replacement(range(len(NUMERIC)), 2))
+SUMS = ["n", "x", "y", "xx", "yy", "xy"]
+
+# Engine sizes, in liters or cc ("1.5 dCi", "2,0", "1600 cc")
+DISPLACEMENT_PATTERN = re.compile(r"\d+(?:[.,]\d+)?")
+
+@st.cache_resource
+def _shared_correlations(db_path, deduplicated):
+    return CorrelationStore()
+
+def get_correlations(deduplicated=False, dataset=None):
+    """
+    The process-wide correlation store (of the deduplicated listings when
+    asked, see dedup.py), brought up to date with `dataset` (the shared
+    dataset by default; pages pass the one they hold).
+    """
+    dataset = get_dataset() if dataset is None else dataset
+    store = _shared_correlations(get_incremental_loader().db_path, deduplicated)
+    if store.version != dataset.version:
+        store.update(dataset.frame.take(get_duplicates(dataset).kept) if deduplicated else dataset.frame, dataset.version)
+    return store
+
+class CorrelationStore:
+    """
+    Buckets are numbered in order of appearance: `pairs` maps (brand, model)
+    to the number of each pair, and `bucket_pair`, `bucket_month` (months
+    since 1970-01) and `bucket_band` describe each bucket. `sums` holds the
+    SUMS of every pair of NUMERIC columns per bucket. `combinations` maps the
+    codes of the CATEGORICAL values (1.. in order of appearance, 0 when
+    missing, see `levels`) to the number of each combination, whose codes are
+    the rows of `combination_codes`; `combination_keys` (sorted: bucket, then
+    combination number) and `combination_counts` hold the listings of each
+    combination per bucket.
+    """
+
+    def __init__(self):
+        self.version = None
+        self.rows = None
+        self.hashes = None
+        self.reference = None
+        self.pairs = {}
+        self.buckets = {}
+        self.levels = {column: {} for column in CATEGORICAL}
+        self.combinations = {}
+        self.combination_codes = np.zeros((0, len(CATEGORICAL)), dtype=np.int64)
+        self.bucket_pair = np.zeros(0, dtype=np.int64)
+        self.bucket_month = np.zeros(0, dtype=np.int64)
+        self.bucket_band = np.zeros(0, dtype=np.int64)
+        self.sums = np.zeros((0, len(PAIRS), len(SUMS)), dtype=np.int64)
+        self.combination_keys = np.zeros(0, dtype=np.int64)
+        self.combination_counts = np.zeros(0, dtype=np.int64)
+        self._lock = threading.Lock()
+
+    def update(self, cleaned, version):
+        with self._lock:
+            if version == self.version:
+                return
+            rows = self._correlation_rows(cleaned)
+            removed, added, hashes = row_multiset_diff(self.rows, rows, self.hashes)
+            self._accumulate(removed, -1)
+            self._accumulate(added, 1)
+            self.rows = rows
+            self.hashes = hashes
+            self.version = version
+
+    def _correlation_rows(self, cleaned):
+        # Day, price, bucket, NUMERIC values and combination of categories of
+        # each listing; new buckets and categories get a number
+        dates = cleaned["date"].to_numpy()
+        months = dates.astype("datetime64[M]").astype(np.int64)
+        prices = cleaned["price"].to_numpy(dtype=np.int64)
+        rows = pd.DataFrame({
+            "day": dates.astype("datetime64[D]").astype(np.int64),
+            "price": prices,
+            "bucket": self._bucket_ids(cleaned, months, _band(prices)),
+            "mileage": cleaned["mileage"].to_numpy(dtype=float, na_value=np.nan),
+            "year": cleaned["year"].to_numpy(dtype=float, na_value=np.nan),
+            "displacement": engine_displacement(cleaned["engine"]),
+        })
+        rows["combination"] = self._combination_ids(np.column_stack([self._level_codes(column, cleaned[column]) for column in CATEGORICAL]))
+        if self.reference is None:
+            # Sums are taken from these values, so they stay small
+            self.reference = np.array([np.nan_to_num(np.nanmedian(rows[column].to_numpy(dtype=float))) if len(rows) else 0
+                                       for column in NUMERIC]).round()
+        return rows
+
+    def _bucket_ids(self, cleaned, months, bands):
+        brand_codes, brands = factorize(cleaned["brand"])
+        model_codes, models = factorize(cleaned["model"])
+        first_month = months.min() if len(months) else 0
+        keys = ((brand_codes.astype(np.int64) * len(models) + model_codes) << 28) | ((months - first_month) << 8) | bands
+        keys, inverse = np.unique(keys, return_inverse=True)
+        pairs, months, bands = keys >> 28, (keys >> 8) % 2**20 + first_month, keys % 2**8
+        brands, models = np.asarray(brands, dtype=object), np.asarray(models, dtype=object)
+        ids = np.empty(len(keys), dtype=np.int64)
+        for i, (brand, model, month, band) in enumerate(zip(brands[pairs // len(models)], models[pairs % len(models)], months.tolist(), bands.tolist())):
+            pair = self.pairs.setdefault((brand, model), len(self.pairs))
+            ids[i] = self.buckets.setdefault((pair, month, band), len(self.buckets))
+        new = len(self.buckets) - len(self.bucket_pair)
+        if new:
+            described = np.array(list(itertools.islice(self.buckets, len(self.bucket_pair), None)), dtype=np.int64).reshape(-1, 3)
+            self.bucket_pair = np.concatenate([self.bucket_pair, described[:, 0]])
+            self.bucket_month = np.concatenate([self.bucket_month, described[:, 1]])
+            self.bucket_band = np.concatenate([self.bucket_band, described[:, 2]])
+            self.sums = np.concatenate([self.sums, np.zeros((new, len(PAIRS), len(SUMS)), dtype=np.int64)])
+        return ids[inverse]
+
+    def _level_codes(self, column, values):
+        # Code 1.. of each value of a CATEGORICAL column, 0 when missing
+        value_codes, values = factorize(values)
+        levels = self.levels[column]
+        codes = np.zeros(len(values) + 1, dtype=np.int64)
+        for i, value in enumerate(values.tolist()):
+            codes[i] = levels.setdefault(value, len(levels) + 1)
+        return codes[value_codes]
+
+    def _combination_ids(self, codes):
+        # Number of the combination of each row of `codes`; new combinations
+        # get a number. Distinct rows are found one column at a time
+        distinct = np.zeros(len(codes), dtype=np.int64)
+        for column in codes.T:
+            distinct = pd.factorize(distinct * (column.max(initial=0) + 1) + column)[0]
+        first = np.unique(distinct, return_index=True)[1]
+        ids = np.array([self.combinations.setdefault(combination, len(self.combinations))
+                        for combination in map(tuple, codes[first].tolist())], dtype=np.int64)
+        new = len(self.combinations) - len(self.combination_codes)
+        if new:
+            self.combination_codes = np.concatenate([self.combination_codes, np.array(list(self.combinations)[-new:], dtype=np.int64)])
+        return ids[distinct]
+
+    def _accumulate(self, rows, sign):
+        if rows.empty:
+            return
+        buckets = rows["bucket"].to_numpy()
+        # Whole numbers below 2**53 per bucket: the float sums are exact
+        self.sums += sign * np.rint(_pair_sums(self._values(rows), buckets, len(self.bucket_pair))).astype(np.int64)
+        keys, counts = np.unique((buckets << COMBINATION_BITS) | rows["combination"].to_numpy(), return_counts=True)
+        self.combination_keys, self.combination_counts = _add_counts(self.combination_keys, self.combination_counts, keys, sign * counts)
+
+    def _values(self, rows):
+        return rows[NUMERIC].to_numpy(dtype=float) - self.reference
+
+    def select(self, date_range=None, price_range=None, brand=None, model=None):
+        """
+        Merged statistics of the listings inside the date and price windows
+        (inclusive), of `brand` and `model` when given.
+        """
+        with self._lock:
+            selected = np.ones(len(self.pairs), dtype=bool)
+            if brand is not None or model is not None:
+                selected = np.array([(brand is None or pair_brand == brand) and (model is None or pair_model == model)
+                                     for pair_brand, pair_model in self.pairs])
+            selected = selected[self.bucket_pair]
+            inside = selected.copy()
+            days, prices = self.rows["day"].to_numpy(), self.rows["price"].to_numpy()
+            in_window = np.ones(len(self.rows), dtype=bool)
+            if date_range is not None:
+                start, end = (pd.Timestamp(day).to_datetime64().astype("datetime64[D]").astype(np.int64) for day in date_range)
+                month_start = self.bucket_month.astype("datetime64[M]").astype("datetime64[D]").astype(np.int64)
+                month_end = (self.bucket_month + 1).astype("datetime64[M]").astype("datetime64[D]").astype(np.int64) - 1
+                inside &= (month_start >= start) & (month_end <= end)
+                in_window &= (days >= start) & (days <= end)
+            if price_range is not None:
+                low, high = int(price_range[0]), int(price_range[1])
+                band_high = np.append(BAND_EDGES[1:] - 1, np.iinfo(np.int64).max)
+                inside &= (BAND_EDGES[self.bucket_band] >= low) & (band_high[self.bucket_band] <= high)
+                in_window &= (prices >= low) & (prices <= high)
+            # The listings of the partially covered months and bands
+            buckets = self.rows["bucket"].to_numpy()
+            edges = self.rows[in_window & selected[buckets] & ~inside[buckets]]
+            # Summed as integers: exact, whatever the order of the buckets
+            sums = self.sums[inside].sum(axis=0).astype(float) + _pair_sums(self._values(edges), np.zeros(len(edges), dtype=np.int64), 1)[0]
+            taken = inside[self.combination_keys >> COMBINATION_BITS]
+            combinations = np.concatenate([self.combination_keys[taken] % 2**COMBINATION_BITS, edges["combination"].to_numpy()])
+            counts = np.concatenate([self.combination_counts[taken], np.ones(len(edges), dtype=np.int64)])
+            levels = {column: {code: value for value, code in levels.items()} for column, levels in self.levels.items()}
+            return Selection(sums, combinations, counts, self.combination_codes, levels)
+
+class Selection:
+    """
+    Merged statistics of a selection of listings (see CorrelationStore.select).
+    """
+
+    def __init__(self, sums, combinations, counts, combination_codes, levels):
+        self.sums = sums
+        # The same combination from every bucket counted once, as the codes
+        # of its CATEGORICAL values
+        codes, combinations = pd.factorize(combinations)
+        self.counts = np.bincount(codes, weights=counts, minlength=len(combinations)).astype(np.int64)
+        self.codes = combination_codes[combinations]
+        self.levels = levels
+        self.count = int(counts.sum())
+
+    def pearson(self):
+        """
+        Pearson correlation of every pair of NUMERIC columns, over the listings
+        where both are known (as DataFrame.corr: NaN for a constant column).
+        """
+        n, x, y, xx, yy, xy = self.sums.T
+        with np.errstate(divide="ignore", invalid="ignore"):
+            correlations = np.clip((xy - x * y / n) / np.sqrt((xx - x * x / n) * (yy - y * y / n)), -1, 1)
+        matrix = np.empty((len(NUMERIC), len(NUMERIC)))
+        for (i, j), correlation in zip(PAIRS, correlations):
+            matrix[i, j] = matrix[j, i] = correlation if i != j else np.where(correlation > 0, 1.0, np.nan)
+        return pd.DataFrame(matrix, index=NUMERIC, columns=NUMERIC)
+
+    def crosstab(self, a, b):
+        """
+        Listings per combination of the values of two CATEGORICAL columns
+        (missing values left out), as pd.crosstab.
+        """
+        size_a, size_b = len(self.levels[a]) + 1, len(self.levels[b]) + 1
+        codes_a, codes_b = self.codes[:, CATEGORICAL.index(a)], self.codes[:, CATEGORICAL.index(b)]
+        known = (codes_a > 0) & (codes_b > 0)
+        table = np.bincount(codes_a[known] * size_b + codes_b[known], weights=self.counts[known], minlength=size_a * size_b).reshape(size_a, size_b)
+        rows, columns = np.flatnonzero(table.sum(axis=1)), np.flatnonzero(table.sum(axis=0))
+        table = pd.DataFrame(table[np.ix_(rows, columns)].astype(np.int64),
+                             index=pd.Index([self.levels[a][code] for code in rows], name=a),
+                             columns=pd.Index([self.levels[b][code] for code in columns], name=b))
+        return table.sort_index().sort_index(axis=1)
+
+    def cramers_v(self):
+        """
+        Cramér's V of every pair of CATEGORICAL columns.
+        """
+        matrix = pd.DataFrame(np.eye(len(CATEGORICAL)), index=CATEGORICAL, columns=CATEGORICAL)
+        for a, b in itertools.combinations(CATEGORICAL, 2):
+            matrix.loc[a, b] = matrix.loc[b, a] = cramers_v(self.crosstab(a, b).to_numpy())
+        return matrix
+
+def cramers_v(table):
+    """
+    Cramér's V of a contingency table (without bias correction); NaN when a
+    side has a single value.
+    """
+    table = np.asarray(table, dtype=float)
+    n = table.sum()
+    if min(table.shape) < 2 or n == 0:
+        return np.nan
+    expected = np.outer(table.sum(axis=1), table.sum(axis=0)) / n
+    chi2 = ((table - expected) ** 2 / expected).sum()
+    return float(np.sqrt(chi2 / n / (min(table.shape) - 1)))
+
+def engine_displacement(engine):
+    """
+    Displacement in cc of each engine description (the first number: liters
+    up to 10, cc from 500 on), NaN when there is none. Each distinct
+    description is parsed once.
+    """
+    codes, descriptions = factorize(engine)
+    displacements = np.full(len(descriptions) + 1, np.nan)
+    for i, description in enumerate(descriptions):
+        match = DISPLACEMENT_PATTERN.search(str(description))
+        if match:
+            number = float(match.group().replace(",", "."))
+            if 0.5 <= number <= 10:
+                displacements[i] = round(number * 1000)
+            elif 500 <= number <= 10_000:
+                displacements[i] = round(number)
+    return displacements[codes]
+
+def _band(prices):
+    # Price band of each price (see BAND_EDGES)
+    return np.maximum(np.searchsorted(BAND_EDGES, prices, "right") - 1, 0)
+
+def _pair_sums(values, groups, size):
+    # SUMS of every pair of columns of `values` per group, over the rows where
+    # both values are known
+    sums = np.zeros((size, len(PAIRS), len(SUMS)))
+    for pair, (i, j) in enumerate(PAIRS):
+        x, y = values[:, i], values[:, j]
+        known = ~np.isnan(x) & ~np.isnan(y)
+        x, y, group = x[known], y[known], groups[known]
+        for position, weights in enumerate([None, x, y, x * x, y * y, x * y]):
+            sums[:, pair, position] = np.bincount(group, weights=weights, minlength=size)
+    return sums
+
+def _add_counts(keys, counts, added_keys, added_counts):
+    # Sorted keys and their counts plus other (sorted, distinct) keys and
+    # counts; keys whose count drops to 0 are removed
+    positions = np.searchsorted(keys, added_keys)
+    found = positions < len(keys)
+    found[found] = keys[positions[found]] == added_keys[found]
+    counts = counts.copy()
+    counts[positions[found]] += added_counts[found]
+    keys = np.insert(keys, positions[~found], added_keys[~found])
+    counts = np.insert(counts, positions[~found], added_counts[~found])
+    kept = counts != 0
+    return keys[kept], counts[kept]
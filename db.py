@@ -0,0 +1,151 @@
+"""
+SQLite access for the dashboard, safe while the scraper (js/scraper.js) writes.
+
+The database file is switched to WAL (write-ahead log) once per process: readers
+then see the last committed state and neither block the scraper's writes nor
+wait for them. Reads go through a pool of read-only connections (`mode=ro`
+URI) per database file, opened once with a large page cache and memory-mapped
+I/O. A read that still finds the database busy (while the file is switched to
+WAL, or on a checkpoint) is retried with exponential backoff.
+"""
+import contextlib
+import os
+import queue
+import sqlite3
+import time
+import urllib.parse
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+# Read-only connections kept open per database file
+POOL_SIZE = 8
+
+# Page cache of each connection, in KiB, and memory-mapped I/O, in bytes
+CACHE_SIZE_KIB = 64 * 1024
+MMAP_SIZE = 256 * 2**20
+
+# SQLite's own wait on a locked database, in seconds
+BUSY_TIMEOUT = 2.0
+
+# Retries of a read that failed on a busy database, the first after
+# RETRY_DELAY seconds, each next one after twice as long
+RETRIES = 5
+RETRY_DELAY = 0.05
+
+@st.cache_resource
+def get_pool(db_path):
+    """
+    The process-wide read-only connection pool of `db_path`, whose file is
+    switched to WAL first.
+    """
+    enable_wal(db_path)
+    return ConnectionPool(db_path, POOL_SIZE)
+
+def enable_wal(db_path):
+    """
+    Switch the database file to WAL mode (it stays in WAL mode for every
+    connection, the scraper's too). Returns the journal mode of the file.
+    """
+    conn = sqlite3.connect(db_path, timeout=BUSY_TIMEOUT)
+    try:
+        return conn.execute("PRAGMA journal_mode=WAL").fetchone()[0]
+    except sqlite3.OperationalError:
+        # Read-only or locked database: reads still work, retried when busy
+        return None
+    finally:
+        conn.close()
+
+class ConnectionPool:
+    """
+    Up to `size` idle read-only connections; more are opened when every one is
+    in use, and closed when given back to a full pool.
+    """
+
+    def __init__(self, db_path, size):
+        self.db_path = db_path
+        self._idle = queue.LifoQueue(maxsize=size)
+
+    @contextlib.contextmanager
+    def connection(self):
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            conn = connect_read_only(self.db_path)
+        try:
+            yield conn
+        finally:
+            # No read transaction left open: it would keep an old snapshot
+            conn.rollback()
+            try:
+                self._idle.put_nowait(conn)
+            except queue.Full:
+                conn.close()
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+def connect_read_only(db_path):
+    """
+    A read-only connection to `db_path`, usable from any thread (one at a time).
+    """
+    uri = "file:" + urllib.parse.quote(os.path.abspath(db_path)) + "?mode=ro"
+    conn = sqlite3.connect(uri, uri=True, timeout=BUSY_TIMEOUT, check_same_thread=False)
+    conn.execute(f"PRAGMA cache_size=-{CACHE_SIZE_KIB}")
+    conn.execute(f"PRAGMA mmap_size={MMAP_SIZE}")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    return conn
+
+def read(db_path, fn):
+    """
+    fn(conn) on a pooled read-only connection of `db_path`, retried with
+    backoff while the database is busy.
+    """
+    pool = get_pool(db_path)
+    for attempt in range(RETRIES + 1):
+        try:
+            with pool.connection() as conn:
+                return fn(conn)
+        except sqlite3.OperationalError as error:
+            if attempt == RETRIES or not is_busy(error):
+                raise
+            time.sleep(RETRY_DELAY * 2**attempt)
+
+def read_sql(db_path, sql, params=()):
+    """
+    pd.read_sql of a query on a pooled read-only connection (see read).
+    """
+    return read(db_path, lambda conn: pd.read_sql(sql, conn, params=params))
+
+def fetch_all(db_path, sql, params=()):
+    """
+    The rows of a query on a pooled read-only connection (see read).
+    """
+    return read(db_path, lambda conn: conn.execute(sql, params).fetchall())
+
+@contextlib.contextmanager
+def pooled_connection(db_path):
+    """
+    A pooled read-only connection for reads that outlive one call, e.g.
+    chunked reads (not retried).
+    """
+    with get_pool(db_path).connection() as conn:
+        yield conn
+
+def sql_values(column):
+    """
+    The values of a Series as Python values for the sqlite3 module, None
+    where missing.
+    """
+    if isinstance(column.dtype, np.dtype) and column.dtype.kind in "iub":
+        return column.tolist()
+    return column.to_numpy(dtype=object, na_value=None).tolist()
+
+def is_busy(error):
+    # SQLITE_BUSY / SQLITE_LOCKED, as raised by the sqlite3 module
+    message = str(error).lower()
+    return "locked" in message or "busy" in message
@@ -0,0 +1,161 @@
+"""
+Deal scores of the listings, with top-K lists for the Deals page.
+
+Every listing is compared with the listings of its bucket (brand, model,
+year and MILEAGE_BUCKET km band): its score is its distance to the bucket's
+median price in robust standard deviations (1.4826 x MAD), so the most negative
+scores are the cheapest cars for what they are. The scores are computed for
+the whole shared dataset at once, once per version, together with the
+DEAL_TOP_K best deals overall and per brand, model and wilaya. A query is
+answered from one of these lists when its filters keep enough of it; otherwise
+only the matching listings are partially sorted (np.argpartition).
+"""
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from utils import get_dataset
+
+# Width of the mileage bands of the buckets, in km
+MILEAGE_BUCKET = 50_000
+
+# Buckets with fewer listings get no score
+DEAL_MIN_LISTINGS = 5
+
+# Listings priced under this fraction of their bucket's median are taken for
+# junk prices (monthly payments, deposits, typos), not deals
+MIN_PRICE_RATIO = 0.3
+
+# Floor of the MAD, as a fraction of the median (buckets of identical prices)
+MIN_MAD_RATIO = 0.02
+
+# Length of the materialized lists of best deals
+DEAL_TOP_K = 100
+
+# Columns with a list of best deals per value
+TOP_COLUMNS = ["brand", "model", "wilaya"]
+
+def get_deal_scores(dataset=None):
+    """
+    The process-wide deal scores of `dataset` (the shared dataset by default;
+    pages pass the one they hold, so that the row ids match its rows and the
+    inverted index built from it).
+    """
+    dataset = get_dataset() if dataset is None else dataset
+    return _scores_for(dataset.version, dataset.frame)
+
+@st.cache_resource(max_entries=1)
+def _scores_for(version, _frame):
+    return DealScores(_frame)
+
+class DealScores:
+    """
+    Row ids are positions in `frame`, as in the inverted index. `score` is NaN
+    for the listings without a score.
+    """
+
+    def __init__(self, frame, k=DEAL_TOP_K):
+        self.frame = frame
+        self.k = k
+        self.median, self.score = bucket_scores(frame)
+        self.discount = 1 - frame["price"].to_numpy() / self.median
+        # Every scored row, best first: the one full sort, done once per version
+        scored = np.flatnonzero(~np.isnan(self.score))
+        self.ranked = scored[np.argsort(self.score[scored], kind="stable")]
+        self._codes = {}
+        self._lookup = {}
+        self._lists = {}
+        self._offsets = {}
+        for column in TOP_COLUMNS:
+            codes, uniques = pd.factorize(frame[column])
+            self._codes[column] = codes
+            self._lookup[column] = {value: code for code, value in enumerate(uniques)}
+            # Ranked rows grouped by value (best first within each value), cut at k
+            ranked = self.ranked[codes[self.ranked] >= 0]
+            by_value = ranked[np.argsort(codes[ranked], kind="stable")]
+            counts = np.bincount(codes[by_value], minlength=len(uniques))
+            starts = np.concatenate([[0], np.cumsum(counts)])
+            rank = np.arange(len(by_value)) - np.repeat(starts[:-1], counts)
+            kept = by_value[rank < k]
+            self._lists[column] = kept
+            self._offsets[column] = np.concatenate([[0], np.cumsum(np.minimum(counts, k))])
+
+    def best(self, n, rows=None, **values):
+        """
+        Row ids of the `n` best deals, best first, among `rows` (a sorted
+        row-id array, None for every row) and the listings whose TOP_COLUMNS
+        columns equal `values` (e.g. brand="RENAULT", wilaya=16).
+        """
+        codes = {column: self._lookup[column].get(value) for column, value in values.items()}
+        if any(code is None for code in codes.values()):
+            return np.empty(0, dtype=np.int64)
+        candidates = [self.ranked[:self.k]] if not codes else [self._list(column, code) for column, code in codes.items()]
+        for ranked in candidates:
+            # A list filtered by the other criteria is the start of the ranking
+            # of the selection; it is complete when the list was not cut at k
+            found = self._matching(ranked, rows, codes)
+            if len(found) >= n or len(ranked) < self.k:
+                return found[:n]
+        return self._partial_sort(n, rows, codes)
+
+    def _list(self, column, code):
+        offsets = self._offsets[column]
+        return self._lists[column][offsets[code]:offsets[code + 1]]
+
+    def _matching(self, ranked, rows, codes):
+        keep = np.ones(len(ranked), dtype=bool)
+        for column, code in codes.items():
+            keep &= self._codes[column][ranked] == code
+        if rows is not None:
+            keep &= _contains(rows, ranked)
+        return ranked[keep]
+
+    def _partial_sort(self, n, rows, codes):
+        # The n best of the selection without sorting all of it
+        selected = np.arange(len(self.frame)) if rows is None else rows
+        keep = ~np.isnan(self.score[selected])
+        for column, code in codes.items():
+            keep &= self._codes[column][selected] == code
+        selected = selected[keep]
+        if len(selected) > n:
+            selected = selected[np.argpartition(self.score[selected], n)[:n]]
+        return selected[np.argsort(self.score[selected], kind="stable")]
+
+    def table(self, rows):
+        """
+        The listings of `rows` with their bucket median, discount and score.
+        """
+        deals = self.frame.take(rows)
+        return deals.assign(median=self.median[rows], discount=self.discount[rows], score=self.score[rows])
+
+def bucket_scores(frame):
+    """
+    (median price of the listing's bucket, robust z-score of its price) of
+    every listing, NaN where the bucket is too small or the price too low.
+    """
+    prices = frame["price"].to_numpy(dtype=float)
+    band = frame["mileage"] // MILEAGE_BUCKET
+    # Listings with a missing key are in no bucket (-1; ngroup gives NaN)
+    bucket = frame.groupby([frame["brand"], frame["model"], frame["year"], band], observed=True, sort=False).ngroup()
+    bucket = bucket.fillna(-1).to_numpy(dtype=np.int64)
+    valid = bucket >= 0
+    size = np.bincount(bucket[valid])
+    median = np.full(len(frame), np.nan)
+    mad = np.full(len(frame), np.nan)
+    grouped = pd.Series(prices[valid]).groupby(bucket[valid])
+    median[valid] = grouped.transform("median").to_numpy()
+    mad[valid] = pd.Series(np.abs(prices[valid] - median[valid])).groupby(bucket[valid]).transform("median").to_numpy()
+    scale = 1.4826 * np.maximum(mad, MIN_MAD_RATIO * median)
+    score = (prices - median) / scale
+    eligible = valid.copy()
+    eligible[valid] = size[bucket[valid]] >= DEAL_MIN_LISTINGS
+    eligible &= prices >= MIN_PRICE_RATIO * median
+    score[~eligible] = np.nan
+    return median, score
+
+def _contains(sorted_rows, rows):
+    # Whether each of `rows` is in the sorted row-id array
+    positions = np.searchsorted(sorted_rows, rows)
+    found = positions < len(sorted_rows)
+    found[found] = sorted_rows[positions[found]] == rows[found]
+    return found
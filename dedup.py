@@ -0,0 +1,282 @@
+"""
+Near-duplicate listings: the same car posted again under a new link.
+
+Two listings are duplicates when they have the same brand, model, year and
+wilaya (the block), prices within PRICE_TOLERANCE, mileages within
+MILEAGE_TOLERANCE (or MILEAGE_SLACK km), the same color (or a missing one),
+and titles whose word sets have an estimated Jaccard similarity of at least
+TITLE_SIMILARITY (MinHash, NUM_HASHES hash functions). Duplicates are chained
+into clusters, and the deduplicated listings keep the latest listing of each
+cluster.
+
+Nothing is compared pairwise over a block: the MinHash signature is cut into
+BANDS bands (LSH), and for every band the listings are kept sorted by (block
+and band, price, mileage range). A listing is only compared with the WINDOW
+listings on each side of it in that order, so the candidates of a listing are
+the ones with the same block, a similar title and the closest prices (then
+mileages, among listings of the same price), and the cost grows as n log n. Every listing version is a node of a union-find forest kept between
+dataset versions: on an update, only the new or modified listings are
+inserted into the sorted bands and compared with their neighbours, and the
+clusters of the other listings are kept as they were.
+"""
+import threading
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import streamlit as st
+
+from utils import get_dataset, get_incremental_loader
+
+BLOCK_COLUMNS = ["brand", "model", "year", "wilaya"]
+
+# MinHash signature of the titles: NUM_HASHES values in BANDS bands
+NUM_HASHES = 32
+BANDS = 8
+
+# Thresholds of a duplicate
+TITLE_SIMILARITY = 0.5
+PRICE_TOLERANCE = 0.05
+MILEAGE_TOLERANCE = 0.05
+MILEAGE_SLACK = 5_000
+
+# Listings compared on each side of a listing in the (block and band, price, mileage range) order
+WINDOW = 8
+
+# Modulus of the MinHash hash functions (a Mersenne prime) and their coefficients
+_PRIME = np.uint64(2**31 - 1)
+_COEFFICIENTS = np.random.default_rng(20251001).integers(1, 2**31 - 1, size=(2, NUM_HASHES), dtype=np.uint64)
+
+# Bits of a sort key holding the price and the mileage range (the others hold
+# the band's hash), and the width of a mileage range
+_PRICE_BITS = 24
+_MILEAGE_BITS = 8
+_MILEAGE_STEP = 2_500
+
+@st.cache_resource
+def _shared_duplicates(db_path):
+    return DuplicateStore()
+
+def get_duplicates(dataset=None):
+    """
+    The duplicate clusters of `dataset` (anything with the `frame` and
+    `version` of a Dataset, such as the inverted index; the shared dataset by
+    default), from the process-wide store brought up to date with it. Pages
+    pass the dataset they hold, so that the row ids match its rows even when
+    a refresh changed the shared dataset in between.
+    """
+    dataset = get_dataset() if dataset is None else dataset
+    store = _shared_duplicates(get_incremental_loader().db_path)
+    return store.update(dataset.frame, dataset.version)
+
+class Duplicates:
+    """
+    The clusters of one dataset version: `cluster[i]` is the cluster of row i
+    and `kept` the sorted row ids of the latest listing of each cluster.
+    """
+
+    def __init__(self, version, cluster, kept):
+        self.version = version
+        self.cluster = cluster
+        self.kept = kept
+
+    def duplicates(self):
+        """
+        Number of listings that are not the latest of their cluster.
+        """
+        return len(self.cluster) - len(self.kept)
+
+class DuplicateStore:
+    """
+    `cluster[i]` is the cluster of row i of the last dataset version passed to
+    `update`, and `kept` the sorted row ids of the latest listing of each cluster.
+    `update` returns them as Duplicates, which a later update does not change.
+    """
+
+    def __init__(self):
+        self.version = None
+        self.cluster = None
+        self.kept = None
+        self._lock = threading.Lock()
+        self._clear()
+
+    def _clear(self):
+        # Node tables: one node per listing version ever seen
+        self._row_hashes = pd.Index(np.empty(0, dtype=np.uint64))
+        self._parent = np.empty(0, dtype=np.int64)
+        self._block = np.empty(0, dtype=np.uint64)
+        self._price = np.empty(0, dtype=np.int64)
+        self._mileage = np.empty(0, dtype=np.int64)
+        self._color = np.empty(0, dtype=np.uint64)
+        self._signature = np.empty((0, NUM_HASHES), dtype=np.uint32)
+        self._active = np.empty(0, dtype=bool)
+        # Per band: node ids sorted by their (band hash, price) key, and the keys
+        self._band_nodes = [np.empty(0, dtype=np.int64) for _ in range(BANDS)]
+        self._band_keys = [np.empty(0, dtype=np.uint64) for _ in range(BANDS)]
+
+    def update(self, frame, version):
+        with self._lock:
+            if version == self.version:
+                return Duplicates(self.version, self.cluster, self.kept)
+            hashes = pd.util.hash_pandas_object(frame[["link", "title", "price", "mileage", "color", *BLOCK_COLUMNS]], index=False).to_numpy()
+            # Forget the nodes of listings gone or modified once they outnumber the live ones
+            if len(self._parent) > 2 * len(frame):
+                self._clear()
+            nodes = self._row_hashes.get_indexer(hashes)
+            # Listings gone or modified since the last version are no one's duplicate
+            self._active = np.zeros(len(self._parent), dtype=bool)
+            self._active[nodes[nodes >= 0]] = True
+            new = np.flatnonzero(nodes < 0)
+            if len(new):
+                nodes[new] = self._add_nodes(frame.take(new), hashes[new])
+            self.cluster = _roots(self._parent)[nodes]
+            # The latest listing of every cluster
+            latest_first = np.argsort(-frame["date"].to_numpy().astype(np.int64), kind="stable")
+            _, first = np.unique(self.cluster[latest_first], return_index=True)
+            self.kept = np.sort(latest_first[first])
+            self.version = version
+            return Duplicates(self.version, self.cluster, self.kept)
+
+    def _add_nodes(self, listings, hashes):
+        start = len(self._parent)
+        nodes = np.arange(start, start + len(listings))
+        block = pd.util.hash_pandas_object(listings[BLOCK_COLUMNS], index=False).to_numpy()
+        price = listings["price"].to_numpy(dtype=np.int64)
+        mileage = listings["mileage"].fillna(-1).to_numpy(dtype=np.int64)
+        color = pd.util.hash_pandas_object(listings["color"], index=False).to_numpy().copy()
+        color[listings["color"].isna().to_numpy()] = 0
+        self._row_hashes = self._row_hashes.append(pd.Index(hashes))
+        self._parent = np.concatenate([self._parent, nodes])
+        self._block = np.concatenate([self._block, block])
+        self._price = np.concatenate([self._price, price])
+        self._mileage = np.concatenate([self._mileage, mileage])
+        self._color = np.concatenate([self._color, color])
+        self._signature = np.concatenate([self._signature, minhash(listings["title"])])
+        self._active = np.concatenate([self._active, np.ones(len(nodes), dtype=bool)])
+
+        pairs = []
+        price_key = np.minimum(np.maximum(price, 0), 2**_PRICE_BITS - 1).astype(np.uint64)
+        # Listings of the same price (e.g. a round one) are ordered by mileage,
+        # so that a repost is next to the car it repeats
+        mileage_key = np.clip(mileage // _MILEAGE_STEP, 0, 2**_MILEAGE_BITS - 1).astype(np.uint64)
+        for band in range(BANDS):
+            band_hash = _band_hash(block, self._signature[nodes, band * _rows_per_band():(band + 1) * _rows_per_band()])
+            keys = (band_hash << np.uint64(_PRICE_BITS + _MILEAGE_BITS)) | (price_key << np.uint64(_MILEAGE_BITS)) | mileage_key
+            order = np.argsort(keys)
+            keys, band_nodes = keys[order], nodes[order]
+            pairs += self._neighbours(band, keys, band_nodes)
+            # New nodes among their new neighbours
+            for offset in range(1, WINDOW + 1):
+                close = _close(keys[:-offset], keys[offset:])
+                pairs.append((band_nodes[:-offset][close], band_nodes[offset:][close]))
+            positions = np.searchsorted(self._band_keys[band], keys)
+            self._band_keys[band] = np.insert(self._band_keys[band], positions, keys)
+            self._band_nodes[band] = np.insert(self._band_nodes[band], positions, band_nodes)
+        # A pair found in several bands is checked once
+        first = np.concatenate([a for a, _ in pairs])
+        second = np.concatenate([b for _, b in pairs])
+        unique = np.unique(np.minimum(first, second) * len(self._parent) + np.maximum(first, second))
+        first, second = unique // len(self._parent), unique % len(self._parent)
+        keep = self._duplicate(first, second)
+        self._parent = _union(self._parent, first[keep], second[keep])
+        return nodes
+
+    def _neighbours(self, band, keys, nodes):
+        # (new node, existing node) pairs of the WINDOW existing nodes on each side
+        existing = self._band_nodes[band]
+        if not len(existing):
+            return []
+        positions = np.searchsorted(self._band_keys[band], keys)
+        pairs = []
+        for offset in range(-WINDOW, WINDOW):
+            at = positions + offset
+            inside = np.flatnonzero((at >= 0) & (at < len(existing)))
+            close = inside[_close(keys[inside], self._band_keys[band][at[inside]])]
+            pairs.append((nodes[close], existing[at[close]]))
+        return pairs
+
+    def _duplicate(self, first, second):
+        # Whether each candidate pair is a pair of duplicates; titles are
+        # compared last, for the pairs that pass the other tests
+        price_a, price_b = self._price[first], self._price[second]
+        mileage_a, mileage_b = self._mileage[first], self._mileage[second]
+        color_a, color_b = self._color[first], self._color[second]
+        duplicate = (
+            (first != second)
+            & self._active[first] & self._active[second]
+            & (self._block[first] == self._block[second])
+            & (np.abs(price_a - price_b) <= PRICE_TOLERANCE * np.maximum(price_a, price_b))
+            & (mileage_a >= 0) & (mileage_b >= 0)
+            & (np.abs(mileage_a - mileage_b) <= np.maximum(MILEAGE_SLACK, MILEAGE_TOLERANCE * np.maximum(mileage_a, mileage_b)))
+            & ((color_a == color_b) | (color_a == 0) | (color_b == 0))
+        )
+        candidates = np.flatnonzero(duplicate)
+        similar = (self._signature[first[candidates]] == self._signature[second[candidates]]).mean(axis=1)
+        duplicate[candidates] = similar >= TITLE_SIMILARITY
+        return duplicate
+
+def minhash(titles):
+    """
+    MinHash signatures (NUM_HASHES uint32 per title) of the lowercase word
+    sets of `titles`. Titles without a word get all-maximal signatures.
+    """
+    if titles.dtype == pd.StringDtype("pyarrow"):
+        titles = pa.array(titles.array)
+    else:
+        titles = pa.array(titles.astype(object).to_numpy(), type=pa.string(), from_pandas=True)
+    if isinstance(titles, pa.ChunkedArray):
+        titles = titles.combine_chunks()
+    words = pc.utf8_split_whitespace(pc.utf8_lower(pc.fill_null(titles, "")))
+    tokens = pc.list_flatten(words)
+    parents = pc.list_parent_indices(words).to_numpy()
+    present = pc.not_equal(tokens, "")
+    tokens, parents = tokens.filter(present), parents[present.to_numpy(zero_copy_only=False)]
+    # Hash the vocabulary once, then gather
+    encoded = pc.dictionary_encode(tokens)
+    vocabulary = pd.util.hash_array(encoded.dictionary.to_numpy(zero_copy_only=False)) % _PRIME
+    indices = encoded.indices.to_numpy()
+    signature = np.full((len(titles), NUM_HASHES), np.iinfo(np.uint32).max, dtype=np.uint32)
+    if len(parents):
+        starts = np.flatnonzero(np.concatenate([[True], parents[1:] != parents[:-1]]))
+        for column, (a, b) in enumerate(_COEFFICIENTS.T):
+            word_hashes = ((a * vocabulary + b) % _PRIME).astype(np.uint32)
+            signature[parents[starts], column] = np.minimum.reduceat(word_hashes[indices], starts)
+    return signature
+
+def _close(keys_a, keys_b):
+    # Whether two sort keys have the same band hash and prices within PRICE_TOLERANCE
+    mask = np.uint64(2**_PRICE_BITS - 1)
+    keys_a, keys_b = keys_a >> np.uint64(_MILEAGE_BITS), keys_b >> np.uint64(_MILEAGE_BITS)
+    price_a, price_b = (keys_a & mask).astype(np.int64), (keys_b & mask).astype(np.int64)
+    return ((keys_a >> np.uint64(_PRICE_BITS)) == (keys_b >> np.uint64(_PRICE_BITS))) & (np.abs(price_a - price_b) <= PRICE_TOLERANCE * np.maximum(price_a, price_b))
+
+def _rows_per_band():
+    return NUM_HASHES // BANDS
+
+def _band_hash(block, band):
+    # Hash of the block and of one band of the signatures, in 64 - _PRICE_BITS - _MILEAGE_BITS bits
+    key = block.copy()
+    for column in band.T:
+        key ^= column.astype(np.uint64)
+        key *= np.uint64(0x9E3779B97F4A7C15)
+        key ^= key >> np.uint64(29)
+    return key >> np.uint64(_PRICE_BITS + _MILEAGE_BITS)
+
+def _roots(parent):
+    # Root of every node, by pointer jumping
+    while True:
+        grandparent = parent[parent]
+        if np.array_equal(grandparent, parent):
+            return parent
+        parent = grandparent
+
+def _union(parent, first, second):
+    # Forest in which the nodes of every pair share a root (the smallest node id)
+    parent = _roots(parent)
+    while True:
+        root_a, root_b = parent[first], parent[second]
+        apart = root_a != root_b
+        if not apart.any():
+            return parent
+        np.minimum.at(parent, np.maximum(root_a[apart], root_b[apart]), np.minimum(root_a[apart], root_b[apart]))
+        parent = _roots(parent)
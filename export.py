@@ -0,0 +1,164 @@
+"""
+Streaming export of the listings as Excel, CSV or Parquet.
+
+The listings come in chunks (of a DataFrame already in memory, or straight from
+SQLite with utils.iter_listings) and every chunk is written before the next one
+is read, so memory use depends on the chunk size, not on the number of rows.
+Excel workbooks are written by openpyxl in write-only mode, which keeps the
+rows in a temporary file until the archive is assembled.
+"""
+import tempfile
+import pandas as pd
+import pyarrow as pa
+
+from utils import INTEGER_COLUMNS
+
+# Rows per chunk
+CHUNK_ROWS = 50_000
+
+# Format -> (file extension, MIME type)
+EXPORT_FORMATS = {
+    "xlsx": ("xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+    "csv": ("csv", "text/csv"),
+    "parquet": ("parquet", "application/vnd.apache.parquet"),
+}
+
+SHEET_NAME = "Car Data"
+
+def frame_chunks(frame, chunk_rows=CHUNK_ROWS):
+    """
+    Split a DataFrame into consecutive chunks (views, nothing is copied).
+    """
+    for start in range(0, max(len(frame), 1), chunk_rows):
+        yield frame.iloc[start:start + chunk_rows]
+
+def export_bytes(chunks, fmt):
+    """
+    The content of the export of `chunks` in `fmt`, for st.download_button.
+    The file is assembled on disk, so only the finished export is held in memory.
+    """
+    with tempfile.TemporaryFile() as file:
+        write_export(chunks, fmt, file)
+        file.seek(0)
+        return file.read()
+
+def iter_export(chunks, fmt, block_size=1 << 20):
+    """
+    Yield the export of `chunks` in `fmt` as byte blocks, as it is produced.
+    CSV and Parquet blocks are emitted after every chunk; an Excel workbook
+    can only be emitted once its archive is complete.
+    """
+    if fmt == "xlsx":
+        with tempfile.TemporaryFile() as file:
+            write_export(chunks, fmt, file)
+            file.seek(0)
+            while block := file.read(block_size):
+                yield block
+        return
+    sink = _Drain()
+    for _ in _write_chunks(chunks, fmt, sink):
+        if sink.parts:
+            yield sink.drain()
+    if sink.parts:
+        yield sink.drain()
+
+def write_export(chunks, fmt, file):
+    """
+    Write the export of `chunks` in `fmt` to a binary file object.
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"unknown export format: {fmt}")
+    for _ in _write_chunks(chunks, fmt, file):
+        pass
+
+def _write_chunks(chunks, fmt, file):
+    # Generator: writes one chunk per step, so callers can forward the bytes in between
+    if fmt == "csv":
+        for number, chunk in enumerate(chunks):
+            file.write(_normalize(chunk).to_csv(index=False, header=number == 0).encode("utf-8"))
+            yield
+    elif fmt == "parquet":
+        import pyarrow.parquet as pq
+
+        writer = None
+        try:
+            for chunk in chunks:
+                chunk = _normalize(chunk)
+                if writer is None:
+                    schema = _arrow_schema(chunk)
+                    writer = pq.ParquetWriter(file, schema)
+                writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+                yield
+        finally:
+            if writer is not None:
+                writer.close()
+    elif fmt == "xlsx":
+        from openpyxl import Workbook
+
+        workbook = Workbook(write_only=True)
+        sheet = workbook.create_sheet(SHEET_NAME)
+        header = False
+        for chunk in chunks:
+            if not header:
+                sheet.append(list(chunk.columns))
+                header = True
+            values = _normalize(chunk).astype(object)
+            for row in values.where(values.notna(), None).itertuples(index=False, name=None):
+                sheet.append(row)
+            yield
+        workbook.save(file)
+        yield
+
+def _normalize(chunk):
+    # Integer columns read as float because of missing values go back to
+    # (nullable) integers, so every chunk writes them the same way
+    kinds = {column: "Int64" for column in chunk.columns
+             if (column in INTEGER_COLUMNS or column == "date_int") and chunk[column].dtype.kind == "f"}
+    return chunk.astype(kinds) if kinds else chunk
+
+def _arrow_schema(chunk):
+    # Types that every chunk can be converted to, whatever its pandas dtypes
+    fields = []
+    for column in chunk.columns:
+        dtype = chunk[column].dtype
+        if pd.api.types.is_datetime64_dtype(dtype):
+            kind = pa.timestamp("ns")
+        elif column in INTEGER_COLUMNS or column == "date_int" or pd.api.types.is_integer_dtype(dtype):
+            kind = pa.int64()
+        elif pd.api.types.is_float_dtype(dtype):
+            kind = pa.float64()
+        elif pd.api.types.is_bool_dtype(dtype):
+            kind = pa.bool_()
+        else:
+            kind = pa.string()
+        fields.append(pa.field(column, kind))
+    return pa.schema(fields)
+
+class _Drain:
+    """
+    Write-only file object that keeps the written bytes until drained.
+    """
+
+    def __init__(self):
+        self.parts = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b"".join(self.parts)
+        self.parts = []
+        return data
@@ -0,0 +1,222 @@
+"""
+Fair-price model: per brand x model regression of log(price) on age, mileage,
+fuel and gearbox.
+
+Every listing adds x x' and x log(price) to the sufficient statistics of its
+model (one np.bincount per pair of features, for all models at once), and the
+coefficients of every model are solved in one batched np.linalg.solve. Each
+model is pulled towards the fit of all listings by PRIOR_LISTINGS
+pseudo-listings, so models with few listings, or a single fuel, still get a
+sensible curve. When the dataset version changes, only the contributions of
+added, removed or modified listings (found by hashing the rows of the
+regression) are subtracted or added before solving again.
+"""
+import threading
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from utils import get_incremental_loader, row_multiset_diff
+
+# Weight, in listings, of the fit of all listings in each model's fit
+PRIOR_LISTINGS = 20
+
+# Mileage unit of the coefficients
+MILEAGE_UNIT = 100_000
+
+# Ages of the depreciation curve
+CURVE_AGES = np.arange(0, 21)
+
+@st.cache_resource
+def _shared_fair_prices(db_path):
+    return FairPriceModel(PRIOR_LISTINGS)
+
+def get_fair_prices():
+    """
+    The process-wide fair-price model, brought up to date with the incremental loader.
+    """
+    loader = get_incremental_loader()
+    cleaned = loader.refresh()
+    model = _shared_fair_prices(loader.db_path)
+    model.update(cleaned, loader.version)
+    return model
+
+class FairPriceModel:
+    """
+    `coefficients[g]` are the coefficients of group g (a brand x model, see
+    `groups`) over `features`: intercept, age, mileage (per MILEAGE_UNIT km)
+    and one indicator per fuel and gearbox but the first of each.
+    """
+
+    def __init__(self, prior_listings):
+        self.prior_listings = prior_listings
+        self.version = None
+        self.rows = None
+        self.hashes = None
+        self.groups = pd.MultiIndex.from_arrays([[], []], names=["brand", "model"])
+        self.fuels = None
+        self.gearboxes = None
+        self.features = None
+        self.xtx = None
+        self.xty = None
+        self.count = None
+        self.coefficients = None
+        self._lock = threading.Lock()
+
+    def update(self, cleaned, version):
+        with self._lock:
+            if version == self.version:
+                return
+            fuels = _levels(cleaned["fuel"])
+            gearboxes = _levels(cleaned["gearbox"])
+            if self.rows is not None and fuels == self.fuels and gearboxes == self.gearboxes:
+                rows = self._design(cleaned)
+                removed, added, hashes = row_multiset_diff(self.rows, rows, self.hashes)
+                self._grow(len(self.groups))
+                self._accumulate(removed, -1)
+                self._accumulate(added, 1)
+            else:
+                # First build, or a new fuel/gearbox: every listing's features change
+                self.fuels, self.gearboxes = fuels, gearboxes
+                self.features = ["intercept", "age", "mileage"] + [f"fuel={fuel}" for fuel in fuels[1:]] + [f"gearbox={gearbox}" for gearbox in gearboxes[1:]]
+                rows = self._design(cleaned)
+                size = len(self.features)
+                self.xtx = np.zeros((0, size, size))
+                self.xty = np.zeros((0, size))
+                self.count = np.zeros(0)
+                self._grow(len(self.groups))
+                _, added, hashes = row_multiset_diff(None, rows)
+                self._accumulate(added, 1)
+            self.rows = rows
+            self.hashes = hashes
+            self.coefficients = self._solve()
+            self.version = version
+
+    def fit(self, brand, model):
+        """
+        The coefficients of a model as a Series (None if it has no listing).
+        """
+        group = self._group(brand, model)
+        if group is None:
+            return None
+        return pd.Series(self.coefficients[group], index=self.features)
+
+    def listings(self, brand, model):
+        """
+        Number of listings the model's fit is based on.
+        """
+        group = self._group(brand, model)
+        return 0 if group is None else int(self.count[group])
+
+    def expected_price(self, brand, model, age, mileage, fuel=None, gearbox=None):
+        """
+        Median expected price (exp of the fitted log-price) of a listing;
+        `age` and `mileage` can be arrays. None if the model has no listing.
+        """
+        group = self._group(brand, model)
+        if group is None:
+            return None
+        age = np.asarray(age, dtype=float)
+        x = np.zeros(np.broadcast(age, np.asarray(mileage)).shape + (len(self.features),))
+        x[..., 0] = 1
+        x[..., 1] = age
+        x[..., 2] = np.asarray(mileage, dtype=float) / MILEAGE_UNIT
+        for name, value in [("fuel", fuel), ("gearbox", gearbox)]:
+            if f"{name}={value}" in self.features:
+                x[..., self.features.index(f"{name}={value}")] = 1
+        return np.exp(x @ self.coefficients[group])
+
+    def yearly_mileage(self, brand, model):
+        """
+        Average kilometres per year of age of the model's listings.
+        """
+        group = self._group(brand, model)
+        if group is None or self.xtx[group, 0, 1] == 0:
+            return 0.0
+        return self.xtx[group, 0, 2] / self.xtx[group, 0, 1] * MILEAGE_UNIT
+
+    def depreciation(self, brand, model, fuel=None, gearbox=None, ages=CURVE_AGES):
+        """
+        Expected price by age, with the model's average mileage for that age.
+        """
+        mileage = ages * self.yearly_mileage(brand, model)
+        prices = self.expected_price(brand, model, ages, mileage, fuel, gearbox)
+        return pd.DataFrame({"age": ages, "mileage": mileage, "expected price": prices})
+
+    def _group(self, brand, model):
+        try:
+            group = self.groups.get_loc((brand, model))
+        except KeyError:
+            return None
+        return group if self.count[group] > 0 else None
+
+    def _design(self, cleaned):
+        # One row per usable listing: group and features, then log(price)
+        usable = (cleaned["price"] > 0) & cleaned["year"].notna() & cleaned["mileage"].notna() & cleaned["date"].notna()
+        data = cleaned[usable.to_numpy()]
+        # Group of every listing, from the brand x model pairs of category codes
+        brands = pd.Categorical(data["brand"])
+        models = pd.Categorical(data["model"])
+        pairs = brands.codes.astype(np.int64) * len(models.categories) + models.codes
+        used = np.flatnonzero(np.bincount(pairs, minlength=len(brands.categories) * len(models.categories)))
+        keys = pd.MultiIndex.from_arrays([brands.categories[used // len(models.categories)], models.categories[used % len(models.categories)]])
+        new = keys[self.groups.get_indexer(keys) < 0]
+        if len(new):
+            self.groups = self.groups.append(new)
+        group_of = np.zeros(len(brands.categories) * len(models.categories), dtype=np.int64)
+        group_of[used] = self.groups.get_indexer(keys)
+        # Compact dtypes: the rows are kept until the next update
+        columns = {
+            "group": group_of[pairs].astype(np.int32),
+            "age": np.clip(data["date"].dt.year.to_numpy() - data["year"].to_numpy(), 0, None).astype(np.float32),
+            "mileage": (data["mileage"].to_numpy() / MILEAGE_UNIT).astype(np.float32),
+        }
+        for name, levels in [("fuel", self.fuels), ("gearbox", self.gearboxes)]:
+            codes, values = pd.factorize(data[name])
+            code_of = {value: code for code, value in enumerate(values)}
+            for level in levels[1:]:
+                columns[f"{name}={level}"] = codes == code_of.get(level, -2)
+        columns["log_price"] = np.log(data["price"].to_numpy(dtype=float)).astype(np.float32)
+        return pd.DataFrame(columns)
+
+    def _grow(self, groups):
+        # Room for the statistics of groups added since the last update
+        missing = groups - len(self.count)
+        if missing > 0:
+            size = len(self.features)
+            self.xtx = np.concatenate([self.xtx, np.zeros((missing, size, size))])
+            self.xty = np.concatenate([self.xty, np.zeros((missing, size))])
+            self.count = np.concatenate([self.count, np.zeros(missing)])
+
+    def _accumulate(self, rows, sign):
+        # Add (sign=1) or subtract (sign=-1) the rows' x x' and x y, per group
+        if rows.empty:
+            return
+        group = rows["group"].to_numpy()
+        x = np.column_stack([np.ones(len(rows)), rows[self.features[1:]].to_numpy(dtype=float)])
+        y = rows["log_price"].to_numpy(dtype=float)
+        groups = len(self.count)
+        for i in range(x.shape[1]):
+            for j in range(i, x.shape[1]):
+                sums = sign * np.bincount(group, weights=x[:, i] * x[:, j], minlength=groups)
+                self.xtx[:, i, j] += sums
+                if i != j:
+                    self.xtx[:, j, i] += sums
+            self.xty[:, i] += sign * np.bincount(group, weights=x[:, i] * y, minlength=groups)
+        self.count += sign * np.bincount(group, minlength=groups)
+
+    def _solve(self):
+        # Every group at once: (X'X + k S) b = X'y + k S b_all, where S is the
+        # average x x' of all listings and b_all their own fit
+        size = len(self.features)
+        total = self.count.sum()
+        if total == 0:
+            return np.zeros((len(self.count), size))
+        ridge = np.eye(size) * 1e-9
+        pooled = np.linalg.solve(self.xtx.sum(axis=0) + ridge, self.xty.sum(axis=0))
+        prior = self.prior_listings * self.xtx.sum(axis=0) / total + ridge
+        return np.linalg.solve(self.xtx + prior, (self.xty + prior @ pooled)[..., None])[..., 0]
+
+def _levels(column):
+    # Distinct values of a column, sorted (the first one is the reference)
+    return sorted(column.dropna().unique())
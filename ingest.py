@@ -0,0 +1,229 @@
+"""
+Bulk ingestion of scraped listings into the scraper's Cars table.
+
+Listings come as JSONL or CSV files, one listing per line or row with the
+columns of utils.COLUMNS (missing columns are left empty). They are read in
+batches, and each batch is validated and normalized with clean_data's row
+rules (brand and model filled, posted after 2020, a price over 49 that is not
+a junk price, a mileage, mileages written in thousands fixed, models in
+uppercase), then written in one transaction of
+`INSERT ... ON CONFLICT(link) DO UPDATE` through executemany, ROWS_PER_STATEMENT
+listings per statement. Validation and normalization are vectorized; the
+batch only becomes Python values to be bound by the sqlite3 module.
+
+As with the scraper's Sequelize model, an existing listing is only updated
+(and its updatedAt bumped) when one of its values changed, and its createdAt
+is kept. Every transaction's updatedAt is later than every one already in the
+table, so the dashboard's incremental loader, which reads the rows at or past
+its watermark, picks the batch up on its next refresh. The minimum-count
+filters of clean_data depend on the whole table and are left to the loader.
+
+Throughput (tests/benchmarks/test_ingest.py): new listings are written at
+35,000 to 50,000 per second, short of the 100,000 aimed at. The limit is
+SQLite maintaining the table's indexes (the unique link and the query
+layer's four, see utils.INDEXES) on every insert: the same statements write
+about 140,000 listings per second into the table without them, and reading
+and normalizing a batch run at over 150,000 per second. Listings that did
+not change, so nothing is written, go at about 75,000 per second.
+
+Usage:
+    python ingest.py listings.jsonl more.csv [--db cars_db.sqlite] [--batch-rows 100000]
+"""
+import argparse
+import io
+import itertools
+import os
+import sqlite3
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.json as pa_json
+
+from db import BUSY_TIMEOUT, enable_wal, sql_values
+from utils import COLUMNS, DB_PATH, INTEGER_COLUMNS, clean_rows, has_brand_and_model
+
+# Listings read, validated and written (in one transaction) at a time
+BATCH_ROWS = 100_000
+
+# Listings per INSERT statement: fewer statements to run for the same listings
+ROWS_PER_STATEMENT = 64
+
+# Page cache of the writing connection, in KiB
+CACHE_SIZE_KIB = 256 * 1024
+
+# Format of Sequelize's createdAt/updatedAt in SQLite
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S.%f"
+
+# Columns written as text, whatever JSON or CSV made of them
+TEXT_COLUMNS = [column for column in COLUMNS if column not in INTEGER_COLUMNS and column != "date"]
+
+# Values compared to decide whether an existing listing changed
+UPDATED_COLUMNS = [column for column in COLUMNS if column != "link"]
+
+WRITTEN_COLUMNS = COLUMNS + ["createdAt", "updatedAt"]
+
+def upsert_statement(rows):
+    """
+    `INSERT ... ON CONFLICT(link) DO UPDATE` of `rows` listings, taking the
+    values of WRITTEN_COLUMNS of each listing in turn.
+    """
+    values = ", ".join([f"({', '.join('?' * len(WRITTEN_COLUMNS))})"] * rows)
+    return (
+        f"INSERT INTO Cars ({', '.join(WRITTEN_COLUMNS)}) VALUES {values} "
+        f"ON CONFLICT(link) DO UPDATE SET {', '.join(f'{column} = excluded.{column}' for column in UPDATED_COLUMNS)}, updatedAt = excluded.updatedAt "
+        f"WHERE ({', '.join(UPDATED_COLUMNS)}) IS NOT ({', '.join(f'excluded.{column}' for column in UPDATED_COLUMNS)})"
+    )
+
+UPSERT = upsert_statement(1)
+
+def ingest_files(paths, db_path=DB_PATH, batch_rows=BATCH_ROWS):
+    """
+    Ingest JSONL (.jsonl, .json) and CSV (.csv) files of listings. Returns
+    the number of listings read, rejected and written (inserted or changed).
+    """
+    totals = {"read": 0, "rejected": 0, "written": 0}
+    conn = connect_for_writing(db_path)
+    try:
+        for path in paths:
+            for batch in read_batches(path, batch_rows):
+                for name, count in write_batch(conn, batch).items():
+                    totals[name] += count
+    finally:
+        conn.close()
+    return totals
+
+def ingest_frame(frame, db_path=DB_PATH):
+    """
+    Ingest one frame of listings (see ingest_files).
+    """
+    conn = connect_for_writing(db_path)
+    try:
+        return write_batch(conn, frame)
+    finally:
+        conn.close()
+
+def connect_for_writing(db_path):
+    """
+    A connection to `db_path` (switched to WAL) for write_batch.
+    """
+    enable_wal(db_path)
+    conn = sqlite3.connect(db_path, timeout=BUSY_TIMEOUT, isolation_level=None)
+    # In WAL mode, commits are durable at the next checkpoint with synchronous=NORMAL
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA cache_size=-{CACHE_SIZE_KIB}")
+    return conn
+
+def read_batches(path, batch_rows=BATCH_ROWS):
+    """
+    The listings of a JSONL or CSV file, as frames of about `batch_rows` rows,
+    parsed by pyarrow with the text columns as text (numbers are parsed by
+    normalize). A JSONL batch that pyarrow cannot type (a column holding both
+    text and numbers) is parsed by pandas instead.
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension in (".jsonl", ".json"):
+        with open(path, "rb") as file:
+            while lines := list(itertools.islice(file, batch_rows)):
+                try:
+                    yield _as_text(pa_json.read_json(io.BytesIO(b"".join(lines)))).to_pandas()
+                except pa.ArrowInvalid:
+                    yield pd.read_json(io.BytesIO(b"".join(lines)), lines=True, dtype=False, convert_dates=False)
+    elif extension == ".csv":
+        # Text columns stay text (e.g. model 208), the others are inferred
+        options = pa_csv.ConvertOptions(column_types={column: pa.string() for column in TEXT_COLUMNS}, strings_can_be_null=True)
+        batches, rows = [], 0
+        for batch in pa_csv.open_csv(path, convert_options=options):
+            batches.append(batch)
+            rows += len(batch)
+            if rows >= batch_rows:
+                yield pa.Table.from_batches(batches).to_pandas()
+                batches, rows = [], 0
+        if batches:
+            yield pa.Table.from_batches(batches).to_pandas()
+    else:
+        raise ValueError(f"unsupported file type (expected .jsonl, .json or .csv): {path}")
+
+def normalize(frame):
+    """
+    The listings of `frame` that pass clean_data's row rules, normalized as
+    clean_data does, with the Cars table's columns ('date' as YYYY-MM-DD).
+    The last listing of a link repeated in the frame wins.
+    """
+    frame = frame.reindex(columns=COLUMNS).reset_index(drop=True)
+    for column in INTEGER_COLUMNS:
+        frame[column] = pd.to_numeric(frame[column], errors="coerce")
+    # Unreadable dates are rejected with the dates before 2020
+    frame["date"] = pd.to_datetime(frame["date"], errors="coerce")
+    for column in TEXT_COLUMNS:
+        values = frame[column]
+        if pd.api.types.infer_dtype(values, skipna=True) not in ("string", "empty"):
+            frame[column] = values.where(values.isna(), values.astype(str))
+    keep = has_brand_and_model(frame) & frame["link"].notna().to_numpy()
+    cleaned = clean_rows(frame, keep)
+    # In link order, which keeps the writes to the link index together
+    cleaned = cleaned[~cleaned["link"].duplicated(keep="last")].sort_values("link")
+    # Whole numbers, as Sequelize's INTEGER columns hold them
+    for column in INTEGER_COLUMNS:
+        cleaned[column] = cleaned[column].round().astype("Int64")
+    cleaned["date"] = np.datetime_as_string(cleaned["date"].to_numpy().astype("datetime64[D]"))
+    return cleaned
+
+def write_batch(conn, frame):
+    """
+    Validate, normalize and upsert one frame of listings in one transaction.
+    Returns the number of listings read, rejected (or superseded by a later
+    listing of the same link in the frame) and written.
+    """
+    listings = normalize(frame)
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        stamp = _next_timestamp(conn)
+        values = _interleaved(listings.assign(createdAt=stamp, updatedAt=stamp))
+        width = ROWS_PER_STATEMENT * len(WRITTEN_COLUMNS)
+        whole = len(values) - len(values) % width
+        changes = conn.total_changes
+        conn.executemany(upsert_statement(ROWS_PER_STATEMENT), (values[start:start + width] for start in range(0, whole, width)))
+        rest = values[whole:]
+        conn.executemany(UPSERT, (rest[start:start + len(WRITTEN_COLUMNS)] for start in range(0, len(rest), len(WRITTEN_COLUMNS))))
+        written = conn.total_changes - changes
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    return {"read": len(frame), "rejected": len(frame) - len(listings), "written": written}
+
+def _interleaved(listings):
+    # The WRITTEN_COLUMNS values of every listing in turn, as one flat list
+    values = [None] * (len(listings) * len(WRITTEN_COLUMNS))
+    for position, column in enumerate(WRITTEN_COLUMNS):
+        values[position::len(WRITTEN_COLUMNS)] = sql_values(listings[column])
+    return values
+
+def _next_timestamp(conn):
+    # Now, or just past the latest updatedAt if that is later, in Sequelize's format
+    latest = conn.execute("SELECT MAX(updatedAt) FROM Cars").fetchone()[0]
+    now = pd.Timestamp.now(tz="UTC")
+    if latest is not None:
+        now = max(now, pd.Timestamp(latest) + pd.Timedelta(milliseconds=1))
+    return now.strftime(TIMESTAMP_FORMAT)[:-3] + " +00:00"
+
+def _as_text(table):
+    # TEXT_COLUMNS of a pyarrow table as strings
+    for column in TEXT_COLUMNS:
+        index = table.schema.get_field_index(column)
+        if index >= 0 and not pa.types.is_string(table.schema.field(index).type):
+            table = table.set_column(index, column, table.column(index).cast(pa.string()))
+    return table
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("paths", nargs="+")
+    parser.add_argument("--db", default=DB_PATH)
+    parser.add_argument("--batch-rows", type=int, default=BATCH_ROWS)
+    args = parser.parse_args()
+    totals = ingest_files(args.paths, args.db, args.batch_rows)
+    print(f"{totals['read']} listings read, {totals['rejected']} rejected, {totals['written']} inserted or updated")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+"""
+Per-section instrumentation of the pages.
+
+A rerun (utils.start_rerun) records, for every `with section(...)` block run
+during it, the wall time, the number of rows going in and out and the change
+of the process's resident memory. Sections can be nested, including inside
+the shared loaders. At the end of the rerun (utils.show_rerun_stats) the
+records are appended to SECTION_LOG as JSON lines, and shown in the sidebar
+when the "Debug panel" toggle is on. From that panel, the next rerun can be
+profiled with pyinstrument when it is installed, cProfile otherwise.
+
+Outside of a rerun (benchmarks, scripts), `section` does nothing.
+"""
+import cProfile
+import datetime
+import io
+import json
+import numbers
+import os
+import pstats
+import threading
+import time
+from contextlib import contextmanager
+
+import pandas as pd
+import streamlit as st
+
+# JSON lines file the sections of every rerun are appended to (None: no log)
+SECTION_LOG = "sections.jsonl"
+
+# Functions listed in the cProfile report
+PROFILE_TOP = 30
+
+_current = threading.local()
+_log_lock = threading.Lock()
+
+class Section:
+    """
+    Record of one section of a rerun. Set its output with `output(rows)`.
+    """
+
+    def __init__(self, name, rows_in):
+        self.name = name
+        self.rows_in = rows_in
+        self.rows_out = None
+        self.seconds = None
+        self.memory_delta = None
+
+    def output(self, rows):
+        self.rows_out = _count(rows)
+
+    def record(self):
+        return {"section": self.name, "seconds": self.seconds, "rows_in": self.rows_in,
+                "rows_out": self.rows_out, "memory_delta": self.memory_delta}
+
+@contextmanager
+def section(name, rows_in=None):
+    """
+    Time the block as a section of the current rerun; `rows_in` is a frame
+    (or a number of rows). Yields the Section, whose output can be set.
+    """
+    rerun = getattr(_current, "rerun", None)
+    record = Section(name, _count(rows_in))
+    if rerun is None:
+        yield record
+        return
+    rerun.path.append(name)
+    record.name = " / ".join(rerun.path)
+    memory = _resident_memory()
+    started = time.perf_counter()
+    try:
+        yield record
+    finally:
+        record.seconds = time.perf_counter() - started
+        after = _resident_memory()
+        record.memory_delta = None if memory is None or after is None else after - memory
+        rerun.path.pop()
+        rerun.sections.append(record)
+
+class Rerun:
+    """
+    The sections of one run of a page script, in the order they ended.
+    """
+
+    def __init__(self, page):
+        self.page = page
+        self.started = time.perf_counter()
+        self.sections = []
+        self.path = []
+        self.profile = None
+        self._profiler = None
+        _current.rerun = self
+        if st.session_state.pop("profile_next_rerun", False):
+            self._start_profiler()
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def finish(self, session_bytes):
+        """
+        End the rerun: stop the profiler, log the sections and show the
+        debug panel if it is enabled.
+        """
+        elapsed = self.elapsed
+        if getattr(_current, "rerun", None) is self:
+            _current.rerun = None
+        self._stop_profiler()
+        total = Section("rerun", None)
+        total.seconds = elapsed
+        records = [record.record() for record in self.sections + [total]]
+        records[-1]["session_bytes"] = session_bytes
+        write_log(self.page, records)
+        if st.sidebar.toggle("Debug panel", key="debug_panel"):
+            self._show_panel(records)
+
+    def _show_panel(self, records):
+        table = pd.DataFrame(records).set_index("section")
+        table["ms"] = table.pop("seconds") * 1000
+        table["memory MB"] = pd.to_numeric(table.pop("memory_delta")) / 1e6
+        with st.sidebar.expander("Sections of this rerun", expanded=True):
+            st.dataframe(table[["ms", "rows_in", "rows_out", "memory MB"]].round(1), use_container_width=True)
+            st.button("Profile the next rerun", on_click=_profile_next_rerun, help="pyinstrument if installed, cProfile otherwise")
+        if self.profile is not None:
+            with st.sidebar.expander("Profile of this rerun"):
+                st.code(self.profile, language=None)
+
+    def _start_profiler(self):
+        try:
+            from pyinstrument import Profiler
+            self._profiler = Profiler()
+            self._profiler.start()
+        except ImportError:
+            self._profiler = cProfile.Profile()
+            try:
+                self._profiler.enable()
+            except ValueError:
+                # Another session is being profiled right now
+                self._profiler = None
+
+    def _stop_profiler(self):
+        profiler, self._profiler = self._profiler, None
+        if profiler is None:
+            return
+        if isinstance(profiler, cProfile.Profile):
+            profiler.disable()
+            report = io.StringIO()
+            pstats.Stats(profiler, stream=report).sort_stats("cumulative").print_stats(PROFILE_TOP)
+            self.profile = report.getvalue()
+        else:
+            profiler.stop()
+            self.profile = profiler.output_text()
+
+def _profile_next_rerun():
+    # Runs before the rerun the button triggers, which is then profiled
+    st.session_state["profile_next_rerun"] = True
+
+def write_log(page, records):
+    """
+    Append the section records of a rerun to SECTION_LOG, one JSON object per
+    line with the time, page and session.
+    """
+    if SECTION_LOG is None:
+        return
+    stamp = datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="milliseconds")
+    session = _session_id()
+    lines = "".join(json.dumps({"time": stamp, "page": page, "session": session, **record}) + "\n" for record in records)
+    with _log_lock, open(SECTION_LOG, "a", encoding="utf-8") as log:
+        log.write(lines)
+
+def _session_id():
+    from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+    ctx = get_script_run_ctx()
+    return ctx.session_id if ctx is not None else None
+
+def _count(rows):
+    # Number of rows of a frame / array, or the number itself
+    if rows is None:
+        return None
+    return int(rows) if isinstance(rows, numbers.Integral) else len(rows)
+
+def _resident_memory():
+    # Resident memory of the process in bytes (Linux only, None elsewhere)
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return None
@@ -0,0 +1,158 @@
+"""
+Inverted index of the cleaned listings for the Models page's cascading filters.
+
+For every filter column, the row ids of the shared dataset are grouped by
+value (sorted row-id arrays, stored back to back in one array per column), and
+for every range column they are sorted by value. A drill-down is then a chain
+of intersections of sorted row-id arrays, and the options of the next widget
+are read from the codes of the remaining rows: the listings themselves are only
+materialized once, for the charts and the table.
+"""
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from utils import get_dataset
+
+VALUE_COLUMNS = ["brand", "model", "year", "fuel", "gearbox", "engine"]
+RANGE_COLUMNS = ["date_int", "price", "mileage"]
+
+def get_inverted_index(dataset=None):
+    """
+    The process-wide index of `dataset` (the shared dataset by default; pages
+    pass the one they hold when other stores' row ids must match it).
+    """
+    dataset = get_dataset() if dataset is None else dataset
+    return _index_for(dataset.version, dataset.frame)
+
+@st.cache_resource(max_entries=1)
+def _index_for(version, _frame):
+    return InvertedIndex(_frame, version)
+
+class InvertedIndex:
+    """
+    Row ids are positions in `frame`, the frame of the dataset `version`.
+    Sets of rows are sorted int64 arrays; None stands for every row.
+    """
+
+    def __init__(self, frame, version=None):
+        self.frame = frame
+        self.version = version
+        self._codes = {}
+        self._values = {}
+        self._lookup = {}
+        self._postings = {}
+        self._offsets = {}
+        for column in VALUE_COLUMNS:
+            codes, uniques = _factorize(frame[column])
+            # Missing values get code 0, the values code 1..len(uniques)
+            codes = codes.astype(np.int64) + 1
+            self._codes[column] = codes
+            self._values[column] = [None] + uniques.tolist()
+            self._lookup[column] = {value: code for code, value in enumerate(self._values[column])}
+            self._postings[column] = np.argsort(codes, kind="stable")
+            self._offsets[column] = np.concatenate([[0], np.cumsum(np.bincount(codes, minlength=len(uniques) + 1))])
+        self._sorted_rows = {}
+        self._sorted_values = {}
+        for column in RANGE_COLUMNS:
+            values = frame[column].to_numpy()
+            order = np.argsort(values, kind="stable")
+            self._sorted_rows[column] = order
+            self._sorted_values[column] = values[order]
+
+    def __len__(self):
+        return len(self.frame)
+
+    def rows(self, column, value):
+        """
+        Sorted row ids of the listings whose `column` equals `value`.
+        """
+        code = self._lookup[column].get(value)
+        if code is None:
+            return np.empty(0, dtype=np.int64)
+        offsets = self._offsets[column]
+        return self._postings[column][offsets[code]:offsets[code + 1]]
+
+    def narrow(self, rows, **criteria):
+        """
+        The subset of `rows` matching every criterion. A criterion maps a
+        VALUE_COLUMNS column to a value or a list of values, or a RANGE_COLUMNS
+        column to an inclusive (low, high) pair. The most selective criteria
+        are applied first; once fewer candidates are left than listings match a
+        criterion, the candidates are checked directly instead.
+        """
+        selections = [self._select(column, wanted) for column, wanted in criteria.items()]
+        for matches, sorted_matches, keep in sorted(selections, key=lambda selection: len(selection[0])):
+            if rows is not None and len(rows) < len(matches):
+                rows = rows[keep(rows)]
+            else:
+                rows = _intersect(rows, matches if sorted_matches else np.sort(matches))
+        return np.arange(len(self.frame)) if rows is None else rows
+
+    def _select(self, column, wanted):
+        # (row ids matching the criterion, whether they are sorted, test of the criterion on given rows)
+        if column in RANGE_COLUMNS:
+            low, high = wanted
+            values = self._sorted_values[column]
+            matches = self._sorted_rows[column][np.searchsorted(values, low, "left"):np.searchsorted(values, high, "right")]
+            column_values = self.frame[column].to_numpy()
+            return matches, False, lambda rows: (column_values[rows] >= low) & (column_values[rows] <= high)
+        if not isinstance(wanted, (list, tuple, set, np.ndarray)):
+            wanted = [wanted]
+        codes = [self._lookup[column][value] for value in wanted if value in self._lookup[column]]
+        offsets = self._offsets[column]
+        postings = self._postings[column]
+        matches = np.concatenate([postings[offsets[code]:offsets[code + 1]] for code in codes]) if codes else postings[:0]
+        return matches, len(codes) <= 1, lambda rows: np.isin(self._codes[column][rows], codes)
+
+    def options(self, column, rows=None):
+        """
+        Sorted distinct values of `column` among `rows` (None for missing
+        values, listed last).
+        """
+        codes = self._codes[column] if rows is None else self._codes[column][rows]
+        present = np.flatnonzero(np.bincount(codes, minlength=len(self._values[column])))
+        values = [self._values[column][code] for code in present if code > 0]
+        return values + [None] if len(present) and present[0] == 0 else values
+
+    def bounds(self, column, rows=None):
+        """
+        (min, max) of a RANGE_COLUMNS column among `rows`, None when empty.
+        """
+        if rows is None:
+            values = self._sorted_values[column]
+            return (values[0], values[-1]) if len(values) else None
+        if len(rows) == 0:
+            return None
+        values = self.frame[column].to_numpy()[rows]
+        return values.min(), values.max()
+
+    def take(self, rows):
+        """
+        The listings of `rows`, in dataset order.
+        """
+        return self.frame.take(rows)
+
+def _factorize(column):
+    # Sorted distinct values and the code of every row (-1 when missing)
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        codes, categories = column.array.codes, column.cat.categories
+        if categories.is_monotonic_increasing:
+            return codes, categories
+        # Categories merged by an incremental refresh can come in any order
+        order = categories.argsort()
+        ranks = np.empty(len(order) + 1, dtype=np.int64)
+        ranks[order] = np.arange(len(order))
+        ranks[-1] = -1
+        return ranks[codes], categories[order]
+    return pd.factorize(column, sort=True)
+
+def _intersect(rows, other):
+    # Intersection of two sorted row-id arrays, by binary search of the shorter one in the longer one
+    if rows is None:
+        return other
+    small, large = (rows, other) if len(rows) <= len(other) else (other, rows)
+    positions = np.searchsorted(large, small)
+    found = positions < len(large)
+    found[found] = large[positions[found]] == small[found]
+    return small[found]
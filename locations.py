@@ -0,0 +1,157 @@
+"""
+Prices of the same model across wilayas, for the Locations page.
+
+The listings of a dataset version are summarized once per (brand, model,
+wilaya) cell and per (brand, model) over every wilaya (the national reference
+of its cells): count, mean and QUANTILES of the price. Each level is one sort
+of (group, price) integer keys, after which every quantile of every group is
+read at its position. The page's matrix and map only select and pivot these
+cells, so no listing is read again until the next version.
+"""
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from utils import get_dataset
+from dedup import get_duplicates
+
+QUANTILES = {"q10": 0.1, "q25": 0.25, "median": 0.5, "q75": 0.75, "q90": 0.9}
+
+# Cells with fewer listings are left out of the matrix and the map by default
+MIN_CELL_LISTINGS = 5
+
+# Name and (latitude, longitude) of the chief town of each wilaya code
+WILAYAS = {
+    1: ("Adrar", 27.87, -0.29), 2: ("Chlef", 36.16, 1.33), 3: ("Laghouat", 33.80, 2.87),
+    4: ("Oum El Bouaghi", 35.87, 7.11), 5: ("Batna", 35.56, 6.17), 6: ("Béjaïa", 36.75, 5.06),
+    7: ("Biskra", 34.85, 5.73), 8: ("Béchar", 31.62, -2.22), 9: ("Blida", 36.47, 2.83),
+    10: ("Bouira", 36.37, 3.90), 11: ("Tamanrasset", 22.79, 5.52), 12: ("Tébessa", 35.40, 8.12),
+    13: ("Tlemcen", 34.88, -1.32), 14: ("Tiaret", 35.37, 1.32), 15: ("Tizi Ouzou", 36.72, 4.05),
+    16: ("Alger", 36.75, 3.06), 17: ("Djelfa", 34.67, 3.26), 18: ("Jijel", 36.82, 5.77),
+    19: ("Sétif", 36.19, 5.41), 20: ("Saïda", 34.83, 0.15), 21: ("Skikda", 36.88, 6.91),
+    22: ("Sidi Bel Abbès", 35.19, -0.63), 23: ("Annaba", 36.90, 7.77), 24: ("Guelma", 36.46, 7.43),
+    25: ("Constantine", 36.37, 6.61), 26: ("Médéa", 36.26, 2.75), 27: ("Mostaganem", 35.93, 0.09),
+    28: ("M'Sila", 35.70, 4.54), 29: ("Mascara", 35.40, 0.14), 30: ("Ouargla", 31.95, 5.33),
+    31: ("Oran", 35.70, -0.63), 32: ("El Bayadh", 33.68, 1.02), 33: ("Illizi", 26.48, 8.47),
+    34: ("Bordj Bou Arréridj", 36.07, 4.76), 35: ("Boumerdès", 36.76, 3.48), 36: ("El Tarf", 36.77, 8.31),
+    37: ("Tindouf", 27.67, -8.15), 38: ("Tissemsilt", 35.61, 1.81), 39: ("El Oued", 33.37, 6.86),
+    40: ("Khenchela", 35.44, 7.14), 41: ("Souk Ahras", 36.29, 7.95), 42: ("Tipaza", 36.59, 2.45),
+    43: ("Mila", 36.45, 6.26), 44: ("Aïn Defla", 36.26, 1.97), 45: ("Naâma", 33.27, -0.31),
+    46: ("Aïn Témouchent", 35.30, -1.14), 47: ("Ghardaïa", 32.49, 3.67), 48: ("Relizane", 35.74, 0.56),
+    49: ("Timimoun", 29.26, 0.24), 50: ("Bordj Badji Mokhtar", 21.33, 0.95), 51: ("Ouled Djellal", 34.42, 5.07),
+    52: ("Béni Abbès", 30.13, -2.17), 53: ("In Salah", 27.19, 2.46), 54: ("In Guezzam", 19.57, 5.77),
+    55: ("Touggourt", 33.10, 6.06), 56: ("Djanet", 24.55, 9.48), 57: ("El M'Ghair", 33.95, 5.92),
+    58: ("El Meniaa", 30.58, 2.88),
+}
+
+def get_location_stats(deduplicated=False):
+    """
+    The process-wide location summaries of the current dataset version (of
+    its deduplicated listings when asked, see dedup.py).
+    """
+    dataset = get_dataset()
+    return _stats_for(dataset.version, deduplicated, dataset)
+
+@st.cache_resource(max_entries=2)
+def _stats_for(version, deduplicated, _dataset):
+    return LocationStats(_dataset.frame.take(get_duplicates(_dataset).kept) if deduplicated else _dataset.frame)
+
+class LocationStats:
+    """
+    `cells` has one row per (brand, model, wilaya) and `models` one row per
+    (brand, model), both with the listings' count, mean and QUANTILES of the
+    price; `cells` also has the premium of its median over the model's.
+    """
+
+    def __init__(self, frame):
+        prices = frame["price"].to_numpy(dtype=np.int64)
+        brand_codes, brands = pd.factorize(frame["brand"])
+        model_codes, models = pd.factorize(frame["model"])
+        # Codes of the wilayas in ascending order, whatever their values
+        wilaya_codes, wilayas = pd.factorize(frame["wilaya"], sort=True)
+        wilayas = np.asarray(wilayas, dtype=np.int64)
+        valid = (brand_codes >= 0) & (model_codes >= 0)
+        # Dense ids of the (brand, model) pairs and of the (pair, wilaya) cells
+        pair, pairs = _dense_ids(np.where(valid, brand_codes * len(models) + model_codes, -1), len(brands) * len(models))
+        in_cell = (pair >= 0) & (wilaya_codes >= 0)
+        cell, cells = _dense_ids(np.where(in_cell, pair * len(wilayas) + wilaya_codes, -1), len(pairs) * len(wilayas))
+        self.models = _summary(pair, prices, pd.DataFrame({
+            "brand": np.asarray(brands)[pairs // len(models)],
+            "model": np.asarray(models)[pairs % len(models)],
+        }))
+        cell_pairs = cells // max(len(wilayas), 1)
+        self.cells = _summary(cell, prices, pd.DataFrame({
+            "brand": self.models["brand"].to_numpy()[cell_pairs],
+            "model": self.models["model"].to_numpy()[cell_pairs],
+            "wilaya": wilayas[cells % max(len(wilayas), 1)],
+        }))
+        self.cells["premium"] = self.cells["median"] / self.models["median"].to_numpy()[cell_pairs] - 1
+
+    def top_models(self, n, brand=None):
+        """
+        The `n` (brand, model) pairs with the most listings, of `brand` when given.
+        """
+        models = self.models if brand is None else self.models[self.models["brand"] == brand]
+        top = models.sort_values(["count", "brand", "model"], ascending=[False, True, True]).head(n)
+        return list(zip(top["brand"], top["model"]))
+
+    def matrix(self, models, value="median", min_listings=MIN_CELL_LISTINGS):
+        """
+        `value` of the cells of `models` ((brand, model) pairs), one row per
+        model in the given order and one column per wilaya with a cell of at
+        least `min_listings` listings.
+        """
+        cells = self._cells(models, min_listings)
+        matrix = cells.pivot_table(index="label", columns="wilaya", values=value, observed=True, aggfunc="first")
+        labels = [f"{brand} {model}" for brand, model in models]
+        matrix = matrix.reindex([label for label in labels if label in matrix.index])
+        matrix.columns = [wilaya_label(wilaya) for wilaya in matrix.columns]
+        return matrix
+
+    def by_wilaya(self, brand, model, min_listings=MIN_CELL_LISTINGS):
+        """
+        The cells of one model with the name and coordinates of their wilaya,
+        by number of listings.
+        """
+        cells = self._cells([(brand, model)], min_listings).drop(columns="label")
+        known = cells["wilaya"].map(lambda wilaya: WILAYAS.get(int(wilaya), (None, np.nan, np.nan)))
+        cells["name"] = [name for name, _, _ in known]
+        cells["latitude"] = [latitude for _, latitude, _ in known]
+        cells["longitude"] = [longitude for _, _, longitude in known]
+        return cells.sort_values(["count", "wilaya"], ascending=[False, True], ignore_index=True)
+
+    def _cells(self, models, min_listings):
+        selected = pd.MultiIndex.from_frame(self.cells[["brand", "model"]]).isin(list(models))
+        cells = self.cells[selected & (self.cells["count"] >= min_listings)]
+        return cells.assign(label=cells["brand"].astype(str) + " " + cells["model"].astype(str))
+
+def wilaya_label(wilaya):
+    """
+    "16 Alger" for 16 (the code alone for unknown codes).
+    """
+    wilaya = int(wilaya)
+    return f"{wilaya} {WILAYAS[wilaya][0]}" if wilaya in WILAYAS else str(wilaya)
+
+def _dense_ids(keys, size):
+    # Ids 0..n-1 of the distinct keys in 0..size-1 (in key order), -1 kept for
+    # the rows without a key, and the distinct keys
+    present = np.bincount(keys[keys >= 0], minlength=size) > 0
+    ids = np.cumsum(present) - 1
+    return np.where(keys >= 0, ids[np.maximum(keys, 0)], -1), np.flatnonzero(present)
+
+def _summary(groups, prices, keys):
+    # `keys` plus the count, mean and QUANTILES of the prices of each group
+    # (-1: no group), read at their positions once the prices are sorted by
+    # (group, price); quantiles are interpolated as pandas does
+    order = np.argsort((groups << 32) | prices)
+    order = order[groups[order] >= 0]
+    groups, prices = groups[order], prices[order].astype(float)
+    counts = np.bincount(groups, minlength=len(keys))
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    summary = keys.assign(count=counts, mean=np.bincount(groups, weights=prices, minlength=len(keys)) / np.maximum(counts, 1))
+    for name, quantile in QUANTILES.items():
+        position = starts + quantile * (counts - 1)
+        low = np.floor(position).astype(np.int64)
+        high = np.ceil(position).astype(np.int64)
+        summary[name] = prices[low] + (prices[high] - prices[low]) * (position - low)
+    return summary
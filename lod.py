@@ -0,0 +1,99 @@
+"""
+Level of detail for the charts of large listings.
+
+Up to a few thousand listings, the scatter plots and histograms draw every
+value. Above that, a scatter plot becomes a density grid (listings counted per
+cell with NumPy, empty cells left blank) and a histogram is drawn from counts
+binned with NumPy, its KDE being the binned counts smoothed by a Gaussian
+kernel instead of a kernel evaluated at every value. Render time then depends
+on the grid, not on the number of listings. `exact=True` always draws every
+value. Boxplots have their own summaries (see sketches.py). seaborn and
+matplotlib are imported by the draw functions, when a chart is actually drawn.
+"""
+import numpy as np
+
+# Above this many points, a scatter plot is drawn as a density grid
+LOD_MAX_POINTS = 5_000
+
+# Above this many values, a histogram and its KDE are computed from binned counts
+LOD_MAX_VALUES = 20_000
+
+# Default of the "Exact charts" setting of the pages
+FORCE_EXACT = False
+
+# Cells per axis of the density grid
+GRID_SIZE = 60
+
+# Bars of a binned histogram, and bins of its KDE per bar
+HIST_BINS = 64
+KDE_BINS_PER_BAR = 16
+
+def draw_scatter(ax, x, y, exact=False, alpha=0.6):
+    """
+    Scatter plot of y against x on ax, as a density grid above LOD_MAX_POINTS
+    points unless `exact`.
+    """
+    from matplotlib.colors import LogNorm
+
+    x, y = _finite(x, y)
+    if exact or len(x) <= LOD_MAX_POINTS:
+        ax.scatter(x, y, alpha=alpha)
+        return
+    counts, x_edges, y_edges = np.histogram2d(x, y, bins=GRID_SIZE)
+    mesh = ax.pcolormesh(x_edges, y_edges, np.ma.masked_equal(counts.T, 0), cmap="Blues", norm=LogNorm())
+    ax.figure.colorbar(mesh, ax=ax, label="Listings")
+
+def draw_histogram(ax, values, exact=False, color=None):
+    """
+    Histogram of `values` (a Series) with its KDE on ax, like
+    sns.histplot(kde=True), from binned counts above LOD_MAX_VALUES values
+    unless `exact`.
+    """
+    if exact or values.count() <= LOD_MAX_VALUES:
+        import seaborn as sns
+
+        sns.histplot(values, kde=True, ax=ax, color=color)
+        return
+    from matplotlib.colors import to_rgba
+
+    (finite,) = _finite(values)
+    counts, edges = np.histogram(finite, bins=HIST_BINS * KDE_BINS_PER_BAR)
+    density = binned_kde(counts, edges, scott_bandwidth(finite))
+    bars = counts.reshape(HIST_BINS, KDE_BINS_PER_BAR).sum(axis=1)
+    bar_edges = edges[::KDE_BINS_PER_BAR]
+    color = color or "C0"
+    ax.bar(bar_edges[:-1], bars, width=np.diff(bar_edges), align="edge", color=to_rgba(color, 0.5), edgecolor=to_rgba("black", 0.75), linewidth=0.5)
+    # Density scaled to the bar counts, as seaborn does
+    ax.plot((edges[:-1] + edges[1:]) / 2, density * len(finite) * (bar_edges[1] - bar_edges[0]), color=color)
+    ax.set_xlabel(values.name)
+    ax.set_ylabel("Count")
+
+def scott_bandwidth(values):
+    """
+    Bandwidth of a Gaussian KDE by Scott's rule, as scipy and seaborn use.
+    """
+    return values.std(ddof=1) * len(values) ** (-1 / 5) if len(values) > 1 else 0.0
+
+def binned_kde(counts, edges, bandwidth):
+    """
+    Density at the bin centers of a Gaussian KDE of the binned values: the
+    counts convolved with the kernel sampled at the bin width.
+    """
+    width = edges[1] - edges[0]
+    total = counts.sum()
+    if total == 0:
+        return np.zeros(len(counts))
+    sigma = bandwidth / width
+    if sigma <= 0:
+        return counts / (total * width)
+    radius = min(int(np.ceil(4 * sigma)), len(counts))
+    offsets = np.arange(-radius, radius + 1)
+    kernel = np.exp(-0.5 * (offsets / sigma) ** 2)
+    kernel /= kernel.sum()
+    return np.convolve(counts, kernel)[radius:radius + len(counts)] / (total * width)
+
+def _finite(*columns):
+    # The columns as float arrays, without the rows missing in any of them
+    arrays = [np.asarray(column, dtype=float) for column in columns]
+    keep = np.logical_and.reduce([np.isfinite(array) for array in arrays])
+    return [array[keep] for array in arrays]
@@ -0,0 +1,118 @@
+"""
+Charts of one model's listings on the Models page, and the drill-down the page
+shows before any filter is changed.
+
+The draw functions live here rather than in the page so that the background
+warm-up (warmup.py) renders the very charts the page asks the chart cache for:
+a chart is cached under its draw function's file and code and its arguments
+(see charts.py).
+"""
+import pandas as pd
+
+from lod import draw_histogram, draw_scatter
+from sketches import draw_boxplot, quantiles
+
+def default_window(index):
+    """
+    The page's default date window: the last month of listings, as the
+    (start, end) dates of its date inputs.
+    """
+    max_date = pd.Timestamp('1970-01-01') + pd.Timedelta(days=int(index.bounds('date_int')[1]))
+    return (max_date - pd.DateOffset(months=1)).date(), max_date.date()
+
+def day(date):
+    # Same unit as the 'date_int' column
+    return (pd.Timestamp(date) - pd.Timestamp('1970-01-01')) // pd.Timedelta('1D')
+
+def default_listings(index, brand, model, start, end):
+    """
+    The listings of `brand` and `model` in the date window as the page selects
+    them when every year, fuel, gearbox and engine is kept, and the values
+    offered for each of these. Returns (listings, options by column, whether
+    the mileage range dropped listings, those without a mileage).
+    """
+    rows = index.narrow(None, date_int=(day(start), day(end)))
+    if not len(rows):
+        return index.take(rows), {}, False
+    rows = index.narrow(rows, price=tuple(map(int, index.bounds('price', rows))))
+    rows = index.narrow(rows, brand=brand)
+    rows = index.narrow(rows, model=model)
+    options = {'year': index.options('year', rows)}
+    rows = index.narrow(rows, year=options['year'])
+    narrowed = False
+    if len(rows):
+        lowest, highest = index.bounds('mileage', rows)
+        if lowest != highest:
+            in_range = index.narrow(rows, mileage=(int(lowest), int(highest)))
+            narrowed = len(in_range) != len(rows)
+            rows = in_range
+    for column in ['fuel', 'gearbox', 'engine']:
+        if len(rows):
+            options[column] = index.options(column, rows)
+            rows = index.narrow(rows, **{column: options[column]})
+    return index.take(rows), options, narrowed
+
+def known(options):
+    """
+    The options of a fair price input: the values of the listings without
+    the missing one (a listing of unknown year, fuel or gearbox is not priced).
+    """
+    return [value for value in options if value is not None]
+
+def without_outliers(models_list, price_query=None, mileage_query=None):
+    """
+    The listings whose price and mileage lie within 1.5 IQR of their quartiles
+    (from the sketches for large listings the queries describe, see
+    sketches.quantiles).
+    """
+    Q1_price, Q3_price = quantiles(models_list, 'price', [0.25, 0.75], price_query)
+    IQR_price = Q3_price - Q1_price
+
+    Q1_mileage, Q3_mileage = quantiles(models_list, 'mileage', [0.25, 0.75], mileage_query)
+    IQR_mileage = Q3_mileage - Q1_mileage
+
+    return models_list[
+        (models_list['price'] >= Q1_price - 1.5 * IQR_price) &
+        (models_list['price'] <= Q3_price + 1.5 * IQR_price) &
+        (models_list['mileage'] >= Q1_mileage - 1.5 * IQR_mileage) &
+        (models_list['mileage'] <= Q3_mileage + 1.5 * IQR_mileage)]
+
+def chart_calls(models_list, filtered_models_list, price_query, exact):
+    """
+    The charts of a model's listings, in page order, as (draw, args, options)
+    for show_chart / render_chart.
+    """
+    return [
+        (price_boxplot, (models_list[['price']], price_query, exact), {}),
+        (price_by_year, (models_list[['year', 'price']], price_query, exact), dict(figsize=(12, 6))),
+        (price_histogram, (models_list['price'], exact), {}),
+        (price_vs_mileage, (filtered_models_list[['mileage', 'price']], exact), dict(figsize=(10, 6))),
+    ]
+
+def price_boxplot(ax, data, query, exact):
+    draw_boxplot(ax, data, 'price', query=query, exact=exact)  # Create a boxplot
+    ax.set_title('Price Distribution')  # Add a title to the plot
+
+def price_by_year(ax, data, query, exact):
+    draw_boxplot(ax, data, 'price', 'year', query=query, exact=exact)
+    ax.set_title("Price Distribution by Year")
+    ax.set_xticklabels(ax.get_xticklabels(), rotation=45)  # Rotate Year labels for readability
+
+def price_histogram(ax, prices, exact):
+    draw_histogram(ax, prices, exact, color='blue')
+    ax.set_title("Price Distribution")
+
+# Scatter plot with Matplotlib (a density grid for large listings)
+def price_vs_mileage(ax, data, exact):
+    draw_scatter(ax, data['mileage'], data['price'], exact, alpha=0.6)
+    ax.set_title("Price vs. Mileage")
+    ax.set_xlabel("Mileage")
+    ax.set_ylabel("Price")
+
+def depreciation_curve(ax, curve, age, expected):
+    ax.plot(curve['age'], curve['expected price'], marker='o')
+    ax.scatter([age], [expected], color='red', zorder=3, label='Selected car')
+    ax.set_title("Depreciation (average mileage for the age)")
+    ax.set_xlabel("Age (years)")
+    ax.set_ylabel("Expected price")
+    ax.legend()
@@ -1,36 +1,61 @@
 import streamlit as st
 import pandas as pd
-import seaborn as sns
-import matplotlib.pyplot as plt
-import sqlite3
-import io
-import mplcursors
-import plotly.express as px
-from utils import load_data_from_db, clean_data, convert_df_to_excel
+import numpy as np
+from utils import start_rerun, show_rerun_stats
+from export import EXPORT_FORMATS, export_bytes, frame_chunks
+from inverted_index import get_inverted_index
+from charts import show_chart
+from lod import FORCE_EXACT
+from model_charts import chart_calls, depreciation_curve, known, without_outliers
+from fair_price import get_fair_prices
+from dedup import get_duplicates
+from instrumentation import section
 
 
+rerun = start_rerun("Models")
+
 st.title("Models Analysis")
 
-# Load and clean the data
-data = load_data_from_db()
-data = clean_data(data)
-data['date_int'] = (data['date'] - pd.Timestamp('1970-01-01')) // pd.Timedelta('1D')
+# Each filter below narrows a set of row ids with the inverted index of the
+# shared dataset (see inverted_index.py); the widget options come from the
+# index too, and the listings are only materialized once at the end
+with section("index") as timing:
+    index = get_inverted_index()
+    timing.output(len(index))
+first_day, last_day = index.bounds('date_int')
+min_date = pd.Timestamp('1970-01-01') + pd.Timedelta(days=int(first_day))
+max_date = pd.Timestamp('1970-01-01') + pd.Timedelta(days=int(last_day))
 # Add a date range filter using Streamlit's date_input
 st.sidebar.subheader("Select Date Range")
 
-start = st.sidebar.date_input("From:", data['date'].max() - pd.DateOffset(months=1),min_value=data['date'].min(),max_value=data['date'].max())
-end = st.sidebar.date_input("To:", data['date'].max(),start,max_value=data['date'].max())
+start = st.sidebar.date_input("From:", max_date - pd.DateOffset(months=1),min_value=min_date,max_value=max_date)
+end = st.sidebar.date_input("To:", max_date,start,max_value=max_date)
+
+def day(date):
+    # Same unit as the 'date_int' column
+    return (pd.Timestamp(date) - pd.Timestamp('1970-01-01')) // pd.Timedelta('1D')
+
+# The same car posted again under a new link counts once (see dedup.py)
+deduplicated = st.sidebar.checkbox("Deduplicated", value=False, help="Keep only the latest listing of each group of near-duplicate listings")
+rows = None
+if deduplicated:
+    with section("deduplicate", len(index)) as timing:
+        rows = get_duplicates(index).kept
+        timing.output(rows)
 
-data= data[data['date'] >= f"{start}"]
-data= data[data['date'] <= f"{end}"]
+with section("date filter", len(index) if rows is None else rows) as timing:
+    rows = index.narrow(rows, date_int=(day(start), day(end)))
+    timing.output(rows)
 
-st.write("Filtred Data per Posting Year:",data.shape[0])
+st.write("Filtred Data per Posting Year:",len(rows))
+
+# Large listings are charted from binned counts unless exact charts are asked for (see lod.py)
+exact_charts = st.sidebar.checkbox("Exact charts", value=FORCE_EXACT, help="Draw every listing, even for large selections (slower)")
 # ---------------------------------------------------------------------
 # Price range filter
 st.subheader("Select Price Range")
 
-min_price = int(data['price'].min())
-max_price = int(data['price'].max())
+min_price, max_price = map(int, index.bounds('price', rows))
 
 price_range = st.slider(
     "Price Range",
@@ -41,9 +66,11 @@ price_range = st.slider(
 )
 
 # Apply the filter
-data = data[(data['price'] >= price_range[0]) & (data['price'] <= price_range[1])]
+with section("price filter", rows) as timing:
+    rows = index.narrow(rows, price=price_range)
+    timing.output(rows)
 
-st.write("Filtered Data after Date & Price Range:", data.shape[0])
+st.write("Filtered Data after Date & Price Range:", len(rows))
 
 
 # ---------------------------------------------------------------------
@@ -53,68 +80,86 @@ model = None
 
 brand = st.selectbox(
     "Select a Brand ...",
-    sorted(data['brand'].unique()),
+    index.options('brand', rows),
     index=None,
     placeholder="Select a Brand ...",
 )
 
 
 if brand:
-    models_list = data[data['brand'] == brand]
+    rows = index.narrow(rows, brand=brand)
     model = st.selectbox(
         "Select a Model ...",
-        sorted(models_list['model'].unique()),
+        index.options('model', rows),
         index=None,
         placeholder="Select a Model ...",
         )
 
+# Set when a filter the quantile sketches do not know about narrows the listing
+narrowed = deduplicated
+
 if model:
-    models_list = models_list[models_list['model'] == model]
+    rows = index.narrow(rows, model=model)
 
+    years = index.options('year', rows)
     selected_years = st.multiselect(
     "Select Years to include in the boxplot",
-    options=models_list['year'].unique(),
-    default=sorted(models_list['year'].unique()))
+    options=years,
+    default=years)
      # Filter data based on selected year
-    models_list = models_list[models_list['year'].isin(selected_years)]
+    rows = index.narrow(rows, year=selected_years)
 
-    if not models_list.empty:
-        if models_list['mileage'].min() == models_list['mileage'].max():
-            st.write('Mileage available:', models_list['mileage'].min())
+    if len(rows):
+        lowest, highest = index.bounds('mileage', rows)
+        if lowest == highest:
+            st.write('Mileage available:', lowest)
         else:
             # Proceed with the slider
             (min_mileage,max_mileage) = st.slider(
                 "Select a range of Mileage", 
-                models_list['mileage'].min(), 
-                models_list['mileage'].max(),
-                (models_list['mileage'].min(), models_list['mileage'].max())
+                int(lowest), 
+                int(highest),
+                (int(lowest), int(highest))
             )
-            models_list = models_list[models_list['mileage']>=min_mileage]
-            models_list = models_list[models_list['mileage']<=max_mileage]
+            in_range = index.narrow(rows, mileage=(min_mileage, max_mileage))
+            # Listings without a mileage are not in any range either
+            narrowed |= len(in_range) != len(rows)
+            rows = in_range
 
-    if not models_list.empty:
+    if len(rows):
+        fuels = index.options('fuel', rows)
         selected_fuels = st.multiselect(
         "Select Fuel to include in the boxplot",
-        options=models_list['fuel'].unique(),
-        default=models_list['fuel'].unique())
+        options=fuels,
+        default=fuels)
         # Filter data based on selected fuel
-        models_list = models_list[models_list['fuel'].isin(selected_fuels)]
+        narrowed |= len(selected_fuels) != len(fuels)
+        rows = index.narrow(rows, fuel=selected_fuels)
     
-    if not models_list.empty:
+    if len(rows):
+        gearboxes = index.options('gearbox', rows)
         selected_gearboxs = st.multiselect(
         "Select Gearbox to include in the boxplot",
-        options=models_list['gearbox'].unique(),
-        default=models_list['gearbox'].unique())
+        options=gearboxes,
+        default=gearboxes)
         # Filter data based on selected gearbox
-        models_list = models_list[models_list['gearbox'].isin(selected_gearboxs)]
+        narrowed |= len(selected_gearboxs) != len(gearboxes)
+        rows = index.narrow(rows, gearbox=selected_gearboxs)
 
-    if not models_list.empty:
+    if len(rows):
+        engines = index.options('engine', rows)
         selected_engines = st.multiselect(
         "Select Engines to include in the boxplot",
-        options=models_list['engine'].unique(),
-        default=models_list['engine'].unique())
+        options=engines,
+        default=engines)
         # Filter data based on selected engine
-        models_list = models_list[models_list['engine'].isin(selected_engines)]
+        narrowed |= len(selected_engines) != len(engines)
+        rows = index.narrow(rows, engine=selected_engines)
+
+    # The only copy of the selected listings
+    with section("take listings", rows) as timing:
+        models_list = index.take(rows)
+        timing.output(models_list)
 
 
     
@@ -127,58 +172,55 @@ if model is not None and brand is not None:
 
         st.write("N° of rows:", models_list.shape[0])
 
-        sns.boxplot(x=models_list['price'])
-
-        fig, ax = plt.subplots()  # Create a matplotlib figure and axis
-        sns.boxplot(x=models_list['price'], ax=ax)  # Create a boxplot with seaborn
-        ax.set_title('Price Distribution')  # Add a title to the plot
-
-        # Display the plot in Streamlit
-        st.pyplot(fig)
-
-    
-        # Create a matplotlib figure
-        fig, ax = plt.subplots(figsize=(12, 6))  # Adjust size as needed
-
-        # Plot the boxplot
-        sns.boxplot(x='year', y='price', data=models_list, ax=ax)
-        
-        # Customize the plot
-        ax.set_title("Price Distribution by Year")
-        ax.set_xticklabels(ax.get_xticklabels(), rotation=45)  # Rotate Year labels for readability
-
-        # Display the plot in Streamlit
-        st.pyplot(fig)
-
-        fig, ax = plt.subplots()
-        sns.histplot(models_list['price'], kde=True, ax=ax, color='blue')
-        ax.set_title("Price Distribution")
-        st.pyplot(fig)
-
-        Q1_price = models_list['price'].quantile(0.25)
-        Q3_price = models_list['price'].quantile(0.75)
-        IQR_price = Q3_price - Q1_price
-
-        Q1_mileage = models_list['mileage'].quantile(0.25)
-        Q3_mileage = models_list['mileage'].quantile(0.75)
-        IQR_mileage = Q3_mileage - Q1_mileage
-
-        # Filter out outliers
-        filtered_models_list = models_list[
-            (models_list['price'] >= Q1_price - 1.5 * IQR_price) & 
-            (models_list['price'] <= Q3_price + 1.5 * IQR_price) &
-            (models_list['mileage'] >= Q1_mileage - 1.5 * IQR_mileage) & 
-            (models_list['mileage'] <= Q3_mileage + 1.5 * IQR_mileage)]
-        # Scatter plot with Matplotlib
-        fig, ax = plt.subplots(figsize=(10, 6))
-        ax.scatter(filtered_models_list['mileage'], filtered_models_list['price'], alpha=0.6)
-        ax.set_title("Price vs. Mileage")
-        ax.set_xlabel("Mileage")
-        ax.set_ylabel("Price")
-        st.pyplot(fig)
+        # Describes models_list to the quantile sketches, which large listings
+        # use instead of sorting every value (see sketches.draw_boxplot)
+        price_window = None if price_range == (min_price, max_price) else price_range
+        # (every year of the model selected, the year is no filter: the sketches of the model answer)
+        years_query = {} if len(selected_years) == len(years) else dict(year=selected_years)
+        sketch_query = None if narrowed else dict(version=index.version, date_range=(start, end), brand=brand, model=model, **years_query)
+        price_query = None if sketch_query is None else dict(sketch_query, price_range=price_window)
+        mileage_query = None if price_window is not None else sketch_query
+
+        with section("outlier filter", models_list) as timing:
+            filtered_models_list = without_outliers(models_list, price_query, mileage_query)
+            timing.output(filtered_models_list)
+
+        # Each chart is drawn by a function of its inputs and cached on them
+        # (see charts.py); the warm-up renders those of the most listed models
+        # (see model_charts.py and warmup.py)
+        for draw, args, options in chart_calls(models_list, filtered_models_list, price_query, exact_charts):
+            show_chart(draw, *args, **options)
+
+        # Expected price from the regression of every listing of the model (see fair_price.py)
+        st.subheader("Fair Price")
+        with section("fair price model"):
+            fair_prices = get_fair_prices()
+        fair_years = known(years)
+        if fair_prices.listings(brand, model) and fair_years:
+            columns = st.columns(4)
+            fair_year = columns[0].selectbox("Year", fair_years, index=len(fair_years) - 1)
+            fair_mileage = columns[1].number_input("Mileage", min_value=0, value=int(models_list['mileage'].median()), step=5000)
+            fair_fuel = columns[2].selectbox("Fuel", known(fuels))
+            fair_gearbox = columns[3].selectbox("Gearbox", known(gearboxes))
+            with section("fair price"):
+                age = max(max_date.year - int(fair_year), 0)
+                expected = fair_prices.expected_price(brand, model, age, fair_mileage, fair_fuel, fair_gearbox)
+                fit = fair_prices.fit(brand, model)
+                curve = fair_prices.depreciation(brand, model, fair_fuel, fair_gearbox)
+            st.metric("Expected price", f"{expected:,.0f}")
+            st.caption(f"Fitted on {fair_prices.listings(brand, model)} listings: "
+                       f"{(1 - np.exp(fit['age'])) * 100:.1f}% per year of age, "
+                       f"{(1 - np.exp(fit['mileage'])) * 100:.1f}% per 100,000 km.")
+
+            show_chart(depreciation_curve, curve, age, expected, figsize=(10, 5))
+        elif fair_years:
+            st.write("No listing to fit the fair price of this model on.")
+        else:
+            st.write("No listing of a known year to price.")
 
         st.write("Listing of the cars:")
-        st.write(models_list)
+        with section("listing table", models_list):
+            st.write(models_list)
     else:
         st.write("No data available for the selected.")
 
@@ -188,15 +230,20 @@ if model is not None and brand is not None:
 # --------------------------------------------------------------
 # Provide an option to download the cleaned data
 st.header("Export Data")
-if st.button("Download Cleaned Data as Excel"):
-    excel_data = convert_df_to_excel(models_list)
+export_format = st.selectbox("Format", list(EXPORT_FORMATS))
+if st.button("Download Cleaned Data"):
+    extension, mime = EXPORT_FORMATS[export_format]
+    with section("export", models_list):
+        export_data = export_bytes(frame_chunks(models_list), export_format)
     st.download_button(
-        label="Download Excel",
-        data=excel_data,
-        file_name="cleaned_car_data.xlsx",
-        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+        label=f"Download {extension.upper()}",
+        data=export_data,
+        file_name=f"cleaned_car_data.{extension}",
+        mime=mime
     )
 
 # Footer
 st.write("Built with ❤️ using Streamlit!")
 
+show_rerun_stats(rerun, globals())
+
@@ -1,15 +1,26 @@
 import streamlit as st
-import pandas as pd
-import seaborn as sns
-import matplotlib.pyplot as plt
-import plotly.express as px
-from utils import load_data_from_db, clean_data
+from utils import get_dataset, start_rerun, show_rerun_stats
+from rollups import frame_summary, get_rollup
+from dedup import get_duplicates
+from charts import show_chart
+from instrumentation import section
+
+rerun = start_rerun("Price Analysis")
 
 st.title("💰 Price Range Analysis")
 
 # Load & clean
-data = load_data_from_db()
-data = clean_data(data)
+with section("load") as timing:
+    dataset = get_dataset()
+    data = dataset.view()
+    timing.output(data)
+
+# The same car posted again under a new link counts once (see dedup.py)
+deduplicated = st.sidebar.checkbox("Deduplicated", value=False, help="Keep only the latest listing of each group of near-duplicate listings")
+if deduplicated:
+    with section("deduplicate", data) as timing:
+        data = data.take(get_duplicates(dataset).kept)
+        timing.output(data)
 
 # Sidebar - Price Range Selection
 st.sidebar.subheader("Filter by Price Range")
@@ -25,62 +36,70 @@ price_range = st.sidebar.slider(
 )
 
 # Apply filter
-filtered_data = data[
-    (data['price'] >= price_range[0]) & 
-    (data['price'] <= price_range[1])
-]
+with section("price filter", data) as timing:
+    filtered_data = data[
+        (data['price'] >= price_range[0]) & 
+        (data['price'] <= price_range[1])
+    ]
+    timing.output(filtered_data)
 
 st.write(f"📊 Data available in selected range: {filtered_data.shape[0]} rows")
 
 # Show summary
 st.subheader("Statistical Summary")
-st.write(filtered_data.describe().drop(columns=['wilaya']))
+with section("statistical summary", filtered_data):
+    st.write(filtered_data.describe().drop(columns=['wilaya', 'date_int']))
 
 # -----------------------------------
 # Brand analysis
 st.header("Brand Analysis in Price Range")
 
-brand_counts = filtered_data['brand'].value_counts().reset_index()
-brand_counts.columns = ['brand', 'count']
-
-brand_avg_price = filtered_data.groupby('brand')['price'].mean().reset_index()
-brand_avg_price.columns = ['brand', 'Average Price']
-
-merged_brand = pd.merge(brand_counts, brand_avg_price, on="brand")
-st.write(merged_brand)
-
-# Plot - top brands
-top_brands = merged_brand.head(10)
-fig = px.bar(
-    top_brands, 
-    x="brand", y="count",
-    title="Top 10 Brands in Selected Price Range",
-    text="count"
-)
-st.plotly_chart(fig, use_container_width=True)
+# Count and average price per brand, answered from the rollup (which counts
+# every listing) unless deduplicated
+with section("brand table") as timing:
+    if deduplicated:
+        merged_brand = frame_summary(filtered_data, 'brand')
+    else:
+        merged_brand = get_rollup(dataset).summary('brand', price_range=price_range)
+    timing.output(merged_brand)
+    st.write(merged_brand)
+
+# Plot - top brands (plotly is only imported once a chart is drawn)
+with section("chart: top brands"):
+    import plotly.express as px
+
+    top_brands = merged_brand.head(10)
+    fig = px.bar(
+        top_brands, 
+        x="brand", y="count",
+        title="Top 10 Brands in Selected Price Range",
+        text="count"
+    )
+    st.plotly_chart(fig, use_container_width=True)
 
 # -----------------------------------
 # Model analysis
 st.header("Model Analysis in Price Range")
 
-model_counts = filtered_data['model'].value_counts().reset_index()
-model_counts.columns = ['model', 'count']
-
-model_avg_price = filtered_data.groupby('model')['price'].mean().reset_index()
-model_avg_price.columns = ['model', 'Average Price']
-
-merged_model = pd.merge(model_counts, model_avg_price, on="model")
-st.write(merged_model)
+# Count and average price per model, answered from the rollup unless deduplicated
+with section("model table") as timing:
+    if deduplicated:
+        merged_model = frame_summary(filtered_data, 'model')
+    else:
+        merged_model = get_rollup(dataset).summary('model', price_range=price_range)
+    timing.output(merged_model)
+    st.write(merged_model)
 
 # Plot - top models
-top_models = merged_model.head(10)
-fig = px.bar(
-    top_models, 
-    x="model", y="count",
-    title="Top 10 Models in Selected Price Range",
-    text="count"
-)
-st.plotly_chart(fig, use_container_width=True)
+with section("chart: top models"):
+    top_models = merged_model.head(10)
+    fig = px.bar(
+        top_models, 
+        x="model", y="count",
+        title="Top 10 Models in Selected Price Range",
+        text="count"
+    )
+    st.plotly_chart(fig, use_container_width=True)
 
 
 # -----------------------------------
@@ -88,25 +107,24 @@ st.plotly_chart(fig, use_container_width=True)
 st.header("Price Distribution of Top 5 Models")
 
 # Find top 5 models by count in the filtered data
-top_5_models = (
-    filtered_data['model']
-    .value_counts()
-    .head(5)
-    .index
-    .tolist()
-)
+top_5_models = merged_model['model'].head(5).tolist()
 
 # Filter only those models
 top_models_data = filtered_data[filtered_data['model'].isin(top_5_models)]
 
-if not top_models_data.empty:
-    fig, ax = plt.subplots(figsize=(12, 6))
-    sns.boxplot(x="model", y="price", data=top_models_data, ax=ax)
+# Drawn by a function of its inputs and cached on them (see charts.py)
+def top_models_boxplot(ax, data):
+    import seaborn as sns
+
+    sns.boxplot(x="model", y="price", data=data, order=data['model'].unique().tolist(), ax=ax)
     
     # Customize
     ax.set_title("Price Distribution of Top 5 Models")
     ax.set_xticklabels(ax.get_xticklabels(), rotation=45)
 
-    st.pyplot(fig)
+if not top_models_data.empty:
+    show_chart(top_models_boxplot, top_models_data[['model', 'price']], figsize=(12, 6))
 else:
     st.write("⚠️ No data available for the selected price range.")
+
+show_rerun_stats(rerun, globals())
@@ -0,0 +1,83 @@
+import streamlit as st
+import pandas as pd
+from utils import get_dataset, start_rerun, show_rerun_stats
+from inverted_index import get_inverted_index
+from deals import DEAL_TOP_K, MILEAGE_BUCKET, get_deal_scores
+from dedup import get_duplicates
+from instrumentation import section
+
+
+rerun = start_rerun("Deals")
+
+st.title("Best Deals")
+st.write("Listings priced furthest under the median of the same brand, model, year and "
+         f"{MILEAGE_BUCKET:,} km mileage band, in robust standard deviations (see deals.py).")
+
+# Scores and lists of best deals are computed once per dataset version; both
+# are taken for the one dataset the page holds, so their row ids match
+dataset = get_dataset()
+with section("scores") as timing:
+    scores = get_deal_scores(dataset)
+    timing.output(len(scores.ranked))
+with section("index"):
+    index = get_inverted_index(dataset)
+
+# ---------------------------------------------------------------------
+# Filters: brand, model and wilaya have lists of best deals of their own,
+# the other filters narrow the row ids with the inverted index
+st.sidebar.subheader("Filters")
+
+brand = st.sidebar.selectbox("Brand", index.options('brand'), index=None, placeholder="Any brand")
+model = None
+if brand:
+    model = st.sidebar.selectbox("Model", index.options('model', index.rows('brand', brand)), index=None, placeholder="Any model")
+
+wilayas = sorted(int(wilaya) for wilaya in pd.unique(index.frame['wilaya'].dropna()))
+wilaya = st.sidebar.selectbox("Wilaya", wilayas, index=None, placeholder="Any wilaya")
+
+lowest_year, highest_year = int(index.frame['year'].min()), int(index.frame['year'].max())
+years = st.sidebar.slider("Year", lowest_year, highest_year, (lowest_year, highest_year))
+
+min_price, max_price = map(int, index.bounds('price'))
+price_range = st.sidebar.slider("Price Range", min_price, max_price, (min_price, max_price))
+
+count = st.sidebar.slider("Number of deals", 10, DEAL_TOP_K, 20, step=10)
+
+# The same car posted again under a new link is listed once (see dedup.py)
+deduplicated = st.sidebar.checkbox("Deduplicated", value=False, help="Keep only the latest listing of each group of near-duplicate listings")
+
+# ---------------------------------------------------------------------
+with section("best deals") as timing:
+    criteria = {}
+    if years != (lowest_year, highest_year):
+        criteria['year'] = list(range(years[0], years[1] + 1))
+    if price_range != (min_price, max_price):
+        criteria['price'] = price_range
+    rows = get_duplicates(index).kept if deduplicated else None
+    if criteria:
+        rows = index.narrow(rows, **criteria)
+    values = {column: value for column, value in [('brand', brand), ('model', model), ('wilaya', wilaya)] if value is not None}
+    best = scores.best(count, rows, **values)
+    timing.output(best)
+
+if len(best):
+    deals = scores.table(best)
+    deals['discount'] = (deals['discount'] * 100).round(1)
+    deals['median'] = deals['median'].round()
+    st.dataframe(
+        deals[['title', 'brand', 'model', 'year', 'mileage', 'fuel', 'gearbox', 'wilaya', 'price', 'median', 'discount', 'score', 'date', 'link']],
+        column_config={
+            'discount': st.column_config.NumberColumn("discount %"),
+            'score': st.column_config.NumberColumn(format="%.2f"),
+            'link': st.column_config.LinkColumn(),
+        },
+        hide_index=True,
+        use_container_width=True,
+    )
+else:
+    st.write("No scored listing matches these filters.")
+
+# Footer
+st.write("Built with ❤️ using Streamlit!")
+
+show_rerun_stats(rerun, globals())
@@ -0,0 +1,106 @@
+import streamlit as st
+import pandas as pd
+from utils import start_rerun, show_rerun_stats
+from trends import EWMA_HALF_LIVES, ROLLING_WINDOW, get_trends
+from charts import show_chart
+from instrumentation import section
+
+
+rerun = start_rerun("Market Trends")
+
+st.title("📉 Market Trends")
+st.write("Listings posted and their prices over time, for the whole market or one brand, model or wilaya. "
+         "The series are kept up to date as new listings arrive (see trends.py).")
+
+with section("series") as timing:
+    trends = get_trends()
+    timing.output(len(trends.series))
+
+# ---------------------------------------------------------------------
+# Which series, and how it is smoothed
+st.sidebar.subheader("Series")
+level = st.sidebar.radio("Trends of", ["Market", "Brand", "Model", "Wilaya"], horizontal=True)
+value = None
+if level == "Brand" or level == "Model":
+    brand = st.sidebar.selectbox("Brand", trends.values("brand"))
+    value = brand
+    if level == "Model":
+        model = st.sidebar.selectbox("Model", [model for _, model in trends.values("model", brand)])
+        value = (brand, model)
+elif level == "Wilaya":
+    value = st.sidebar.selectbox("Wilaya", trends.values("wilaya"))
+
+weekly = st.sidebar.radio("Points", ["Daily", "Weekly"], horizontal=True) == "Weekly"
+window = st.sidebar.slider("Rolling window (days)", 7, 180, ROLLING_WINDOW, step=1)
+half_life = st.sidebar.selectbox("EWMA half-life (days)", EWMA_HALF_LIVES)
+
+with section("query") as timing:
+    daily = trends.daily(level.lower(), value, window, half_life)
+    points = trends.weekly(level.lower(), value) if weekly else daily
+    seasonality = trends.seasonality(level.lower(), value)
+    timing.output(daily)
+
+first_date, last_date = daily.index[0].date(), daily.index[-1].date()
+start = st.sidebar.date_input("From:", max(first_date, (daily.index[-1] - pd.DateOffset(years=2)).date()), min_value=first_date, max_value=last_date)
+end = st.sidebar.date_input("To:", last_date, start, max_value=last_date)
+shown = daily.loc[pd.Timestamp(start):pd.Timestamp(end)]
+points = points.loc[pd.Timestamp(start):pd.Timestamp(end)]
+
+# ---------------------------------------------------------------------
+# Last window against the one before
+latest = daily.iloc[-1]
+before = daily.iloc[-1 - window] if len(daily) > window else daily.iloc[0]
+latest_price, before_price = latest['rolling mean price'], before['rolling mean price']
+columns = st.columns(2)
+columns[0].metric(f"Listings per day (last {window} days)", f"{latest['rolling listings']:,.1f}",
+                  f"{latest['rolling listings'] - before['rolling listings']:+,.1f}")
+# A window without listings has no mean price: no delta is shown then
+columns[1].metric(f"Mean price (last {window} days)", "n/a" if pd.isna(latest_price) else f"{latest_price:,.0f}",
+                  None if pd.isna(latest_price) or pd.isna(before_price) or before_price == 0
+                  else f"{(latest_price / before_price - 1) * 100:+.1f}%")
+
+# Each chart is drawn by a function of its inputs and cached on them (see charts.py)
+def listings_chart(ax, daily, points, weekly, window, half_life):
+    raw = points['listings'] / (7 if weekly else 1)
+    ax.plot(raw.index, raw, color='lightgray', label="Listings per day" + (" (weekly)" if weekly else ""))
+    ax.plot(daily.index, daily['rolling listings'], label=f"{window}-day mean")
+    ax.plot(daily.index, daily['ewma listings'], linestyle='--', label=f"EWMA ({half_life}-day half-life)")
+    ax.set_title("Listings Posted")
+    ax.set_ylabel("Listings per day")
+    ax.legend()
+
+st.subheader("Volume")
+show_chart(listings_chart, shown[['listings', 'rolling listings', 'ewma listings']], points[['listings']], weekly, window, half_life, figsize=(12, 5))
+
+def price_chart(ax, daily, points, weekly, window, half_life):
+    ax.plot(points.index, points['median price'], color='lightgray', marker='.', linestyle='none',
+            label="Median price of the " + ("week" if weekly else "day"))
+    ax.plot(daily.index, daily['rolling mean price'], label=f"{window}-day mean")
+    ax.plot(daily.index, daily['ewma price'], linestyle='--', label=f"EWMA ({half_life}-day half-life)")
+    ax.set_title("Prices")
+    ax.set_ylabel("Price")
+    ax.legend()
+
+st.subheader("Prices")
+show_chart(price_chart, shown[['rolling mean price', 'ewma price']], points[['median price']], weekly, window, half_life, figsize=(12, 5))
+
+def seasonality_chart(ax, seasonality):
+    ax.bar(seasonality.index, seasonality['listings per day'], color='tab:blue')
+    ax.set_xticks(seasonality.index)
+    ax.set_xlabel("Month")
+    ax.set_ylabel("Listings per day", color='tab:blue')
+    prices = ax.twinx()
+    prices.plot(seasonality.index, seasonality['mean price'], color='tab:red', marker='o')
+    prices.set_ylabel("Mean price", color='tab:red')
+    ax.set_title("Seasonality (every year of the history)")
+
+st.subheader("Seasonality")
+show_chart(seasonality_chart, seasonality, figsize=(12, 5))
+
+with st.expander("Series"):
+    st.dataframe(points.iloc[::-1], use_container_width=True)
+
+# Footer
+st.write("Built with ❤️ using Streamlit!")
+
+show_rerun_stats(rerun, globals())
@@ -0,0 +1,92 @@
+import streamlit as st
+from utils import start_rerun, show_rerun_stats
+from locations import MIN_CELL_LISTINGS, get_location_stats, wilaya_label
+from instrumentation import section
+
+
+rerun = start_rerun("Locations")
+
+st.title("📍 Prices by Wilaya")
+st.write("The same model's price across wilayas: every cell is summarized once per dataset "
+         "version (see locations.py), the filters below only select cells.")
+
+# The same car posted again under a new link counts once (see dedup.py)
+deduplicated = st.sidebar.checkbox("Deduplicated", value=False, help="Keep only the latest listing of each group of near-duplicate listings")
+
+with section("location stats") as timing:
+    stats = get_location_stats(deduplicated)
+    timing.output(stats.cells)
+
+# ---------------------------------------------------------------------
+# Which models, and which of their cells
+st.sidebar.subheader("Models")
+brand = st.sidebar.selectbox("Brand", sorted(stats.models['brand'].unique()), index=None, placeholder="Any brand")
+count = st.sidebar.slider("Number of models", 1, 50, 15)
+min_listings = st.sidebar.slider("Minimum listings per wilaya", 1, 100, MIN_CELL_LISTINGS)
+values = {
+    "Median price": "median",
+    "Premium over the national median (%)": "premium",
+    "Listings": "count",
+}
+shown = st.sidebar.radio("Matrix values", list(values))
+
+models = stats.top_models(count, brand)
+
+# ---------------------------------------------------------------------
+st.header("Model × Wilaya")
+with section("matrix") as timing:
+    matrix = stats.matrix(models, values[shown], min_listings)
+    timing.output(matrix)
+if matrix.empty:
+    st.write("No wilaya has enough listings of these models.")
+else:
+    if values[shown] == "premium":
+        matrix = matrix * 100
+    # Cheaper than the national median in green, dearer in red
+    colors = "RdYlGn_r" if values[shown] == "premium" else "Blues"
+    st.dataframe(matrix.style.background_gradient(cmap=colors, axis=None).format("{:,.1f}" if values[shown] == "premium" else "{:,.0f}", na_rep=""),
+                 use_container_width=True)
+
+# ---------------------------------------------------------------------
+st.header("Map")
+labels = {f"{model_brand} {model}": (model_brand, model) for model_brand, model in models}
+selected = st.selectbox("Model", list(labels))
+if selected:
+    with section("wilayas of the model") as timing:
+        wilayas = stats.by_wilaya(*labels[selected], min_listings)
+        timing.output(wilayas)
+
+    if wilayas.empty:
+        st.write("No wilaya has enough listings of this model.")
+    else:
+        # plotly is only imported once a map is drawn
+        with section("chart: map"):
+            import plotly.express as px
+
+            located = wilayas.dropna(subset=['latitude']).assign(
+                premium=lambda cells: cells['premium'] * 100,
+                wilaya=lambda cells: cells['wilaya'].map(wilaya_label),
+            )
+            fig = px.scatter_geo(
+                located,
+                lat='latitude', lon='longitude',
+                size='count', color='premium',
+                color_continuous_scale='RdYlGn_r', color_continuous_midpoint=0,
+                hover_name='wilaya',
+                hover_data={'count': True, 'median': ':,.0f', 'q25': ':,.0f', 'q75': ':,.0f', 'premium': ':.1f', 'latitude': False, 'longitude': False},
+                labels={'premium': "premium %"},
+                title=f"Median price of the {selected} per wilaya, against its national median",
+            )
+            fig.update_geos(fitbounds="locations", showcountries=True)
+            st.plotly_chart(fig, use_container_width=True)
+
+        table = wilayas[['wilaya', 'name', 'count', 'q25', 'median', 'q75', 'premium']].assign(premium=wilayas['premium'] * 100)
+        st.dataframe(table, column_config={
+            'premium': st.column_config.NumberColumn("premium %", format="%.1f"),
+            'median': st.column_config.NumberColumn(format="%.0f"),
+        }, hide_index=True, use_container_width=True)
+
+# Footer
+st.write("Built with ❤️ using Streamlit!")
+
+show_rerun_stats(rerun, globals())
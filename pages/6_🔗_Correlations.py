@@ -0,0 +1,87 @@
+import streamlit as st
+import numpy as np
+from utils import get_dataset, start_rerun, show_rerun_stats
+from correlations import CATEGORICAL, get_correlations
+from charts import show_chart
+from instrumentation import section
+
+
+rerun = start_rerun("Correlations")
+
+st.title("🔗 Correlations")
+st.write("How the listings' values move together: Pearson's r between the numeric columns and Cramér's V "
+         "between the categorical ones, merged from statistics kept per brand, model, month and price band "
+         "(see correlations.py). The engine size is the displacement parsed from the engine description.")
+
+# The same car posted again under a new link counts once (see dedup.py)
+deduplicated = st.sidebar.checkbox("Deduplicated", value=False, help="Keep only the latest listing of each group of near-duplicate listings")
+
+# The dataset version the store and the widgets below are brought up to date with
+dataset = get_dataset()
+with section("correlation store") as timing:
+    store = get_correlations(deduplicated, dataset)
+    timing.output(len(store.bucket_pair))
+
+# ---------------------------------------------------------------------
+# Which listings
+data = dataset.frame
+first_date, last_date = data['date'].min().date(), data['date'].max().date()
+st.sidebar.subheader("Select Date Range")
+start = st.sidebar.date_input("From:", first_date, min_value=first_date, max_value=last_date)
+end = st.sidebar.date_input("To:", last_date, start, max_value=last_date)
+
+min_price, max_price = int(data['price'].min()), int(data['price'].max())
+price_range = st.sidebar.slider("Price Range", min_value=min_price, max_value=max_price, value=(min_price, max_price), step=1)
+
+brands = sorted({brand for brand, _ in store.pairs})
+brand = st.sidebar.selectbox("Brand", brands, index=None, placeholder="Any brand")
+model = None
+if brand is not None:
+    model = st.sidebar.selectbox("Model", sorted(model for pair_brand, model in store.pairs if pair_brand == brand), index=None, placeholder="Any model")
+
+with section("select") as timing:
+    selection = store.select(date_range=(start, end), price_range=price_range, brand=brand, model=model)
+    timing.output(selection.count)
+
+st.write("Listings selected:", selection.count)
+
+# Each chart is drawn by a function of its inputs and cached on them (see charts.py)
+def heatmap(ax, matrix, title, vmin, colors):
+    image = ax.imshow(matrix.to_numpy(dtype=float), cmap=colors, vmin=vmin, vmax=1)
+    ax.set_xticks(range(len(matrix.columns)), matrix.columns, rotation=45)
+    ax.set_yticks(range(len(matrix.index)), matrix.index)
+    for i in range(len(matrix.index)):
+        for j in range(len(matrix.columns)):
+            value = matrix.iat[i, j]
+            if not np.isnan(value):
+                ax.text(j, i, f"{value:.2f}", ha='center', va='center', color='white' if abs(value) > 0.6 else 'black')
+    ax.figure.colorbar(image, ax=ax)
+    ax.set_title(title)
+
+# ---------------------------------------------------------------------
+st.header("Numeric Columns")
+with section("pearson") as timing:
+    pearson = selection.pearson()
+    timing.output(pearson)
+show_chart(heatmap, pearson, "Pearson correlation", -1, 'RdBu_r', figsize=(7, 6))
+
+# ---------------------------------------------------------------------
+st.header("Categorical Columns")
+with section("cramer's v") as timing:
+    cramers_v = selection.cramers_v()
+    timing.output(cramers_v)
+show_chart(heatmap, cramers_v, "Cramér's V", 0, 'Blues', figsize=(7, 6))
+
+st.subheader("Crosstab")
+columns = st.columns(2)
+rows_of = columns[0].selectbox("Rows", CATEGORICAL, index=CATEGORICAL.index('year'))
+columns_of = columns[1].selectbox("Columns", [column for column in CATEGORICAL if column != rows_of], index=0)
+with section("crosstab") as timing:
+    crosstab = selection.crosstab(rows_of, columns_of)
+    timing.output(crosstab)
+st.dataframe(crosstab, use_container_width=True)
+
+# Footer
+st.write("Built with ❤️ using Streamlit!")
+
+show_rerun_stats(rerun, globals())
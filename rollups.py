@@ -0,0 +1,377 @@
+"""
+Pre-aggregated rollups of the cleaned listings: one cube of cells per month x
+brand x model x price band, and one per month x wilaya x price band. The
+brand, model and wilaya summary tables and top-N charts are answered from
+them, so their cost depends on the number of cells, not of listings. The last
+summary tables asked for are kept, per dataset version, for the next session
+asking for the same window (e.g. App.py's default window, which the warm-up
+computes ahead, see warmup.py).
+
+Every cell keeps the first and last day and the lowest and highest price of
+its listings: a date/price window is answered from the cells lying fully
+inside it, plus the listings of the cells it cuts (in the months and price
+bands at its edges), so any window is exact to the day. Cells are coarse on
+purpose (a cell per day would hold about one listing), and the wilayas have
+a cube of their own rather than splitting the brand/model cells.
+
+When the dataset version changes, only the added, removed and modified
+listings are added to or subtracted from their cells (as the correlation
+store does); the first/last day and lowest/highest price are aggregated
+again for the cells that lost listings only. The cubes and the listings they
+were built from are stored as Arrow files next to the snapshot (see
+rollup_paths), so a restart only aggregates the listings changed since.
+"""
+import os
+import threading
+import cachetools
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from utils import factorize, get_dataset, get_incremental_loader, read_arrow, row_multiset_diff, write_arrow
+
+# Summary tables kept (by, windows and dataset version)
+SUMMARY_CACHE_ENTRIES = 64
+
+# Price bands grow geometrically: BANDS_PER_OCTAVE bands per doubling of the price
+BANDS_PER_OCTAVE = 2
+BAND_EDGES = np.unique(np.ceil(2.0 ** (np.arange(40 * BANDS_PER_OCTAVE) / BANDS_PER_OCTAVE))).astype(np.int64)
+
+# Columns the summaries can be grouped by, and the cube each is answered from
+SUMMARY_BY = ["brand", "model", "wilaya"]
+CUBES = {"brand": "pair", "model": "pair", "wilaya": "wilaya"}
+
+# Per cell and per `by` value
+MEASURES = ["count", "price_sum", "price_sq_sum", "price_min", "price_max", "mileage_sum", "mileage_sq_sum"]
+
+# Sums over the listings of a cell, updated by the changed listings only
+SUMS = ["count", "price_sum", "price_sq_sum", "mileage_sum", "mileage_sq_sum"]
+
+# Lowest and highest values of a cell, aggregated again when it loses listings
+BOUNDS = ["price", "day"]
+
+@st.cache_resource
+def _shared_rollup(db_path):
+    return Rollup(path=db_path)
+
+def get_rollup(dataset=None):
+    """
+    The process-wide rollup, brought up to date with `dataset` (the shared
+    dataset by default; pages pass the one they hold).
+    """
+    dataset = get_dataset() if dataset is None else dataset
+    rollup = _shared_rollup(get_incremental_loader().db_path)
+    if rollup.version != dataset.version:
+        rollup.update(dataset.frame, dataset.version)
+    return rollup
+
+def rollup_paths(db_path):
+    """
+    The Arrow files of the rollup of a database: its listings, then each cube.
+    """
+    base = os.path.splitext(db_path)[0]
+    return {name: f"{base}.rollup-{name}.arrow" for name in ["rows", *dict.fromkeys(CUBES.values())]}
+
+class Rollup:
+    """
+    Groups and cells are numbered in order of appearance, per cube:
+    `groups[cube]` maps the (brand, model) pairs or the wilayas to their
+    number, and `cubes[cube]` holds one row per cell with its group, month
+    (since 1970-01) and price band, the MEASURES of its listings and their first and last day (days since
+    1970-01-01). `rows` holds the day, price and mileage of every listing and
+    its cell in each cube (-1 when its wilaya is unknown).
+    With a `path` (the database's), the rollup is stored next to it after
+    each update and read back by the first one.
+    """
+
+    def __init__(self, summary_entries=SUMMARY_CACHE_ENTRIES, path=None):
+        self.version = None
+        self.path = path
+        self.rows = None
+        self.hashes = None
+        self.groups = {cube: {} for cube in dict.fromkeys(CUBES.values())}
+        self.cubes = {cube: _empty_cube() for cube in self.groups}
+        self._group_values = {}
+        self._lock = threading.Lock()
+        self._summaries = cachetools.LRUCache(summary_entries) if summary_entries > 0 else None
+        self._summaries_lock = threading.Lock()
+        self.summary_hits = 0
+        self.summary_misses = 0
+
+    @property
+    def cube(self):
+        """
+        The brand/model cube.
+        """
+        return self.cubes["pair"]
+
+    def update(self, cleaned, version):
+        with self._lock:
+            if version == self.version:
+                return
+            if self.version is None and self.path is not None:
+                self._load()
+                if version == self.version:
+                    return
+            rows = self._rollup_rows(cleaned)
+            removed, added, hashes = row_multiset_diff(self.rows, rows, self.hashes)
+            for cube in self.cubes:
+                self._accumulate(cube, removed, -1)
+                self._accumulate(cube, added, 1)
+                self._bound(cube, rows, removed, added)
+            self.rows = rows
+            self.hashes = hashes
+            self._group_values = {}
+            self.version = version
+            if self.path is not None:
+                self._store()
+
+    def _rollup_rows(self, cleaned):
+        # Day, price and mileage of each listing and its cell in each cube;
+        # new groups and cells get a number
+        dates = cleaned["date"].to_numpy()
+        months = dates.astype("datetime64[M]").astype(np.int64)
+        prices = cleaned["price"].to_numpy(dtype=np.int64)
+        bands = _band(prices)
+        brand_codes, brands = factorize(cleaned["brand"])
+        model_codes, models = factorize(cleaned["model"])
+        wilaya_codes, wilayas = factorize(cleaned["wilaya"])
+        brands, models, wilayas = (pd.Index(values).tolist() for values in [brands, models, wilayas])
+        pair_codes = brand_codes.astype(np.int64) * len(models) + model_codes
+        return pd.DataFrame({
+            "day": dates.astype("datetime64[D]").astype(np.int64),
+            "price": prices,
+            "mileage": cleaned["mileage"].to_numpy(dtype=float, na_value=np.nan),
+            "pair": self._cell_ids("pair", pair_codes, lambda code: (brands[code // len(models)], models[code % len(models)]), months, bands),
+            "wilaya": self._cell_ids("wilaya", wilaya_codes.astype(np.int64), wilayas.__getitem__, months, bands),
+        })
+
+    def _cell_ids(self, cube, codes, group, months, bands):
+        # Number of the cell of each listing, from the code of its group (-1
+        # when missing, `group` giving the group of a code), its month and
+        # price band; new groups and cells are appended
+        groups = self.groups[cube]
+        present = np.flatnonzero(np.bincount(codes[codes >= 0]))
+        numbers = np.full(present.max(initial=-1) + 2, -1, dtype=np.int64)
+        numbers[present] = [groups.setdefault(group(code), len(groups)) for code in present.tolist()]
+        numbers = numbers[codes]
+        inverse, keys = pd.factorize(np.where(numbers >= 0, (numbers << 28) | (months << 8) | bands, -1))
+        frame = self.cubes[cube]
+        known = _cell_keys(frame)
+        order = np.argsort(known)
+        positions = np.minimum(np.searchsorted(known, keys, sorter=order), max(len(known) - 1, 0))
+        found = (known[order[positions]] == keys) if len(known) else np.zeros(len(keys), dtype=bool)
+        ids = np.where(found, order[positions] if len(known) else 0, -1)
+        new = np.flatnonzero(~found & (keys >= 0))
+        if len(new):
+            ids[new] = np.arange(len(frame), len(frame) + len(new))
+            added = _empty_cube(len(new))
+            added["group"], added["month"], added["band"] = keys[new] >> 28, (keys[new] >> 8) % 2**20, keys[new] % 2**8
+            self.cubes[cube] = pd.concat([frame, added], ignore_index=True)
+        return ids[inverse]
+
+    def _accumulate(self, cube, rows, sign):
+        # Add (sign 1) or subtract (-1) the listings of `rows` to the SUMS of their cells
+        known = rows[cube].to_numpy() >= 0
+        if not known.any():
+            return
+        frame = self.cubes[cube]
+        cells = rows[cube].to_numpy()[known]
+        price = rows["price"].to_numpy(dtype=float)[known]
+        mileage = np.nan_to_num(rows["mileage"].to_numpy(dtype=float)[known])
+        for name, weights in [("count", None), ("price_sum", price), ("price_sq_sum", price ** 2),
+                              ("mileage_sum", mileage), ("mileage_sq_sum", mileage ** 2)]:
+            sums = np.bincount(cells, weights=weights, minlength=len(frame))
+            if name in ("count", "price_sum", "mileage_sum"):
+                # Whole numbers below 2**53 per cell: exact
+                sums = np.rint(sums).astype(np.int64)
+            frame[name] = frame[name].to_numpy() + sign * sums
+
+    def _bound(self, cube, rows, removed, added):
+        # First/last day and lowest/highest price of the cells: those that lost
+        # listings are aggregated again from `rows`, the others take in the
+        # added listings
+        frame = self.cubes[cube]
+        again = np.zeros(len(frame) + 1, dtype=bool)
+        again[removed[cube].to_numpy()] = True
+        again[-1] = False
+        cells = rows[cube].to_numpy()
+        taken = again[cells]
+        listings = np.concatenate([cells[taken], added[cube].to_numpy()])
+        known = listings >= 0
+        order = np.argsort(listings[known], kind="stable")
+        listings = listings[known][order]
+        starts = np.flatnonzero(np.append(True, listings[1:] != listings[:-1])) if len(listings) else np.zeros(0, dtype=np.int64)
+        at = listings[starts]
+        for name in BOUNDS:
+            lowest, highest = frame[f"{name}_min"].to_numpy(dtype=float).copy(), frame[f"{name}_max"].to_numpy(dtype=float).copy()
+            lowest[again[:-1]], highest[again[:-1]] = np.inf, -np.inf
+            if len(starts):
+                values = np.concatenate([rows[name].to_numpy()[taken], added[name].to_numpy()])[known][order]
+                lowest[at] = np.minimum(lowest[at], np.minimum.reduceat(values, starts))
+                highest[at] = np.maximum(highest[at], np.maximum.reduceat(values, starts))
+            frame[f"{name}_min"], frame[f"{name}_max"] = lowest, highest
+
+    def _load(self):
+        # The rollup stored by the last update (of any version)
+        paths = rollup_paths(self.path)
+        stored = [read_arrow(path) for path in paths.values()]
+        if any(stored_file is None for stored_file in stored) or any(meta != stored[0][1] for _, meta in stored):
+            # Missing, or the files come from different updates
+            return
+        meta = stored[0][1]
+        for cube, (frame, _) in zip(list(paths)[1:], stored[1:]):
+            values = meta["groups"][cube]
+            self.groups[cube] = {tuple(value) if isinstance(value, list) else value: i for i, value in enumerate(values)}
+            self.cubes[cube] = frame.copy()
+        self.rows = stored[0][0].copy()
+        self.version = meta["version"]
+
+    def _store(self):
+        meta = {"version": self.version, "groups": {cube: list(groups) for cube, groups in self.groups.items()}}
+        paths = rollup_paths(self.path)
+        write_arrow(paths["rows"], self.rows, meta)
+        for cube, frame in self.cubes.items():
+            write_arrow(paths[cube], frame, meta)
+
+    def summary(self, by, date_range=None, price_range=None):
+        """
+        Count and average price per `by` value (one of SUMMARY_BY), sorted by
+        count, for the listings inside the date and price windows. The result
+        is shared with the next callers of the same table: do not modify it.
+        """
+        key = (self.version, by, None if date_range is None else tuple(pd.Timestamp(day) for day in date_range),
+               None if price_range is None else tuple(price_range))
+        with self._summaries_lock:
+            result = None if self._summaries is None else self._summaries.get(key)
+            if result is not None:
+                self.summary_hits += 1
+                return result
+            self.summary_misses += 1
+        result = self._summary(by, date_range, price_range)
+        if self._summaries is not None:
+            with self._summaries_lock:
+                self._summaries[key] = result
+        return result
+
+    def _summary(self, by, date_range, price_range):
+        values, stats = self._merge(by, date_range, price_range, ["count", "price_sum"])
+        result = pd.DataFrame({
+            by: values,
+            "count": stats["count"],
+            "Average Price": stats["price_sum"] / stats["count"],
+        })
+        return result.sort_values(["count", by], ascending=[False, True], ignore_index=True)
+
+    def aggregate(self, by, date_range=None, price_range=None):
+        """
+        Merged MEASURES per `by` value (one of SUMMARY_BY) for the listings
+        inside the windows (inclusive); values without listings are left out.
+        """
+        values, stats = self._merge(by, date_range, price_range, MEASURES)
+        return pd.DataFrame(stats, index=pd.Index(values, name=by))
+
+    def _merge(self, by, date_range, price_range, measures):
+        # The `by` values with listings inside the windows and their measures
+        if by not in SUMMARY_BY:
+            raise ValueError(f"the rollup has no {by!r} dimension ({', '.join(SUMMARY_BY)})")
+        cube = CUBES[by]
+        with self._lock:
+            frame = self.cubes[cube]
+            groups, values = self._group_codes(by)
+            inside, edges = self._select(cube, date_range, price_range)
+        cell_groups = groups[frame["group"].to_numpy()]
+        inside_groups = cell_groups[inside]
+        edge_groups = cell_groups[edges[cube].to_numpy()]
+        edge_values = {"price": edges["price"].to_numpy(dtype=float), "mileage": np.nan_to_num(edges["mileage"].to_numpy(dtype=float))}
+        size = len(values)
+        stats = {}
+        for name in dict.fromkeys(["count", *measures]):
+            cells = frame[name].to_numpy(dtype=float)[inside]
+            if name == "count":
+                stats[name] = (np.bincount(inside_groups, weights=cells, minlength=size) + np.bincount(edge_groups, minlength=size)).astype(np.int64)
+                continue
+            column, statistic = name.split("_", 1)
+            if statistic in ("sum", "sq_sum"):
+                weights = edge_values[column] ** 2 if statistic == "sq_sum" else edge_values[column]
+                stats[name] = np.bincount(inside_groups, weights=cells, minlength=size) + np.bincount(edge_groups, weights=weights, minlength=size)
+            else:
+                reduce, empty = (np.minimum, np.inf) if statistic == "min" else (np.maximum, -np.inf)
+                stats[name] = np.full(size, empty)
+                reduce.at(stats[name], inside_groups, cells)
+                reduce.at(stats[name], edge_groups, edge_values[column])
+        present = stats["count"] > 0
+        return values[present], {name: stats[name][present] for name in measures}
+
+    def price_bounds(self, date_range=None):
+        """
+        (min, max) price of the listings inside the date window.
+        """
+        stats = self.aggregate(SUMMARY_BY[0], date_range)
+        return stats["price_min"].min(), stats["price_max"].max()
+
+    def _group_codes(self, by):
+        # The `by` value of each group of its cube, as codes into the values
+        # (with the lock held)
+        if by not in self._group_values:
+            groups = list(self.groups[CUBES[by]])
+            if CUBES[by] == "pair":
+                groups = [pair[SUMMARY_BY.index(by)] for pair in groups]
+            self._group_values[by] = pd.factorize(np.array(groups, dtype=object))
+        return self._group_values[by]
+
+    def _select(self, cube, date_range, price_range):
+        # Cells of the cube fully inside the windows (a mask over the cells),
+        # and the listings inside the windows of the cells they cut (with the
+        # lock held)
+        frame = self.cubes[cube]
+        inside = np.ones(len(frame), dtype=bool)
+        outside = np.zeros(len(frame), dtype=bool)
+        bounds = []
+        if date_range is not None:
+            start, end = (pd.Timestamp(day).to_datetime64().astype("datetime64[D]").astype(np.int64) for day in date_range)
+            bounds.append(("day", start, end))
+        if price_range is not None:
+            bounds.append(("price", int(price_range[0]), int(price_range[1])))
+        for name, low, high in bounds:
+            lowest, highest = frame[f"{name}_min"].to_numpy(), frame[f"{name}_max"].to_numpy()
+            inside &= (lowest >= low) & (highest <= high)
+            outside |= (highest < low) | (lowest > high)
+        cut = np.append(~inside & ~outside, False)
+        if not cut.any():
+            return inside, self.rows.iloc[:0]
+        kept = cut[self.rows[cube].to_numpy()]
+        for name, low, high in bounds:
+            values = self.rows[name].to_numpy()
+            kept &= (values >= low) & (values <= high)
+        return inside, self.rows[kept]
+
+def frame_summary(frame, by):
+    """
+    The table of Rollup.summary, computed from the listings of `frame` (for
+    selections the rollup does not know about, e.g. deduplicated listings).
+    """
+    stats = frame.groupby(by, observed=True)["price"].agg(["size", "mean"])
+    result = pd.DataFrame({
+        by: stats.index.to_numpy(),
+        "count": stats["size"].to_numpy(),
+        "Average Price": stats["mean"].to_numpy(),
+    })
+    return result.sort_values(["count", by], ascending=[False, True], ignore_index=True)
+
+def _cell_keys(frame):
+    # (group << 28) | (month << 8) | band of each cell of a cube
+    return (frame["group"].to_numpy() << 28) | (frame["month"].to_numpy() << 8) | frame["band"].to_numpy()
+
+def _empty_cube(cells=0):
+    # Cells without listings: their bounds are empty, so any window holds them
+    frame = pd.DataFrame({column: np.zeros(cells, dtype=np.int64) for column in ["group", "month", "band", *SUMS]})
+    for column in ["price_sq_sum", "mileage_sq_sum"]:
+        frame[column] = frame[column].astype(float)
+    for name in BOUNDS:
+        frame[f"{name}_min"], frame[f"{name}_max"] = np.full(cells, np.inf), np.full(cells, -np.inf)
+    return frame
+
+def _band(prices):
+    # Price band of each price (see BAND_EDGES)
+    return np.maximum(np.searchsorted(BAND_EDGES, prices, "right") - 1, 0)
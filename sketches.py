@@ -0,0 +1,417 @@
+"""
+Mergeable quantile sketches of the cleaned listings' prices and mileages, so
+boxplots and IQR filters over large selections do not have to sort every
+value.
+
+Listings are grouped in buckets at a few granularities (brand x model x year,
+brand x model, brand, and every listing), and the listings of a bucket in
+blocks of 1, 2, 4, ... 2**(BLOCK_LEVELS - 1) months, aligned on multiples of
+their length. A block of more than SUMMARY_RATIO * `chunks` values (chunks
+being ceil(2 / epsilon)) is summarized: its sorted values are cut into
+`chunks` chunks of equal rank, each kept as (median value, weight), so the
+summaries of a level hold at most 1 / SUMMARY_RATIO of the values. Smaller
+blocks are not summarized: their values are read from the listings, kept
+sorted by brand x model x year bucket and day. A date range is cut into the
+longest aligned blocks it covers (at most two per level) and the days at its
+edges, which are read from the listings too. A selection is answered at the
+coarsest granularity that has every dimension it selects or groups by, so the
+whole market is a few blocks of one bucket, and a brand the same blocks of its
+own bucket.
+
+Merging is concatenation. A summarized block of n_i values misplaces a rank
+by at most half a chunk (n_i / chunks / 2 + 1), and a summarized block holds
+more than `chunks` values, so a quantile of any selection of n values is off
+by at most epsilon * n / 2 ranks from the summaries, and by at most half that
+from interpolating between chunks: epsilon * n in all. Selections whose blocks
+are all small are exact. When the dataset version changes, only the blocks of
+the buckets with added, removed or modified listings are summarized again.
+"""
+import math
+import threading
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from utils import get_dataset, get_incremental_loader, row_multiset_diff
+
+# Rank error bound of the sketches (fraction of the selected values)
+SKETCH_EPSILON = 0.01
+
+# Up to this many rows the quantiles are computed exactly from the rows
+EXACT_MAX_ROWS = 20_000
+
+BUCKET_DIMENSIONS = ["brand", "model", "year"]
+METRICS = ["price", "mileage"]
+
+# Bucket dimensions of each granularity, finest first
+GRANULARITIES = [BUCKET_DIMENSIONS, ["brand", "model"], ["brand"], []]
+
+# A block is summarized when it holds more than this many times the chunks of a summary
+SUMMARY_RATIO = 4
+
+# Blocks of 1, 2, 4, ... months: up to 2**(BLOCK_LEVELS - 1) months (10 years)
+BLOCK_LEVELS = 8
+
+# Bits of a row key holding the day, of a block key holding the level and the
+# block, and of a sort key holding the rank of a value
+_DAY_BITS = 20
+_BLOCK_BITS = 16
+_LEVEL_BITS = 8
+_RANK_BITS = 27
+
+@st.cache_resource
+def _shared_sketches(db_path):
+    return SketchStore(SKETCH_EPSILON)
+
+def get_sketches(dataset=None):
+    """
+    The process-wide sketch store, brought up to date with `dataset` (the
+    shared dataset by default).
+    """
+    dataset = get_dataset() if dataset is None else dataset
+    store = _shared_sketches(get_incremental_loader().db_path)
+    store.update(dataset.frame, dataset.version)
+    return store
+
+class SketchStore:
+    """
+    Buckets are numbered in order of appearance: `buckets` maps the
+    (brand, model, year) of a bucket of the finest granularity to its number,
+    None standing for a missing value, and parents[g][bucket] is the number of
+    the bucket holding it at granularity g (`dimensions[g]` describes them).
+    `keys` holds the (finest bucket, day) of every listing, sorted, and
+    `values` its METRICS in the same order. For each granularity and metric,
+    `nodes` holds the sorted keys (bucket, level, block) of the summarized
+    blocks, and `centroids` their (value, weight) chunks, the chunks of node i
+    being offsets[i]:offsets[i + 1].
+    """
+
+    def __init__(self, epsilon):
+        self.epsilon = epsilon
+        self.chunks = math.ceil(2 / epsilon)
+        self.version = None
+        self.buckets = {}
+        self.coarser = [{} for _ in GRANULARITIES]
+        self.parents = [np.zeros(0, dtype=np.int64) for _ in GRANULARITIES]
+        self.dimensions = [pd.DataFrame(columns=dimensions, dtype=object) for dimensions in GRANULARITIES]
+        self.rows = None
+        self.hashes = None
+        self.keys = np.zeros(0, dtype=np.int64)
+        self.values = {metric: np.zeros(0) for metric in METRICS}
+        self.nodes = [{metric: np.zeros(0, dtype=np.int64) for metric in METRICS} for _ in GRANULARITIES]
+        self.offsets = [{metric: np.zeros(1, dtype=np.int64) for metric in METRICS} for _ in GRANULARITIES]
+        self.centroids = [{metric: (np.zeros(0), np.zeros(0, dtype=np.int64)) for metric in METRICS} for _ in GRANULARITIES]
+        self._lock = threading.Lock()
+
+    def update(self, cleaned, version):
+        with self._lock:
+            if version == self.version:
+                return
+            rows = self._sketch_rows(cleaned)
+            removed, added, hashes = row_multiset_diff(self.rows, rows, self.hashes)
+            affected = np.union1d(removed["bucket"].to_numpy(), added["bucket"].to_numpy())
+            order = np.argsort(rows["key"].to_numpy(), kind="stable")
+            self.keys = rows["key"].to_numpy()[order]
+            self.values = {metric: rows[metric].to_numpy(dtype=float)[order] for metric in METRICS}
+            buckets, days = self.keys >> _DAY_BITS, self.keys & (2**_DAY_BITS - 1)
+            ranks = {metric: np.unique(self.values[metric], return_inverse=True)[1].reshape(-1) for metric in METRICS}
+            for granularity, parents in enumerate(self.parents):
+                # The rows of the affected buckets of the granularity, sorted by (bucket, day)
+                touched = np.unique(parents[affected])
+                rows_touched = np.flatnonzero(np.isin(parents[buckets], touched))
+                keys = (parents[buckets[rows_touched]] << _DAY_BITS) | days[rows_touched]
+                order = np.argsort(keys, kind="stable")
+                for metric in METRICS:
+                    rows_sorted = rows_touched[order]
+                    self._summarize(granularity, metric, touched, keys[order], self.values[metric][rows_sorted], ranks[metric][rows_sorted])
+            self.rows = rows
+            self.hashes = hashes
+            self.version = version
+
+    def _sketch_rows(self, cleaned):
+        # (finest bucket, day) key and METRICS of each listing; new buckets get a number
+        codes = [pd.factorize(cleaned[column].to_numpy(dtype=object))[0] for column in BUCKET_DIMENSIONS]
+        distinct = np.zeros(len(cleaned), dtype=np.int64)
+        for column_codes in codes:
+            distinct = pd.factorize(distinct * (column_codes.max(initial=0) + 2) + column_codes + 1)[0]
+        first = np.unique(distinct, return_index=True)[1]
+        dimensions = cleaned[BUCKET_DIMENSIONS].iloc[first].astype(object)
+        ids = np.array([self.buckets.setdefault(tuple(None if pd.isna(value) else value for value in values), len(self.buckets))
+                        for values in dimensions.itertuples(index=False, name=None)], dtype=np.int64)
+        if len(self.buckets) > len(self.parents[0]):
+            for granularity, columns in enumerate(GRANULARITIES):
+                positions = [BUCKET_DIMENSIONS.index(column) for column in columns]
+                coarser = self.coarser[granularity]
+                self.parents[granularity] = np.array([coarser.setdefault(tuple(bucket[i] for i in positions), len(coarser))
+                                                      for bucket in self.buckets], dtype=np.int64)
+                self.dimensions[granularity] = pd.DataFrame(list(coarser), columns=columns, dtype=object)
+        days = cleaned["date"].to_numpy().astype("datetime64[D]").astype(np.int64)
+        rows = pd.DataFrame({"key": (ids[distinct] << _DAY_BITS) | days, "bucket": ids[distinct]})
+        for metric in METRICS:
+            rows[metric] = cleaned[metric].to_numpy(dtype=float, na_value=np.nan)
+        return rows
+
+    def _summarize(self, granularity, metric, affected, keys, values, ranks):
+        # Summaries of every block of more than SUMMARY_RATIO * `chunks`
+        # values of the affected buckets of a granularity, replacing theirs
+        # (`ranks` orders the values)
+        known = ~np.isnan(values)
+        bucket = keys >> _DAY_BITS
+        # A bucket of few values has no large block at any level
+        known &= np.bincount(bucket[known], minlength=len(bucket) and bucket.max() + 1)[bucket] > SUMMARY_RATIO * self.chunks
+        keys, values, rank = keys[known], values[known], ranks[known]
+        bucket, month = keys >> _DAY_BITS, _month(keys & (2**_DAY_BITS - 1))
+        # Rows sorted by block then value: the rows of a level are sorted runs
+        # of the next one, which a stable sort merges
+        order = np.arange(len(values))
+        nodes, centroid_values, centroid_weights = [], [], []
+        for level in range(BLOCK_LEVELS):
+            block = (bucket[order] << _BLOCK_BITS) | (month[order] >> level)
+            resorted = np.argsort((block << _RANK_BITS) | rank[order], kind="stable")
+            order, block = order[resorted], block[resorted]
+            start = _run_starts(block)
+            size = np.diff(np.append(start, len(block)))
+            large = size > SUMMARY_RATIO * self.chunks
+            if not large.any():
+                continue
+            # Chunks of equal rank of the sorted values of each large block
+            start, size = start[large], size[large]
+            first = start[:, None] + (np.arange(self.chunks) * size[:, None] + self.chunks - 1) // self.chunks
+            last = np.append(first[:, 1:], (start + size)[:, None], axis=1)
+            first, last = first.reshape(-1), last.reshape(-1)
+            centroid_values.append((values[order[(first + last - 1) // 2]] + values[order[(first + last) // 2]]) / 2)
+            centroid_weights.append(last - first)
+            block_keys = np.repeat(block[start], self.chunks)
+            nodes.append(((block_keys >> _BLOCK_BITS) << (_LEVEL_BITS + _BLOCK_BITS)) | (level << _BLOCK_BITS) | (block_keys & (2**_BLOCK_BITS - 1)))
+        old_nodes, old_offsets = self.nodes[granularity][metric], self.offsets[granularity][metric]
+        old_values, old_weights = self.centroids[granularity][metric]
+        kept = ~np.isin(old_nodes >> (_LEVEL_BITS + _BLOCK_BITS), affected)
+        kept_chunks = np.repeat(kept, np.diff(old_offsets))
+        chunk_nodes = np.concatenate([np.repeat(old_nodes[kept], np.diff(old_offsets)[kept])] + nodes)
+        chunk_values = np.concatenate([old_values[kept_chunks]] + centroid_values)
+        chunk_weights = np.concatenate([old_weights[kept_chunks]] + centroid_weights)
+        order = np.argsort(chunk_nodes, kind="stable")
+        chunk_nodes = chunk_nodes[order]
+        start = _run_starts(chunk_nodes)
+        self.nodes[granularity][metric] = chunk_nodes[start]
+        self.offsets[granularity][metric] = np.append(start, len(chunk_nodes))
+        self.centroids[granularity][metric] = (chunk_values[order], chunk_weights[order])
+
+    def select(self, metric, version=None, date_range=None, price_range=None, by=None, **selection):
+        """
+        Centroids (value, weight and bucket dimensions) of `metric` for the
+        listings matching the selection, or None when `version` is given and
+        the sketches hold another version of the dataset. `selection` maps
+        bucket dimensions (brand, model, year) to a value or a list of values;
+        the centroids are taken from the coarsest granularity that has these
+        and `by` (the dimension the caller groups them by). A price window is
+        only supported for the 'price' metric. For 'year', the listings per
+        bucket are returned, which is exact.
+        """
+        if price_range is not None and metric != "price":
+            raise ValueError("a price window can only be applied to the price sketches")
+        needed = set(selection) | ({by} if by is not None else set()) | ({"year"} if metric == "year" else set())
+        granularity = max(g for g, columns in enumerate(GRANULARITIES) if needed <= set(columns))
+        source = "price" if metric == "year" else metric
+        with self._lock:
+            if version is not None and version != self.version:
+                return None
+            keep = np.ones(len(self.dimensions[0]), dtype=bool)
+            for column, values in selection.items():
+                values = values if isinstance(values, (list, tuple, set, np.ndarray, pd.Index)) else [values]
+                keep &= self.dimensions[0][column].isin([_plain(value) for value in values]).to_numpy()
+            buckets = np.flatnonzero(keep)
+            days = self.keys & (2**_DAY_BITS - 1)
+            if date_range is None:
+                first_day, last_day = (int(days.min()), int(days.max())) if len(days) else (0, -1)
+            else:
+                first_day, last_day = (int(pd.Timestamp(day).to_datetime64().astype("datetime64[D]").astype(np.int64)) for day in date_range)
+            values, weights, owners = self._gather(granularity, source, buckets, first_day, last_day + 1)
+            dimensions = self.dimensions[granularity]
+        if price_range is not None:
+            inside = (values >= price_range[0]) & (values <= price_range[1])
+            values, weights, owners = values[inside], weights[inside], owners[inside]
+        if metric == "year":
+            counts = np.bincount(owners, weights=weights, minlength=len(dimensions))
+            owners = np.flatnonzero(counts)
+            weights = counts[owners].astype(np.int64)
+            values = dimensions["year"].to_numpy()[owners]
+            known = pd.notna(values)
+            values, weights, owners = values[known].astype(float), weights[known], owners[known]
+        centroids = dimensions.iloc[owners].reset_index(drop=True)
+        centroids.insert(0, "weight", weights)
+        centroids.insert(0, "value", values)
+        return centroids
+
+    def _gather(self, granularity, metric, buckets, start_day, end_day):
+        # Values, weights and buckets (of the granularity) of the summaries
+        # and listings of the finest buckets between two days (end excluded),
+        # with the lock held
+        first_month = _month(start_day) if _month_start(_month(start_day)) == start_day else _month(start_day) + 1
+        end_month = _month(end_day)
+        if first_month >= end_month:
+            edges, blocks = [(start_day, end_day)], []
+        else:
+            edges = [(start_day, _month_start(first_month)), (_month_start(end_month), end_day)]
+            blocks = _blocks(first_month, end_month)
+        parents = self.parents[granularity][buckets]
+        coarse = np.unique(parents)
+        values, weights, owners = [], [], []
+        centroid_values, centroid_weights = self.centroids[granularity][metric]
+        nodes, offsets = self.nodes[granularity][metric], self.offsets[granularity][metric]
+        for level, block in blocks:
+            keys = (coarse << (_LEVEL_BITS + _BLOCK_BITS)) | (level << _BLOCK_BITS) | block
+            positions = np.searchsorted(nodes, keys)
+            found = positions < len(nodes)
+            found[found] = nodes[positions[found]] == keys[found]
+            chunks = _ranges(offsets[positions[found]], offsets[positions[found] + 1])
+            values.append(centroid_values[chunks])
+            weights.append(centroid_weights[chunks])
+            owners.append(np.repeat(coarse[found], np.diff(offsets)[positions[found]]))
+            # The blocks not summarized are read from the listings of their finest buckets
+            small = np.isin(parents, coarse[~found])
+            self._listings(metric, buckets[small], parents[small], _month_start(block << level),
+                           _month_start((block + 1) << level), values, weights, owners)
+        for first, end in edges:
+            if first < end:
+                self._listings(metric, buckets, parents, first, end, values, weights, owners)
+        if not values:
+            return np.zeros(0), np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        values, weights, owners = np.concatenate(values), np.concatenate(weights), np.concatenate(owners)
+        known = ~np.isnan(values)
+        return values[known], weights[known], owners[known]
+
+    def _listings(self, metric, buckets, parents, first_day, end_day, values, weights, owners):
+        # Append the values of the listings of finest buckets between two days
+        starts = np.searchsorted(self.keys, (buckets << _DAY_BITS) | first_day)
+        ends = np.searchsorted(self.keys, (buckets << _DAY_BITS) | end_day)
+        rows = _ranges(starts, ends)
+        values.append(self.values[metric][rows])
+        weights.append(np.ones(len(rows), dtype=np.int64))
+        owners.append(np.repeat(parents, ends - starts))
+
+def sketch_quantiles(centroids, qs):
+    """
+    Quantiles of a set of centroids, using the same linear interpolation as
+    pandas: exact when every centroid has weight 1.
+    """
+    order = np.argsort(centroids["value"].to_numpy(), kind="stable")
+    values = centroids["value"].to_numpy(dtype=float)[order]
+    weights = centroids["weight"].to_numpy(dtype=float)[order]
+    if len(values) == 0:
+        return np.full(len(qs), np.nan)
+    # Rank of the middle of each chunk (0-based)
+    positions = np.cumsum(weights) - weights + (weights - 1) / 2
+    return np.interp((weights.sum() - 1) * np.asarray(qs), positions, values)
+
+def exact_centroids(values):
+    """
+    The values of a Series as centroids of weight 1 (no missing value), for
+    sketch_quantiles and box_stats.
+    """
+    values = values.dropna().to_numpy(dtype=float)
+    return pd.DataFrame({"value": values, "weight": np.ones(len(values), dtype=np.int64)})
+
+def box_stats(centroids, label=None):
+    """
+    matplotlib `bxp` statistics computed from centroids, as seaborn computes
+    them from the values: quartiles interpolated linearly and whiskers at the
+    furthest values within 1.5 IQR of the box. Individual outliers are not
+    kept by the sketches, so no fliers are drawn.
+    """
+    q1, med, q3 = sketch_quantiles(centroids, [0.25, 0.5, 0.75])
+    values = centroids["value"].to_numpy(dtype=float)
+    iqr = q3 - q1
+    inside = values[(values >= q1 - 1.5 * iqr) & (values <= q3 + 1.5 * iqr)]
+    return {
+        "label": label,
+        "q1": q1, "med": med, "q3": q3,
+        "whislo": inside.min() if len(inside) else q1,
+        "whishi": inside.max() if len(inside) else q3,
+        "fliers": [],
+    }
+
+def quantiles(data, column, qs, query=None):
+    """
+    Quantiles of data[column]. When `data` has more than EXACT_MAX_ROWS rows
+    and `query` describes it for SketchStore.select (None when the page applied
+    filters the sketches do not know about), the sketches are used instead,
+    if they hold the version of the dataset named in the query.
+    """
+    centroids = None
+    if query is not None and len(data) > EXACT_MAX_ROWS:
+        centroids = get_sketches().select(column, **query)
+    if centroids is None:
+        return list(data[column].quantile(qs))
+    return list(sketch_quantiles(centroids, qs))
+
+def draw_boxplot(ax, data, y, x=None, order=None, query=None, exact=False):
+    """
+    Boxplot of data[y] (by data[x] if given) on ax: with seaborn up to
+    EXACT_MAX_ROWS rows or when `exact`, otherwise without outliers, from the
+    sketches when `query` describes `data` (see quantiles) or from the values
+    themselves.
+    """
+    if x is not None and order is None:
+        # seaborn would also draw the categories absent from `data`
+        order = data[x].dropna().unique().tolist()
+    if x is not None and not order:
+        # Every listing has a missing `x`: no box to draw
+        ax.set_xticks([])
+        ax.set_xlabel(x)
+        ax.set_ylabel(y)
+        return
+    if exact or len(data) <= EXACT_MAX_ROWS:
+        import seaborn as sns
+
+        if x is None:
+            sns.boxplot(x=data[y], ax=ax)
+        else:
+            sns.boxplot(x=x, y=y, data=data, order=order, ax=ax)
+        return
+    centroids = None if query is None else get_sketches().select(y, by=x, **query)
+    if centroids is None:
+        centroids = exact_centroids(data[y]).assign(**({} if x is None else {x: data.loc[data[y].notna(), x].to_numpy()}))
+    if x is None:
+        ax.bxp([box_stats(centroids)], vert=False, showfliers=False)
+        ax.set_xlabel(y)
+        return
+    groups = dict(list(centroids.groupby(x, observed=True)))
+    ax.bxp([box_stats(groups[label], label) for label in order if label in groups], showfliers=False)
+    ax.set_xlabel(x)
+    ax.set_ylabel(y)
+
+def _blocks(first_month, end_month):
+    # The longest aligned blocks covering the months, as (level, block)
+    blocks = []
+    while first_month < end_month:
+        level = 0
+        while (level + 1 < BLOCK_LEVELS and first_month % 2 ** (level + 1) == 0
+               and first_month + 2 ** (level + 1) <= end_month):
+            level += 1
+        blocks.append((level, first_month >> level))
+        first_month += 2 ** level
+    return blocks
+
+def _run_starts(keys):
+    # Positions where a run of equal sorted keys starts
+    return np.flatnonzero(np.append(True, keys[1:] != keys[:-1])) if len(keys) else np.zeros(0, dtype=np.int64)
+
+def _ranges(starts, ends):
+    # Concatenated aranges start:end
+    lengths = ends - starts
+    return np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+
+def _month(day):
+    # Months since 1970-01 of days since 1970-01-01
+    return np.asarray(day).astype("datetime64[D]").astype("datetime64[M]").astype(np.int64)
+
+def _month_start(month):
+    # Days since 1970-01-01 of the first day of a month
+    return int(np.int64(month).astype("datetime64[M]").astype("datetime64[D]").astype(np.int64))
+
+def _plain(value):
+    # Selection values as the bucket dimensions hold them
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return None
+    return value.item() if isinstance(value, np.generic) else value
@@ -0,0 +1,242 @@
+"""
+Synthetic listings with the scraper's Car schema, for benchmarks and tests
+without the real cars_db.sqlite.
+
+Brands and models follow Zipf-like popularity (a few brands and models make
+most of the listings, with a long tail of rare ones below MIN_LISTINGS). The
+year drives the mileage, and age, mileage and fuel drive the price around a
+base price per model. The problems clean_data deals with are included: empty
+brands and models, junk prices (BAD_PRICES and prices under 50), mileages
+written in thousands (under 1000), missing mileages and listings posted
+before 2020.
+
+Rows are generated in chunks of CHUNK_ROWS with a seed per chunk: the same
+(rows, seed) always gives the same listings, and 10M rows never need more
+than one chunk in memory.
+
+Usage:
+    python synthetic.py cars_db.sqlite --rows 1000000 [--seed 0]
+"""
+import argparse
+import sqlite3
+
+import numpy as np
+import pandas as pd
+
+from db import sql_values
+from utils import BAD_PRICES, COLUMNS
+
+# Rows generated (and inserted) at a time
+CHUNK_ROWS = 500_000
+
+# Listings are posted between these dates; END_DATE is also the "current"
+# year of the models, so the data does not depend on the day it is generated
+START_DATE = pd.Timestamp("2019-06-01")
+END_DATE = pd.Timestamp("2025-09-30")
+
+# Brands by popularity, with their models by popularity
+CATALOG = {
+    "RENAULT": ["Clio", "Symbol", "Megane", "Kangoo", "Captur", "Scenic", "Express"],
+    "PEUGEOT": ["208", "308", "207", "301", "Partner", "3008", "206"],
+    "VOLKSWAGEN": ["Golf", "Polo", "Passat", "Caddy", "Tiguan", "Touareg"],
+    "HYUNDAI": ["Accent", "i10", "Tucson", "Elantra", "Atos", "Creta"],
+    "DACIA": ["Logan", "Sandero", "Duster", "Dokker", "Stepway"],
+    "TOYOTA": ["Yaris", "Corolla", "Hilux", "Land Cruiser", "Rav4"],
+    "KIA": ["Picanto", "Rio", "Sportage", "Cerato"],
+    "CHEVROLET": ["Sail", "Aveo", "Spark", "Optra", "Cruze"],
+    "SEAT": ["Ibiza", "Leon", "Arona"],
+    "CITROEN": ["C3", "C4", "Berlingo", "C-Elysee"],
+    "SUZUKI": ["Swift", "Alto", "Maruti", "Celerio"],
+    "FIAT": ["Tipo", "Punto", "Doblo", "500"],
+    "NISSAN": ["Micra", "Qashqai", "Navara", "Sunny"],
+    "SKODA": ["Octavia", "Fabia", "Rapid"],
+    "MERCEDES": ["Classe C", "Classe E", "Classe A", "Sprinter"],
+    "BMW": ["Serie 3", "Serie 5", "X3"],
+    "AUDI": ["A3", "A4", "A6", "Q5"],
+    "FORD": ["Fiesta", "Focus", "Ranger"],
+    "CHERY": ["Tiggo", "QQ"],
+    "GEELY": ["Emgrand", "Coolray"],
+    "MITSUBISHI": ["L200", "Pajero"],
+    "OPEL": ["Astra", "Corsa"],
+    "HONDA": ["Civic", "Jazz"],
+    "MAZDA": ["3", "6"],
+    "JEEP": ["Grand Cherokee", "Renegade"],
+    "DFSK": ["Glory", "Mini Truck"],
+    "JAC": ["J5", "S3"],
+    "LADA": ["Niva", "Granta"],
+    "SSANGYONG": ["Rexton", "Tivoli"],
+    "ISUZU": ["D-Max"],
+    "LAND ROVER": ["Range Rover", "Discovery"],
+    "PORSCHE": ["Cayenne", "Macan"],
+}
+
+# Rare models of every brand, and their popularity relative to the catalog's
+# models: most of them stay below MIN_LISTINGS
+RARE_MODELS = 12
+RARE_WEIGHT = 1e-3
+
+# Price level of a brand relative to the others
+BRAND_PRICE = {"MERCEDES": 2.5, "BMW": 2.5, "AUDI": 2.2, "LAND ROVER": 3.5, "PORSCHE": 4.0,
+               "TOYOTA": 1.5, "JEEP": 1.6, "VOLKSWAGEN": 1.3, "DACIA": 0.8, "CHERY": 0.7, "LADA": 0.6}
+
+# Median price (same unit as the scraped prices: millions of centimes) of a new car
+BASE_PRICE = 300
+
+# Share of the listings of each wilaya code (the others share the rest)
+WILAYAS = {16: ("Alger", 0.22), 31: ("Oran", 0.08), 19: ("Sétif", 0.07), 25: ("Constantine", 0.05),
+           9: ("Blida", 0.05), 15: ("Tizi Ouzou", 0.04), 6: ("Béjaïa", 0.04), 35: ("Boumerdès", 0.04),
+           42: ("Tipaza", 0.03), 5: ("Batna", 0.03)}
+
+FUELS = {"Diesel": 0.55, "Essence": 0.40, "GPL": 0.04, "Hybride": 0.01}
+ENGINES = {"Diesel": ["1.5 dCi", "1.6 HDi", "2.0 TDI", "1.9 TDI"], "Essence": ["1.2", "1.4 TSI", "1.6", "1.0 TCe"],
+           "GPL": ["1.6", "1.4"], "Hybride": ["1.8 Hybrid"]}
+COLORS = ["Blanc", "Noir", "Gris", "Gris argent", "Bleu", "Rouge", "Marron", "Vert"]
+PAPERS = ["Carte grise / safia", "Carte jaune", "Licence / délai"]
+FINITIONS = ["Life", "Zen", "Intens", "Allure", "Active", "Highline", "Confortline", None]
+
+def synthetic_frame(rows, seed=0):
+    """
+    `rows` raw listings as one frame with the columns load_data_from_db reads.
+    """
+    return pd.concat([chunk[COLUMNS] for chunk in iter_synthetic(rows, seed)], ignore_index=True)
+
+def iter_synthetic(rows, seed=0):
+    """
+    `rows` raw listings with their createdAt/updatedAt, as frames of at most
+    CHUNK_ROWS rows.
+    """
+    models = _models(seed)
+    for number, start in enumerate(range(0, rows, CHUNK_ROWS)):
+        yield _chunk(np.random.default_rng([seed, number + 1]), models, start, min(CHUNK_ROWS, rows - start))
+
+def write_synthetic_db(path, listings):
+    """
+    Write listings (a frame, or an iterable of frames) to a new SQLite file
+    with the scraper's Cars table. Missing createdAt/updatedAt are set to a
+    fixed time.
+    """
+    frames = [listings] if isinstance(listings, pd.DataFrame) else listings
+    conn = sqlite3.connect(path)
+    try:
+        # A throwaway file: no journal needed while it is written
+        conn.execute("PRAGMA journal_mode = OFF")
+        conn.execute("PRAGMA synchronous = OFF")
+        conn.execute("DROP TABLE IF EXISTS Cars")
+        conn.execute(
+            "CREATE TABLE Cars (id INTEGER PRIMARY KEY AUTOINCREMENT, link VARCHAR(255) NOT NULL UNIQUE, "
+            "title VARCHAR(255), price INTEGER NOT NULL, engine VARCHAR(255), fuel VARCHAR(255), mileage INTEGER, "
+            "color VARCHAR(255), gearbox VARCHAR(255), paper VARCHAR(255), brand VARCHAR(255), year INTEGER, "
+            "model VARCHAR(255), finition VARCHAR(255), location VARCHAR(255), wilaya INTEGER, date DATE, "
+            "createdAt DATETIME NOT NULL, updatedAt DATETIME NOT NULL)"
+        )
+        columns = COLUMNS + ["createdAt", "updatedAt"]
+        insert = f"INSERT INTO Cars ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+        for frame in frames:
+            frame = frame.assign(**{column: "2025-01-01 00:00:00.000 +00:00" for column in ["createdAt", "updatedAt"] if column not in frame})
+            values = [sql_values(frame[column]) for column in columns]
+            conn.executemany(insert, zip(*values))
+        conn.commit()
+    finally:
+        conn.close()
+
+def _models(seed):
+    # (brand, model, popularity, base price) of every model of the catalog
+    rng = np.random.default_rng(seed)
+    brands, models, weights, prices = [], [], [], []
+    for brand_rank, (brand, names) in enumerate(CATALOG.items(), start=1):
+        names = names + [f"{name} {suffix}" for name, suffix in zip(names * RARE_MODELS, range(2, RARE_MODELS + 2))][:RARE_MODELS]
+        for model_rank, name in enumerate(names, start=1):
+            brands.append(brand)
+            models.append(name)
+            rare = model_rank > len(CATALOG[brand])
+            weights.append(brand_rank ** -1.1 * model_rank ** -1.3 * (RARE_WEIGHT if rare else 1))
+            prices.append(BASE_PRICE * BRAND_PRICE.get(brand, 1.0) * rng.lognormal(0, 0.3))
+    weights = np.array(weights)
+    return pd.DataFrame({"brand": brands, "model": models, "weight": weights / weights.sum(), "price": prices})
+
+def _chunk(rng, models, start, rows):
+    picked = rng.choice(len(models), rows, p=models["weight"].to_numpy())
+    brand = models["brand"].to_numpy()[picked]
+    model = models["model"].to_numpy()[picked]
+
+    # Age in years, then a mileage of about 15000 km per year
+    age = np.minimum(np.floor(rng.gamma(2.0, 4.0, rows)), 35).astype(np.int64)
+    age[rng.random(rows) < 0.03] = 0
+    year = END_DATE.year - age
+    mileage = np.where(age == 0, rng.integers(0, 5000, rows),
+                       age * rng.lognormal(np.log(15_000), 0.45, rows)).astype(np.int64)
+
+    fuel = rng.choice(list(FUELS), rows, p=list(FUELS.values()))
+    price = (models["price"].to_numpy()[picked] * np.exp(-0.08 * age) * np.exp(-0.12 * mileage / 100_000)
+             * np.where(fuel == "Diesel", 1.1, 1.0) * rng.lognormal(0, 0.18, rows))
+    price = np.maximum(np.round(price), 50).astype(np.int64)
+
+    # What clean_data fixes or drops
+    junk = rng.random(rows)
+    price[junk < 0.03] = rng.choice(BAD_PRICES, (junk < 0.03).sum())
+    price[(junk >= 0.03) & (junk < 0.04)] = rng.integers(1, 50, ((junk >= 0.03) & (junk < 0.04)).sum())
+    in_thousands = rng.random(rows) < 0.12
+    mileage[in_thousands] //= 1000
+    mileage = pd.array(mileage, dtype="Int64")
+    mileage[rng.random(rows) < 0.01] = pd.NA
+    shown_brand = brand.copy()
+    shown_brand[rng.random(rows) < 0.01] = ""
+    shown_model = model.copy()
+    shown_model[rng.random(rows) < 0.01] = None
+
+    codes = np.array(list(WILAYAS))
+    shares = np.array([share for _, share in WILAYAS.values()])
+    others = np.setdiff1d(np.arange(1, 59), codes)
+    wilaya = np.where(rng.random(rows) < shares.sum(), rng.choice(codes, rows, p=shares / shares.sum()), rng.choice(others, rows))
+    names = {code: name for code, (name, _) in WILAYAS.items()}
+    location = np.array([names.get(code, "Centre ville") for code in range(59)], dtype=object)[wilaya]
+
+    # More listings in recent months
+    # (each distinct day and minute is formatted once)
+    span = (END_DATE - START_DATE).days
+    days = (START_DATE + pd.to_timedelta(np.arange(span + 1), "D")).strftime("%Y-%m-%d").to_numpy(dtype=object)
+    minutes = np.array([f" {minute // 60:02d}:{minute % 60:02d}:00.000 +00:00" for minute in range(1440)], dtype=object)
+    posted = days[np.floor(np.sqrt(rng.random(rows)) * (span + 1)).astype(np.int64)]
+    stamps = posted + minutes[rng.integers(0, 1440, rows)]
+
+    def pick(values, weights=None):
+        return np.array(values, dtype=object)[rng.choice(len(values), rows, p=weights)]
+
+    engine = np.empty(rows, dtype=object)
+    for name, engines in ENGINES.items():
+        mask = fuel == name
+        engine[mask] = np.array(engines, dtype=object)[rng.integers(0, len(engines), mask.sum())]
+
+    ids = 30_000_000 + start + np.arange(rows)
+    titles = (models["brand"] + " " + models["model"] + " ").to_numpy(dtype=object)
+    return pd.DataFrame({
+        "link": "https://www.ouedkniss.com/voiture-d" + ids.astype(str).astype(object),
+        "title": titles[picked] + year.astype(str).astype(object),
+        "price": price,
+        "engine": engine,
+        "fuel": fuel.astype(object),
+        "mileage": mileage,
+        "color": pick(COLORS),
+        "gearbox": np.where(rng.random(rows) < np.where(age < 5, 0.3, 0.1), "Automatique", "Manuelle").astype(object),
+        "paper": pick(PAPERS, [0.85, 0.1, 0.05]),
+        "brand": shown_brand,
+        "year": year,
+        "model": shown_model,
+        "finition": pick(FINITIONS),
+        "location": location,
+        "wilaya": wilaya,
+        "date": posted,
+        "createdAt": stamps,
+        "updatedAt": stamps,
+    })
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path")
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    write_synthetic_db(args.path, iter_synthetic(args.rows, args.seed))
+
+if __name__ == "__main__":
+    main()
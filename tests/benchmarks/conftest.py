@@ -0,0 +1,15 @@
+"""
+Fixtures of the per-feature benchmarks (the system-level ones, which start
+processes or servers, are in benchmark.py).
+"""
+import pytest
+
+import utils
+
+@pytest.fixture(scope="session")
+def frame(cleaned):
+    """
+    The `cleaned` listings of a Dataset, with the columns the pages derive
+    (date_int). Shared: copy before changing.
+    """
+    return utils.Dataset(cleaned, "benchmark").frame
@@ -0,0 +1,57 @@
+"""
+The deal scores and top-K lists of a dataset version, and the best deals of a
+few filter combinations against a full sort of the matching listings.
+"""
+import numpy as np
+import pytest
+
+import deals
+from inverted_index import InvertedIndex
+
+@pytest.fixture(scope="module")
+def scores(frame):
+    return deals.DealScores(frame)
+
+@pytest.fixture(scope="module")
+def index(frame):
+    return InvertedIndex(frame)
+
+def selections(frame):
+    # (values the top-K lists are kept by, criteria narrowed with the index)
+    brand = frame["brand"].value_counts().index[1]
+    model = frame.loc[frame["brand"] == brand, "model"].value_counts().index[0]
+    return {
+        "all listings": ({}, {}),
+        "brand": ({"brand": brand}, {}),
+        "model": ({"brand": brand, "model": model}, {}),
+        "wilaya": ({"wilaya": 16}, {}),
+        "brand and wilaya": ({"brand": brand, "wilaya": 16}, {}),
+        "brand and years": ({"brand": brand}, {"year": [2015, 2016, 2017]}),
+        "price window": ({}, {"price": (100, 300)}),
+    }
+
+def full_sort(frame, scores, values, selected, n=50):
+    keep = ~np.isnan(scores.score)
+    for column, value in values.items():
+        keep &= frame[column].to_numpy() == value
+    if selected is not None:
+        keep &= np.isin(np.arange(len(frame)), selected)
+    matching = np.flatnonzero(keep)
+    return matching[np.argsort(scores.score[matching], kind="stable")][:n]
+
+@pytest.mark.parametrize("implementation", ["full sort", "top-K lists"])
+@pytest.mark.parametrize("selection", ["all listings", "brand", "model", "wilaya", "brand and wilaya", "brand and years", "price window"])
+def test_benchmark_best(benchmark, frame, scores, index, rows, selection, implementation):
+    benchmark.group = f"best 50 deals, {selection}, {rows} rows"
+    values, criteria = selections(frame)[selection]
+    selected = index.narrow(None, **criteria) if criteria else None
+    if implementation == "full sort":
+        best = benchmark(full_sort, frame, scores, values, selected)
+    else:
+        best = benchmark(scores.best, 50, selected, **values)
+    # Listings of equal scores may come in any order
+    np.testing.assert_array_equal(scores.score[best], scores.score[full_sort(frame, scores, values, selected)])
+
+def test_benchmark_build(benchmark, frame, rows):
+    benchmark.group = f"deal scores and top-K lists, {rows} rows"
+    benchmark(deals.DealScores, frame)
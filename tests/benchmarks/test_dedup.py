@@ -0,0 +1,55 @@
+"""
+Clustering time of the near-duplicate detection, built at once and
+incrementally (reposts arriving in a new version), and the share of reposts
+found when they are not exact copies.
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+import dedup
+import utils
+
+# Share of the injected reposts that must land in their original's cluster
+MIN_RECALL = 0.85
+
+def with_reposts(frame, share=0.05, seed=0):
+    # `frame` plus a repost of `share` of its listings: a new link three days
+    # later, the price within 2%, a few more km and sometimes a longer title
+    rng = np.random.default_rng(seed)
+    originals = np.sort(rng.choice(len(frame), int(len(frame) * share), replace=False))
+    reposts = frame.iloc[originals].copy()
+    reposts["link"] = (reposts["link"].astype(str) + "-repost").astype(frame["link"].dtype)
+    reposts["price"] = (reposts["price"] * rng.uniform(0.98, 1.02, len(reposts))).round().astype(frame["price"].dtype)
+    reposts["mileage"] = (reposts["mileage"] + rng.integers(0, 3000, len(reposts))).astype(frame["mileage"].dtype)
+    reposts["title"] = (reposts["title"].astype(str) + np.where(rng.random(len(reposts)) < 0.5, " urgent", "")).astype(frame["title"].dtype)
+    reposts["date"] = reposts["date"] + pd.Timedelta(days=3)
+    combined = utils.apply_schema(pd.concat([frame, reposts], ignore_index=True))
+    return combined, originals, np.arange(len(frame), len(combined))
+
+@pytest.fixture(scope="module")
+def reposted(cleaned):
+    return with_reposts(cleaned)
+
+def assert_reposts_found(benchmark, duplicates, originals, reposts):
+    found = (duplicates.cluster[originals] == duplicates.cluster[reposts]).mean()
+    benchmark.extra_info["reposts found"] = found
+    assert found >= MIN_RECALL, f"only {found:.1%} of the reposts found"
+
+def test_benchmark_build(benchmark, reposted, rows):
+    benchmark.group = f"near-duplicate clusters, {rows} rows"
+    combined, originals, reposts = reposted
+    duplicates = benchmark.pedantic(lambda: dedup.DuplicateStore().update(combined, "benchmark"), rounds=3)
+    assert_reposts_found(benchmark, duplicates, originals, reposts)
+
+def test_benchmark_update(benchmark, cleaned, reposted, rows):
+    benchmark.group = f"near-duplicate clusters, {rows} rows"
+    combined, originals, reposts = reposted
+
+    def before():
+        store = dedup.DuplicateStore()
+        store.update(cleaned, "before")
+        return (store, combined, "after"), {}
+
+    duplicates = benchmark.pedantic(dedup.DuplicateStore.update, setup=before, rounds=3)
+    assert_reposts_found(benchmark, duplicates, originals, reposts)
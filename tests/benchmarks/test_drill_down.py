@@ -0,0 +1,46 @@
+"""
+The Models page cascade (date, price, brand, model, years, mileage, fuel)
+with boolean masks over the frame and with the inverted index.
+"""
+import pandas as pd
+import pytest
+
+import inverted_index
+
+@pytest.fixture(scope="module")
+def index(frame):
+    return inverted_index.InvertedIndex(frame)
+
+def cascades(frame, index):
+    brand = frame["brand"].value_counts().index[0]
+    model = frame.loc[frame["brand"] == brand, "model"].value_counts().index[0]
+    days = (int(frame["date_int"].max()) - 365, int(frame["date_int"].max()))
+
+    def with_masks():
+        data = frame[(frame["date_int"] >= days[0]) & (frame["date_int"] <= days[1])]
+        data = data[(data["price"] >= 100) & (data["price"] <= 1500)]
+        data = data[data["brand"] == brand]
+        data = data[data["model"] == model]
+        data = data[data["year"].isin(data["year"].unique()[:5])]
+        data = data[(data["mileage"] >= 10_000) & (data["mileage"] <= 200_000)]
+        return data[data["fuel"].isin(data["fuel"].unique()[:2])]
+
+    def with_index():
+        selected = index.narrow(None, date_int=days, price=(100, 1500), brand=brand, model=model)
+        years = frame["year"].to_numpy()[selected]
+        selected = index.narrow(selected, year=list(pd.unique(years)[:5]), mileage=(10_000, 200_000))
+        fuels = frame["fuel"].to_numpy()[selected]
+        return index.take(index.narrow(selected, fuel=list(pd.unique(fuels)[:2])))
+
+    return {"masks": with_masks, "inverted index": with_index}
+
+@pytest.mark.parametrize("implementation", ["masks", "inverted index"])
+def test_benchmark(benchmark, frame, index, rows, implementation):
+    benchmark.group = f"Models page cascade, {rows} rows"
+    run = cascades(frame, index)
+    selected = benchmark(run[implementation])
+    assert selected.index.equals(run["masks"]().index)
+
+def test_benchmark_build(benchmark, frame, rows):
+    benchmark.group = f"inverted index build, {rows} rows"
+    benchmark(inverted_index.InvertedIndex, frame)
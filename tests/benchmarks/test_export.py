@@ -0,0 +1,63 @@
+"""
+Time and peak memory of each export format, from a DataFrame in memory and
+straight from SQLite, against the original in-memory openpyxl workbook.
+The xlsx ones take over 30 s each at 100000 rows and are marked slow (run
+them with -m slow).
+"""
+import io
+
+import pandas as pd
+import pytest
+
+import export
+import utils
+from synthetic import write_synthetic_db
+
+@pytest.fixture(scope="module")
+def db_path(raw, tmp_path_factory):
+    path = str(tmp_path_factory.mktemp("export") / "cars_db.sqlite")
+    write_synthetic_db(path, raw)
+    return path
+
+@pytest.fixture(scope="module")
+def listings(raw):
+    return utils.clean_data(raw)
+
+def peak_memory(benchmark, fn):
+    """
+    Time fn once with `benchmark` and record the growth of the peak resident
+    memory (VmHWM, reset through Linux's /proc interface) in its extra info.
+    """
+    def status(field):
+        with open("/proc/self/status") as status_file:
+            for line in status_file:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1]) * 1024
+
+    with open("/proc/self/clear_refs", "w") as clear_refs:
+        clear_refs.write("5")
+    baseline = status("VmRSS")
+    result = benchmark.pedantic(fn, rounds=1)
+    benchmark.extra_info["peak memory growth (MB)"] = (status("VmHWM") - baseline) / 2**20
+    return result
+
+def in_memory_excel(frame):
+    output = io.BytesIO()
+    with pd.ExcelWriter(output, engine="openpyxl") as writer:
+        frame.to_excel(writer, index=False, sheet_name="Car Data")
+    return output.getvalue()
+
+@pytest.mark.parametrize("source", ["frame", "SQLite"])
+@pytest.mark.parametrize("fmt", [pytest.param(fmt, marks=pytest.mark.slow) if fmt == "xlsx" else fmt for fmt in export.EXPORT_FORMATS])
+def test_benchmark(benchmark, listings, db_path, rows, fmt, source):
+    benchmark.group = f"{fmt} export, {rows} rows"
+    if source == "frame":
+        exported = peak_memory(benchmark, lambda: export.export_bytes(export.frame_chunks(listings), fmt))
+    else:
+        exported = peak_memory(benchmark, lambda: export.export_bytes(utils.iter_listings(export.CHUNK_ROWS, db_path=db_path), fmt))
+    assert exported
+
+@pytest.mark.slow
+def test_benchmark_in_memory_workbook(benchmark, listings, rows):
+    benchmark.group = f"xlsx export, {rows} rows"
+    assert peak_memory(benchmark, lambda: in_memory_excel(listings))
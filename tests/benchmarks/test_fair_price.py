@@ -0,0 +1,79 @@
+"""
+The fair-price model's batch fit against a loop of per-model fits, its
+incremental update against a refit, and the time of a page's queries.
+"""
+import numpy as np
+import pytest
+
+import fair_price
+
+def fit(frame, version="benchmark"):
+    model = fair_price.FairPriceModel(fair_price.PRIOR_LISTINGS)
+    model.update(frame, version)
+    return model
+
+@pytest.fixture(scope="module")
+def model(cleaned):
+    return fit(cleaned)
+
+def per_model_fits(model, design):
+    # The coefficients of the model, one brand x model at a time: its rows'
+    # least squares with the same prior, solved in a Python loop
+    features = model.features
+    x = np.column_stack([np.ones(len(design)), design[features[1:]].to_numpy(dtype=float)])
+    y = design["log_price"].to_numpy(dtype=float)
+    pooled = np.linalg.lstsq(x, y, rcond=None)[0]
+    prior = model.prior_listings * x.T @ x / len(x)
+    coefficients = np.zeros((len(model.groups), len(features)))
+    for group, rows in design.groupby("group").indices.items():
+        group_x, group_y = x[rows], y[rows]
+        coefficients[group] = np.linalg.solve(group_x.T @ group_x + prior, group_x.T @ group_y + prior @ pooled)
+    return coefficients
+
+def batch_fit(model, design):
+    # The statistics and coefficients again, from the same design rows as the loop
+    for statistics_of in (model.xtx, model.xty, model.count):
+        statistics_of[:] = 0
+    model._accumulate(design, 1)
+    return model._solve()
+
+def next_version(cleaned):
+    # 2% new listings and 1% repriced ones, as between two refreshes
+    before = cleaned.iloc[: len(cleaned) * 49 // 50]
+    after = cleaned.copy()
+    repriced = np.random.default_rng(0).choice(len(before), len(before) // 100, replace=False)
+    after.loc[repriced, "price"] = (after.loc[repriced, "price"] * 1.1).astype(after["price"].dtype)
+    return before, after
+
+@pytest.mark.parametrize("implementation", ["per-model loop", "batch"])
+def test_benchmark_fit(benchmark, model, rows, implementation):
+    benchmark.group = f"fair-price coefficients, {rows} rows"
+    design = model.rows
+    if implementation == "per-model loop":
+        coefficients = benchmark(per_model_fits, model, design)
+    else:
+        coefficients = benchmark(batch_fit, model, design)
+    np.testing.assert_allclose(coefficients, per_model_fits(model, design), rtol=0, atol=1e-6)
+
+def test_benchmark_build(benchmark, cleaned, rows):
+    benchmark.group = f"fair-price model build, {rows} rows"
+    benchmark(fit, cleaned)
+
+def test_benchmark_update(benchmark, cleaned, rows):
+    benchmark.group = f"fair-price model update, {rows} rows"
+    before, after = next_version(cleaned)
+
+    def update(model):
+        model.update(after, "next")
+        return model
+
+    updated = benchmark.pedantic(update, setup=lambda: ((fit(before),), {}), rounds=3)
+    refit = fit(after)
+    order = refit.groups.get_indexer(updated.groups)
+    np.testing.assert_allclose(updated.coefficients, refit.coefficients[order], rtol=0, atol=1e-6)
+
+def test_benchmark_queries(benchmark, model, cleaned, rows):
+    benchmark.group = f"fair-price queries, {rows} rows"
+    brand, name = cleaned.groupby(["brand", "model"], observed=True).size().idxmax()
+    benchmark(lambda: (model.expected_price(brand, name, 5, 80_000, "Diesel", "Manuelle"),
+                       model.depreciation(brand, name, "Diesel", "Manuelle")))
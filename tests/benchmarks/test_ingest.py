@@ -0,0 +1,67 @@
+"""
+Listings per second of ingest.py from JSONL and CSV files into a database
+with the scraper's indexes: new listings, the same listings again
+(unchanged, nothing written) and with a tenth of their prices changed. New
+listings ingested slower than INGEST_TARGET listings per second give a
+warning. What is written is checked by tests/test_ingest.py.
+"""
+import warnings
+
+import numpy as np
+import pytest
+
+import ingest
+import utils
+from synthetic import write_synthetic_db
+
+# Listings per second that ingest.py should sustain from a file to the database
+INGEST_TARGET = 100_000
+
+@pytest.fixture(scope="module")
+def files(raw, tmp_path_factory):
+    directory = tmp_path_factory.mktemp("ingest")
+    repriced = raw.copy()
+    repriced.loc[np.random.default_rng(0).random(len(raw)) < 0.1, "price"] += 10
+    paths = {name: str(directory / name) for name in ["listings.jsonl", "listings.csv", "repriced.jsonl"]}
+    raw.to_json(paths["listings.jsonl"], orient="records", lines=True)
+    raw.to_csv(paths["listings.csv"], index=False)
+    repriced.to_json(paths["repriced.jsonl"], orient="records", lines=True)
+    return paths
+
+def empty_db(raw, path):
+    write_synthetic_db(path, raw.head(0))
+    utils.ensure_indexes.__wrapped__(path)
+    return path
+
+def record_rate(benchmark, rows):
+    if benchmark.stats:
+        rate = rows / benchmark.stats.stats.min
+        benchmark.extra_info["listings per second"] = rate
+        return rate
+
+@pytest.mark.parametrize("extension", ["jsonl", "csv"])
+def test_benchmark_new_listings(benchmark, raw, files, tmp_path, rows, extension):
+    benchmark.group = f"ingest, {rows} rows"
+    path = str(tmp_path / "cars.sqlite")
+    totals = benchmark.pedantic(ingest.ingest_files, setup=lambda: (([files[f"listings.{extension}"]], empty_db(raw, path)), {}), rounds=3)
+    assert totals["read"] == rows and totals["written"] == rows - totals["rejected"]
+    rate = record_rate(benchmark, rows)
+    if rate is not None and rate < INGEST_TARGET:
+        warnings.warn(f"{extension}: {rate:,.0f} listings/s, under the target of {INGEST_TARGET:,}")
+
+@pytest.mark.parametrize("file", ["listings.jsonl", "repriced.jsonl"], ids=["unchanged", "tenth repriced"])
+def test_benchmark_known_listings(benchmark, raw, files, tmp_path, rows, file):
+    benchmark.group = f"ingest, {rows} rows"
+    path = str(tmp_path / "cars.sqlite")
+
+    def setup():
+        # The listings as first ingested, with the indexes
+        ingest.ingest_files([files["listings.jsonl"]], empty_db(raw, path))
+        return ([files[file]], path), {}
+
+    totals = benchmark.pedantic(ingest.ingest_files, setup=setup, rounds=1)
+    if file == "listings.jsonl":
+        assert totals["written"] == 0
+    else:
+        assert 0 < totals["written"] < rows // 5
+    record_rate(benchmark, rows)
@@ -0,0 +1,37 @@
+"""
+Build of the (brand, model, wilaya) summaries against pandas' groupby
+quantiles of the same cells, and the time of the Locations page's matrix and
+map queries.
+"""
+import numpy as np
+import pytest
+
+import locations
+
+@pytest.fixture(scope="module")
+def stats(frame):
+    return locations.LocationStats(frame)
+
+def groupby_quantiles(frame):
+    grouped = frame.groupby(["brand", "model", "wilaya"], observed=True)["price"]
+    return grouped.size(), grouped.quantile(list(locations.QUANTILES.values())).unstack()
+
+def test_quantiles_match_groupby(stats, frame):
+    counts, quantiles = groupby_quantiles(frame)
+    cells = stats.cells.set_index(["brand", "model", "wilaya"])
+    assert len(cells) == len(counts)
+    np.testing.assert_array_equal(cells["count"], counts.loc[cells.index])
+    np.testing.assert_allclose(cells[list(locations.QUANTILES)], quantiles.loc[cells.index])
+
+@pytest.mark.parametrize("implementation", ["pandas", "summaries"])
+def test_benchmark_build(benchmark, frame, rows, implementation):
+    benchmark.group = f"wilaya cells and quantiles, {rows} rows"
+    if implementation == "pandas":
+        benchmark(groupby_quantiles, frame)
+    else:
+        benchmark(locations.LocationStats, frame)
+
+def test_benchmark_queries(benchmark, stats, rows):
+    benchmark.group = f"Locations matrix and map, {rows} rows"
+    models = stats.top_models(15)
+    benchmark(lambda: (stats.matrix(models, "premium"), stats.by_wilaya(*models[0])))
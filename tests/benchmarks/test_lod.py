@@ -0,0 +1,36 @@
+"""
+Render time of the price histogram, of the price boxplots and of the price
+vs. mileage scatter plot, drawing every value and with the level-of-detail
+rendering of lod.py (boxplots without their outliers, see
+sketches.draw_boxplot).
+"""
+import io
+
+import pytest
+from matplotlib.figure import Figure
+
+import charts
+import lod
+import sketches
+
+def render(draw, *args):
+    fig = Figure(figsize=(10, 6))
+    draw(fig.subplots(), *args)
+    output = io.BytesIO()
+    fig.savefig(output, format="png", dpi=charts.CHART_DPI, bbox_inches="tight")
+    return output.tell()
+
+def charts_of(data):
+    return {
+        "histogram": lambda exact: render(lod.draw_histogram, data["price"], exact),
+        "boxplot": lambda exact: render(sketches.draw_boxplot, data[["price"]], "price", None, None, None, exact),
+        "by year": lambda exact: render(sketches.draw_boxplot, data[["year", "price"]], "price", "year", None, None, exact),
+        "scatter": lambda exact: render(lod.draw_scatter, data["mileage"], data["price"], exact),
+    }
+
+@pytest.mark.parametrize("exact", [True, False], ids=["every value", "level of detail"])
+@pytest.mark.parametrize("chart", ["histogram", "boxplot", "by year", "scatter"])
+def test_benchmark(benchmark, cleaned, rows, chart, exact):
+    benchmark.group = f"{chart} render, {rows} rows"
+    size = benchmark(charts_of(cleaned)[chart], exact)
+    benchmark.extra_info["KB"] = size / 1024
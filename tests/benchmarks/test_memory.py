@@ -0,0 +1,33 @@
+"""
+Memory footprint of the cleaned listings with object strings and int64
+against the typed schema, and the time of a few common column operations on
+each.
+"""
+import pytest
+
+import utils
+
+@pytest.fixture(scope="module")
+def frames(raw):
+    untyped = utils.clean_data(raw).reset_index(drop=True)
+    return {"object": untyped, "typed": utils._drop_unused_categories(utils.apply_schema(untyped))}
+
+def test_typed_within_budget(frames):
+    before, after = (utils.memory_report(frames[name]).loc["total"] for name in ["object", "typed"])
+    assert after["bytes per row"] <= utils.MEMORY_BUDGET_PER_ROW, f"{after['bytes per row']:.0f} bytes per row"
+    assert after["MB"] < before["MB"]
+
+def operations(frame):
+    brands = frame["brand"].astype("category").cat.categories[:5].tolist()
+    return {
+        "value_counts": lambda: frame["model"].value_counts(),
+        "isin": lambda: frame["brand"].isin(brands),
+        "unique": lambda: frame["model"].unique(),
+    }
+
+@pytest.mark.parametrize("schema", ["object", "typed"])
+@pytest.mark.parametrize("operation", ["value_counts", "isin", "unique"])
+def test_benchmark(benchmark, frames, rows, operation, schema):
+    benchmark.group = f"{operation}, {rows} rows"
+    benchmark.extra_info["bytes per row"] = utils.memory_report(frames[schema]).loc["total", "bytes per row"]
+    benchmark(operations(frames[schema])[operation])
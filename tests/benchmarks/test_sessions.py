@@ -0,0 +1,44 @@
+"""
+Memory held by concurrent sessions and the time of one page rerun, with a
+private copy of the cleaned listings per session (as st.cache_data returns
+them) against views of the shared Dataset.
+"""
+import tracemalloc
+
+import pandas as pd
+import pytest
+
+import utils
+
+SESSIONS = 20
+
+def loaders(cleaned):
+    dataset = utils.Dataset(cleaned, "benchmark")
+
+    def copied():
+        data = cleaned.copy()
+        data['date_int'] = (data['date'] - pd.Timestamp('1970-01-01')) // pd.Timedelta('1D')
+        return data
+
+    return {"copy per session": copied, "shared view": dataset.view}
+
+def held(load):
+    # Bytes still allocated by SESSIONS sessions' frames
+    tracemalloc.start()
+    frames = [load() for _ in range(SESSIONS)]
+    allocated = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del frames
+    return allocated
+
+def test_shared_views_hold_less_than_copies(cleaned):
+    load = loaders(cleaned)
+    copies, views = held(load["copy per session"]), held(load["shared view"])
+    assert views < copies / SESSIONS, f"{SESSIONS} views hold {views / 2**20:.1f} MB, copies {copies / 2**20:.1f} MB"
+
+@pytest.mark.parametrize("name", ["copy per session", "shared view"])
+def test_benchmark_rerun(benchmark, cleaned, rows, name):
+    benchmark.group = f"page rerun of a session, {rows} rows"
+    load = loaders(cleaned)[name]
+    benchmark.extra_info[f"MB held by {SESSIONS} sessions"] = held(load) / 2**20
+    benchmark(lambda: load()[lambda data: data["price"] > 500]["brand"].value_counts())
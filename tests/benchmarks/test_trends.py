@@ -0,0 +1,72 @@
+"""
+Build of the trend series, their incremental update (a week of new listings,
+then repriced listings all over the history) against a rebuild, and the time
+of a page's queries over the whole history of a model, against a budget.
+"""
+import time
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import trends
+
+# Seconds a page's queries of one model may take
+QUERY_BUDGET = 0.1
+
+def build(frame, version="benchmark"):
+    store = trends.TrendStore(trends.EWMA_HALF_LIVES)
+    store.update(frame, version)
+    return store
+
+@pytest.fixture(scope="module")
+def store(cleaned):
+    return build(cleaned)
+
+def versions(cleaned):
+    last_week = cleaned["date"] > cleaned["date"].max() - pd.Timedelta(days=7)
+    repriced = cleaned.copy()
+    changed = np.random.default_rng(0).choice(len(cleaned), len(cleaned) // 100, replace=False)
+    repriced.loc[changed, "price"] = (repriced.loc[changed, "price"] * 1.1).astype(repriced["price"].dtype)
+    return {"a week of new listings": (cleaned[~last_week], cleaned), "1% repriced": (cleaned, repriced)}
+
+def queries(store, cleaned):
+    brand, model = cleaned.groupby(["brand", "model"], observed=True).size().idxmax()
+    return lambda: (store.daily("model", (brand, model), 90, trends.EWMA_HALF_LIVES[-1]),
+                    store.weekly("model", (brand, model)), store.seasonality("model", (brand, model)))
+
+def best_time(fn, repeat=5):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+def test_queries_within_budget(store, cleaned):
+    seconds = best_time(queries(store, cleaned))
+    assert seconds <= QUERY_BUDGET, f"trend queries take {seconds * 1000:.1f} ms"
+
+def test_benchmark_build(benchmark, cleaned, rows):
+    benchmark.group = f"trend series build, {rows} rows"
+    benchmark.pedantic(build, (cleaned,), rounds=3)
+
+@pytest.mark.parametrize("change", ["a week of new listings", "1% repriced"])
+def test_benchmark_update(benchmark, cleaned, rows, change):
+    benchmark.group = f"trend series update, {rows} rows"
+    before, after = versions(cleaned)[change]
+
+    def update(store):
+        store.update(after, "next")
+        return store
+
+    updated = benchmark.pedantic(update, setup=lambda: ((build(before),), {}), rounds=3)
+    rebuilt = build(after)
+    for level in trends.LEVELS:
+        for value in rebuilt.values(level):
+            pd.testing.assert_frame_equal(updated.daily(level, value), rebuilt.daily(level, value))
+            pd.testing.assert_frame_equal(updated.weekly(level, value), rebuilt.weekly(level, value))
+
+def test_benchmark_queries(benchmark, store, cleaned, rows):
+    benchmark.group = f"trend queries of a model, {rows} rows"
+    benchmark(queries(store, cleaned))
@@ -0,0 +1,70 @@
+"""
+Shared fixtures of the tests: synthetic listings (see synthetic.py) of the
+sizes given with --rows, raw and cleaned, and cleaned listings with missing
+values.
+"""
+import functools
+import logging
+
+import numpy as np
+import pytest
+
+import utils
+from synthetic import synthetic_frame
+
+def pytest_addoption(parser):
+    parser.addoption("--rows", type=int, nargs="+", default=[100_000],
+                     help="sizes of the synthetic listings the data tests run on (default: 100000)")
+
+def pytest_configure(config):
+    # Streamlit's caches warn on every call outside a Streamlit session
+    for name in ["streamlit.runtime.caching.cache_data_api", "streamlit.runtime.scriptrunner_utils.script_run_context"]:
+        logging.getLogger(name).setLevel(logging.ERROR)
+
+def pytest_generate_tests(metafunc):
+    if "rows" in metafunc.fixturenames:
+        metafunc.parametrize("rows", metafunc.config.getoption("rows"), scope="session")
+
+@functools.cache
+def _raw(rows):
+    return synthetic_frame(rows)
+
+@functools.cache
+def _cleaned(rows):
+    # Typed like the loader's listings
+    return utils.apply_schema(utils.clean_data(_raw(rows)).reset_index(drop=True))
+
+# Columns the scraper's schema lets be NULL, and rows with each one missing
+MISSING_COLUMNS = ["wilaya", "brand", "year", "fuel", "gearbox"]
+MISSING_ROWS = 40
+
+@functools.cache
+def _cleaned_with_missing(rows):
+    raw = _raw(rows).copy()
+    rng = np.random.default_rng(0)
+    for column in MISSING_COLUMNS:
+        raw.loc[rng.choice(len(raw), MISSING_ROWS, replace=False), column] = None
+    return utils.apply_schema(utils.clean_data(raw).reset_index(drop=True))
+
+@pytest.fixture(scope="session")
+def raw(rows):
+    """
+    `rows` synthetic listings as the Cars table holds them. Shared: copy before changing.
+    """
+    return _raw(rows)
+
+@pytest.fixture(scope="session")
+def cleaned(rows):
+    """
+    The cleaned and typed `raw` listings. Shared: copy before changing.
+    """
+    return _cleaned(rows)
+
+@pytest.fixture(scope="session")
+def cleaned_with_missing(rows):
+    """
+    Cleaned and typed listings of which some have a NULL wilaya, year, fuel
+    or gearbox (the ones with a NULL brand are cleaned out). Shared: copy
+    before changing.
+    """
+    return _cleaned_with_missing(rows)
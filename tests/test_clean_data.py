@@ -0,0 +1,64 @@
+"""
+clean_data as a single boolean-mask pipeline against the original
+step-by-step implementation: same frame, less time.
+"""
+import time
+
+import pandas as pd
+import pytest
+
+import utils
+
+def clean_data_reference(data):
+    """
+    The original step-by-step clean_data.
+    """
+    cleaned_data = data.dropna(subset=['brand', 'model'])
+    cleaned_data = cleaned_data[cleaned_data['brand'].str.strip() != '']
+    cleaned_data = cleaned_data[cleaned_data['model'].str.strip() != '']
+    cleaned_data = cleaned_data.groupby('model').filter(lambda x: len(x) >= 20)
+    cleaned_data = cleaned_data.groupby('brand').filter(lambda x: len(x) >= 20)
+    cleaned_data['date'] = pd.to_datetime(cleaned_data['date'])
+    cleaned_data = cleaned_data[cleaned_data['date'] > '2020-01-01']
+    cleaned_data = cleaned_data[cleaned_data['price']>49]
+    cleaned_data = cleaned_data[cleaned_data['mileage']>=0]
+    cleaned_data = cleaned_data[~cleaned_data['price'].isin(utils.BAD_PRICES)]
+    current_year = pd.Timestamp.now().year
+    cleaned_data.loc[(cleaned_data["mileage"] < 1000) & (cleaned_data["year"] != current_year), "mileage"] *= 1000
+    cleaned_data["model"] = cleaned_data["model"].str.upper()
+    return cleaned_data
+
+def best_time(fn, repeat=3):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+def test_same_frame_as_reference(raw):
+    pd.testing.assert_frame_equal(utils.clean_data(raw), clean_data_reference(raw.copy()))
+
+def test_same_frame_with_edge_cases():
+    # Blank and missing names, models just under and at the minimum count,
+    # a bad price, dates before 2020 and the mileage fix-up
+    rows = ([("RENAULT", "clio", 500, 800, 2015)] * 20 + [("RENAULT", " ", 500, 10, 2015)] * 3
+            + [("RENAULT", None, 700, 5, 2015)] * 2 + [(" ", "CLIO", 500, 10, 2015)] * 2
+            + [("DACIA", "logan", 1111, 90_000, 2016)] * 19 + [("DACIA", "sandero", 500, 1, 2016)] * 20
+            + [("SKODA", "fabia", 400, 40_000, 2017)] * 19 + [("SKODA", "octavia", 400, 40_000, 2017)] * 19)
+    data = pd.DataFrame(rows, columns=["brand", "model", "price", "mileage", "year"])
+    data["date"] = ["2019-12-31", "2020-01-02", "2024-05-01", "2023-07-14"] * (len(data) // 4) + ["2022-01-01"] * (len(data) % 4)
+    pd.testing.assert_frame_equal(utils.clean_data(data), clean_data_reference(data.copy()))
+
+def test_faster_than_reference(raw):
+    reference = best_time(lambda: clean_data_reference(raw.copy()))
+    vectorized = best_time(lambda: utils.clean_data(raw))
+    assert vectorized < reference, f"clean_data takes {vectorized * 1000:.1f} ms, the reference {reference * 1000:.1f} ms"
+
+@pytest.mark.parametrize("implementation", ["reference", "vectorized"])
+def test_benchmark(benchmark, raw, rows, implementation):
+    benchmark.group = f"clean_data, {rows} rows"
+    if implementation == "reference":
+        benchmark(lambda: clean_data_reference(raw.copy()))
+    else:
+        benchmark(utils.clean_data, raw)
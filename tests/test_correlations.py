@@ -0,0 +1,101 @@
+"""
+The correlation store's merged statistics against DataFrame.corr() and
+pd.crosstab over the same listings, an incremental update against a rebuild,
+and the time of a window's matrices against pandas.
+"""
+import itertools
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import correlations
+
+def build(frame, reference=None):
+    store = correlations.CorrelationStore()
+    # Sums are taken from the reference values of the first update
+    store.reference = reference
+    store.update(frame, "test")
+    return store
+
+def queries(cleaned):
+    brand = cleaned["brand"].value_counts().index[0]
+    date_range = (cleaned["date"].max() - pd.DateOffset(months=6), cleaned["date"].max())
+    price_range = tuple(cleaned["price"].quantile([0.2, 0.8]).round().astype(int))
+    return {
+        "everything": {},
+        "six months, price window": dict(date_range=date_range, price_range=price_range),
+        "top brand, six months": dict(brand=brand, date_range=date_range),
+    }
+
+def selected(frame, query):
+    if "date_range" in query:
+        frame = frame[frame["date"].between(*query["date_range"])]
+    if "price_range" in query:
+        frame = frame[frame["price"].between(*query["price_range"])]
+    if "brand" in query:
+        frame = frame[frame["brand"] == query["brand"]]
+    return frame
+
+def pandas_matrices(listings):
+    numeric = listings.assign(displacement=correlations.engine_displacement(listings["engine"]))[correlations.NUMERIC]
+    return numeric.astype(float).corr(), {(a, b): correlations.cramers_v(pd.crosstab(listings[a], listings[b]))
+                                          for a, b in itertools.combinations(correlations.CATEGORICAL, 2)}
+
+@pytest.fixture(scope="module")
+def store(cleaned):
+    return build(cleaned)
+
+QUERIES = ["everything", "six months, price window", "top brand, six months"]
+
+@pytest.mark.parametrize("query", QUERIES)
+def test_matrices_match_pandas(store, cleaned, query):
+    query = queries(cleaned)[query]
+    selection = store.select(**query)
+    pearson, cramers_v = pandas_matrices(selected(cleaned, query))
+    np.testing.assert_allclose(selection.pearson(), pearson, atol=1e-9)
+    for (a, b), expected in cramers_v.items():
+        assert selection.cramers_v().loc[a, b] == pytest.approx(expected, nan_ok=True), (a, b)
+
+def test_crosstab_matches_pandas(store, cleaned):
+    query = queries(cleaned)["six months, price window"]
+    expected = pd.crosstab(*(selected(cleaned, query)[column].astype(object) for column in ["year", "gearbox"]))
+    actual = store.select(**query).crosstab("year", "gearbox")
+    pd.testing.assert_frame_equal(actual, expected, check_names=False, check_index_type=False)
+
+def test_many_categories(cleaned):
+    # More distinct values than a byte holds: none of them is lost
+    listings = cleaned.assign(color=cleaned["color"].astype(str) + " " + (np.arange(len(cleaned)) % 1000).astype(str))
+    listings = listings.assign(color=listings["color"].astype("category"))
+    actual = build(listings).select().crosstab("color", "fuel")
+    expected = pd.crosstab(listings["color"].astype(object), listings["fuel"].astype(object))
+    assert len(actual) == listings["color"].nunique() > 255
+    pd.testing.assert_frame_equal(actual, expected, check_names=False)
+
+def test_update_matches_rebuild(cleaned):
+    # A new version: a week of new listings and 1% repriced
+    last_week = cleaned["date"] > cleaned["date"].max() - pd.Timedelta(days=7)
+    updated = cleaned.copy()
+    changed = np.random.default_rng(0).choice(len(updated), len(updated) // 100, replace=False)
+    updated.loc[changed, "price"] = (updated.loc[changed, "price"] * 1.1).astype(updated["price"].dtype)
+    store = build(cleaned[~last_week])
+    store.update(updated, "next")
+    rebuilt = build(updated, store.reference)
+    for query in queries(cleaned).values():
+        incremental, full = store.select(**query), rebuilt.select(**query)
+        np.testing.assert_array_equal(incremental.sums, full.sums)
+        assert incremental.count == full.count
+
+@pytest.mark.parametrize("implementation", ["pandas", "merged"])
+@pytest.mark.parametrize("query", QUERIES)
+def test_benchmark(benchmark, store, cleaned, rows, query, implementation):
+    benchmark.group = f"pearson and cramér's v, {query}, {rows} rows"
+    query = queries(cleaned)[query]
+    if implementation == "pandas":
+        benchmark(lambda: pandas_matrices(selected(cleaned, query)))
+    else:
+        benchmark(lambda: (lambda selection: (selection.pearson(), selection.cramers_v()))(store.select(**query)))
+
+def test_benchmark_build(benchmark, cleaned, rows):
+    benchmark.group = f"correlation store build, {rows} rows"
+    benchmark(build, cleaned)
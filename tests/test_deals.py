@@ -0,0 +1,30 @@
+"""
+The deal scores against pandas' bucket medians, with missing keys, and the
+best deals against a full sort.
+"""
+import numpy as np
+import pandas as pd
+
+import deals
+
+def test_bucket_medians_match_groupby(cleaned_with_missing):
+    listings = cleaned_with_missing
+    median, score = deals.bucket_scores(listings)
+    keys = [listings["brand"], listings["model"], listings["year"], listings["mileage"] // deals.MILEAGE_BUCKET]
+    expected = listings.groupby(keys, observed=True)["price"].transform("median")
+    # Listings with a missing year are in no bucket
+    missing = listings["year"].isna().to_numpy()
+    assert missing.any()
+    assert np.isnan(median[missing]).all() and np.isnan(score[missing]).all()
+    np.testing.assert_allclose(median[~missing], expected[~missing].to_numpy())
+
+def test_best_matches_full_sort(cleaned_with_missing):
+    scores = deals.DealScores(cleaned_with_missing)
+    brand = cleaned_with_missing["brand"].value_counts().index[0]
+    table = pd.DataFrame({"brand": cleaned_with_missing["brand"], "score": scores.score}).dropna()
+    for n, values in [(20, {}), (20, dict(brand=brand)), (deals.DEAL_TOP_K + 50, dict(brand=brand))]:
+        selected = table if not values else table[table["brand"] == values["brand"]]
+        best = scores.best(n, **values)
+        # Listings of equal scores may come in any order
+        np.testing.assert_array_equal(scores.score[best], np.sort(selected["score"].to_numpy())[:n])
+        assert set(table.loc[best, "brand"]) <= set(selected["brand"])
@@ -0,0 +1,61 @@
+"""
+The duplicate clusters a page gets for its dataset version, reposts found
+whether they come at once or in a new version, and distinct cars with the
+same text kept apart.
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+import dedup
+import utils
+
+def test_update_returns_the_clusters_of_its_version(cleaned):
+    store = dedup.DuplicateStore()
+    first = cleaned.iloc[:len(cleaned) // 2]
+    older = store.update(first, "older")
+    kept = older.kept.copy()
+    newer = store.update(cleaned, "newer")
+    # A refresh in between does not change the row ids a page already holds
+    assert older.version == "older" and newer.version == "newer"
+    np.testing.assert_array_equal(older.kept, kept)
+    assert older.kept.max() < len(first)
+    assert len(older.cluster) == len(first) and len(newer.cluster) == len(cleaned)
+    assert store.update(cleaned, "newer").kept is newer.kept
+
+def with_reposts(cleaned, share=0.05):
+    # `cleaned` plus a repost of `share` of its listings: the same car (brand,
+    # model, year, km and price) under a new link, three days later
+    originals = np.sort(np.random.default_rng(0).choice(len(cleaned), int(len(cleaned) * share), replace=False))
+    reposts = cleaned.iloc[originals].copy()
+    reposts["link"] = (reposts["link"].astype(str) + "-repost").astype(cleaned["link"].dtype)
+    reposts["date"] = reposts["date"] + pd.Timedelta(days=3)
+    combined = utils.concat_typed([cleaned, reposts]).reset_index(drop=True)
+    return combined, originals, np.arange(len(cleaned), len(combined))
+
+@pytest.mark.parametrize("incremental", [False, True], ids=["at once", "incremental"])
+def test_reposts_land_in_one_cluster(cleaned, incremental):
+    combined, originals, reposts = with_reposts(cleaned)
+    store = dedup.DuplicateStore()
+    if incremental:
+        store.update(cleaned, "before")
+    duplicates = store.update(combined, "after")
+    # Without a mileage, a listing is no one's duplicate
+    known = cleaned["mileage"].notna().to_numpy()[originals]
+    np.testing.assert_array_equal(duplicates.cluster[originals[known]], duplicates.cluster[reposts[known]])
+    # The original is older than its repost, so it is not kept
+    assert not np.isin(originals[known], duplicates.kept).any()
+
+def test_distinct_cars_with_similar_text_are_kept_apart(cleaned):
+    listing = cleaned.iloc[[0] * 6].reset_index(drop=True)
+    listing["link"] = pd.Series([f"https://example.com/{i}" for i in range(6)], dtype=cleaned["link"].dtype)
+    listing["title"] = pd.Series(["Golf 7 GTD toutes options"] * 5 + ["Golf 7 GTD toutes options jamais accidentée"], dtype=cleaned["title"].dtype)
+    listing["price"] = np.array([200, 200, 300, 200, 200, 200], dtype=listing["price"].dtype)
+    listing["mileage"] = np.array([80_000, 80_000, 80_000, 160_000, 80_000, 80_000], dtype=listing["mileage"].dtype)
+    listing["year"] = np.array([2016, 2016, 2016, 2016, 2019, 2016], dtype=listing["year"].dtype)
+    listing["wilaya"] = np.array([16, 16, 16, 16, 16, 31], dtype=listing["wilaya"].dtype)
+    duplicates = dedup.DuplicateStore().update(listing, "test")
+    # The repost (1) of the first listing is its duplicate; the same text
+    # with another price (2), mileage (3), year (4) or wilaya (5) is another car
+    assert duplicates.cluster[0] == duplicates.cluster[1]
+    assert len(set(duplicates.cluster[[0, 2, 3, 4, 5]].tolist())) == 5
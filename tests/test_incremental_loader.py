@@ -0,0 +1,60 @@
+"""
+The incremental loader's listings after new and changed rows (written by
+ingest.py) against a full reload of the same table: clean_data and
+apply_schema over every row.
+"""
+import pandas as pd
+import pytest
+
+import utils
+from db import read_sql
+from ingest import ingest_frame
+from synthetic import synthetic_frame, write_synthetic_db
+
+# Listings in the table (the loader's costs are not measured here)
+ROWS = 20_000
+
+def full_reload(path):
+    return utils.apply_schema(utils.clean_data(read_sql(path, f"SELECT {', '.join(utils.COLUMNS)} FROM cars")).reset_index(drop=True))
+
+def assert_same_listings(actual, expected):
+    # Categories in the same order, then the same codes (much faster than
+    # assert_frame_equal on the categorical values)
+    for column in utils.CATEGORY_COLUMNS:
+        assert actual[column].cat.categories.tolist() == expected[column].cat.categories.tolist(), column
+    codes = lambda frame: frame.assign(**{column: frame[column].cat.codes for column in utils.CATEGORY_COLUMNS})
+    pd.testing.assert_frame_equal(codes(actual), codes(expected))
+
+def by_link(frame):
+    return frame.sort_values("link", ignore_index=True)
+
+@pytest.fixture(scope="module")
+def raw():
+    return synthetic_frame(ROWS)
+
+@pytest.fixture
+def loaded(raw, tmp_path):
+    # A loader that has read the first 80% of the listings
+    path = str(tmp_path / "cars_db.sqlite")
+    first = raw.iloc[:len(raw) * 4 // 5]
+    write_synthetic_db(path, first)
+    loader = utils.IncrementalLoader(path)
+    loader.refresh()
+    return loader, path, first
+
+def test_new_rows(loaded, raw):
+    loader, path, first = loaded
+    new = raw.iloc[len(first):].copy()
+    # A brand and a model sorting before every known one
+    new.loc[new.index[:utils.MIN_LISTINGS * 2], ["brand", "model"]] = ["AAA", "AAA 1"]
+    ingest_frame(new, path)
+    assert_same_listings(loader.refresh(), full_reload(path))
+
+def test_changed_rows(loaded):
+    loader, path, first = loaded
+    changed = first.sample(len(first) // 100, random_state=0)
+    changed = changed.assign(price=changed["price"] + 1)
+    changed.loc[changed.index[::2], "model"] = "AAA 1"
+    ingest_frame(changed, path)
+    # Changed rows move to the end of the loader's listings
+    assert_same_listings(by_link(loader.refresh()), by_link(full_reload(path)))
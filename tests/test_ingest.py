@@ -0,0 +1,120 @@
+"""
+ingest.py's normalize and write_batch: the listings kept against clean_data's
+row rules, the ones rejected, NULL values written as NULL, listings upserted
+only when they changed, and JSONL and CSV files read back by the incremental
+loader as clean_data keeps them.
+"""
+import sqlite3
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import ingest
+import utils
+from synthetic import synthetic_frame, write_synthetic_db
+
+ROWS = 5_000
+
+@pytest.fixture(scope="module")
+def raw():
+    return synthetic_frame(ROWS)
+
+@pytest.fixture
+def db_path(tmp_path):
+    # An empty Cars table
+    path = str(tmp_path / "cars_db.sqlite")
+    write_synthetic_db(path, synthetic_frame(1).head(0))
+    return path
+
+def stored(path, columns="*"):
+    conn = sqlite3.connect(path)
+    try:
+        return pd.read_sql(f"SELECT {columns} FROM Cars ORDER BY link", conn)
+    finally:
+        conn.close()
+
+def variants(raw):
+    # One listing that passes clean_data's row rules, and a copy of it per
+    # change, under its own link
+    listing = ingest.normalize(raw).iloc[0]
+    changes = {
+        "kept": {},
+        "no brand": {"brand": None},
+        "no model": {"model": None},
+        "blank model": {"model": "  "},
+        "low price": {"price": 40},
+        "junk price": {"price": 1111},
+        "unreadable price": {"price": "call me"},
+        "no price": {"price": None},
+        "before 2020": {"date": "2019-06-01"},
+        "no year": {"year": None},
+        "no wilaya": {"wilaya": None},
+    }
+    rows = [dict(listing, link=f"https://example.com/{name}", **change) for name, change in changes.items()]
+    return pd.DataFrame(rows, columns=utils.COLUMNS).astype(object)
+
+def test_normalize_keeps_clean_data_rows(raw):
+    expected = utils.clean_rows(raw, utils.has_brand_and_model(raw)).sort_values("link", ignore_index=True)
+    normalized = ingest.normalize(raw).reset_index(drop=True)
+    assert normalized["link"].tolist() == expected["link"].tolist()
+    for column in utils.INTEGER_COLUMNS:
+        np.testing.assert_array_equal(normalized[column].to_numpy(dtype=float, na_value=np.nan), expected[column].to_numpy(dtype=float), err_msg=column)
+    assert normalized["model"].tolist() == expected["model"].str.upper().tolist()
+    assert normalized["date"].tolist() == expected["date"].dt.strftime("%Y-%m-%d").tolist()
+
+def test_rejected_listings(raw, db_path):
+    frame = variants(raw)
+    totals = ingest.ingest_frame(frame, db_path)
+    assert totals == {"read": len(frame), "rejected": len(frame) - 3, "written": 3}
+    written = stored(db_path)
+    assert written["link"].tolist() == [f"https://example.com/{name}" for name in ["kept", "no wilaya", "no year"]]
+    # A listing without a year or a wilaya is kept, with a NULL
+    written = written.set_index("link")
+    assert pd.isna(written.loc["https://example.com/no year", "year"])
+    assert pd.isna(written.loc["https://example.com/no wilaya", "wilaya"])
+    assert written.loc["https://example.com/no year", "wilaya"] == written.loc["https://example.com/kept", "wilaya"]
+
+def test_last_listing_of_a_link_wins(raw, db_path):
+    frame = variants(raw).iloc[[0, 0]]
+    frame.iloc[1, frame.columns.get_loc("price")] = 12345
+    totals = ingest.ingest_frame(frame, db_path)
+    assert totals == {"read": 2, "rejected": 1, "written": 1}
+    assert stored(db_path, "price")["price"].tolist() == [12345]
+
+def test_unchanged_listing_is_not_written_again(raw, db_path):
+    frame = raw.head(200)
+    first = ingest.ingest_frame(frame, db_path)
+    before = stored(db_path, "link, price, createdAt, updatedAt").set_index("link")
+    assert first["written"] == len(before)
+    assert ingest.ingest_frame(frame, db_path)["written"] == 0
+    pd.testing.assert_frame_equal(stored(db_path, "link, price, createdAt, updatedAt").set_index("link"), before)
+    # A repriced listing is updated: a new updatedAt, the same createdAt
+    repriced = frame.copy()
+    link = before.index[0]
+    repriced.loc[repriced["link"] == link, "price"] += 10
+    assert ingest.ingest_frame(repriced, db_path)["written"] == 1
+    after = stored(db_path, "link, price, createdAt, updatedAt").set_index("link")
+    assert after.loc[link, "price"] == before.loc[link, "price"] + 10
+    assert after.loc[link, "createdAt"] == before.loc[link, "createdAt"]
+    assert after.loc[link, "updatedAt"] > before["updatedAt"].max()
+    pd.testing.assert_frame_equal(after.drop(index=link), before.drop(index=link))
+
+@pytest.mark.parametrize("extension", ["jsonl", "csv"])
+def test_files_read_back_by_the_loader(raw, db_path, tmp_path, extension):
+    file = str(tmp_path / f"listings.{extension}")
+    if extension == "jsonl":
+        raw.to_json(file, orient="records", lines=True)
+    else:
+        raw.to_csv(file, index=False)
+    expected = utils.clean_rows(raw, utils.has_brand_and_model(raw)).sort_values("link", ignore_index=True)
+    totals = ingest.ingest_files([file], db_path, batch_rows=ROWS // 3)
+    assert totals == {"read": len(raw), "rejected": len(raw) - len(expected), "written": len(expected)}
+    # The loader's cleaned rows (before the minimum-count filters) are the ones clean_data's row rules keep
+    loader = utils.IncrementalLoader(db_path)
+    loader.refresh()
+    loaded = loader.prepared.reset_index().sort_values("link", ignore_index=True)
+    assert loaded["link"].tolist() == expected["link"].tolist()
+    for column in utils.INTEGER_COLUMNS:
+        np.testing.assert_array_equal(loaded[column].to_numpy(dtype=float), expected[column].to_numpy(dtype=float), err_msg=column)
+    assert loaded["model"].astype(str).tolist() == expected["model"].astype(str).tolist()
@@ -0,0 +1,32 @@
+"""
+The index's options and row sets against the same filters applied to the frame.
+"""
+import pandas as pd
+
+from inverted_index import InvertedIndex
+from utils import Dataset
+
+def unsorted_categories(frame):
+    # As an incremental refresh can leave them: new values after the old ones
+    return Dataset(frame.assign(**{
+        column: frame[column].cat.reorder_categories(frame[column].cat.categories[::-1])
+        for column in ["brand", "model", "fuel"]
+    }), "test").frame
+
+def test_options_are_sorted(cleaned):
+    index = InvertedIndex(unsorted_categories(cleaned))
+    for column in ["brand", "model", "fuel"]:
+        options = index.options(column)
+        values = [value for value in options if value is not None]
+        assert values == sorted(cleaned[column].dropna().unique())
+        assert options[len(values):] == ([None] if cleaned[column].isna().any() else [])
+
+def test_rows_match_frame_filters(cleaned):
+    frame = unsorted_categories(cleaned)
+    index = InvertedIndex(frame)
+    brand = index.options("brand")[0]
+    rows = index.narrow(None, brand=brand)
+    model = index.options("model", rows)[0]
+    rows = index.narrow(rows, model=model)
+    expected = frame[(frame["brand"] == brand) & (frame["model"] == model)]
+    pd.testing.assert_frame_equal(index.take(rows), expected)
@@ -0,0 +1,29 @@
+"""
+The location summaries against pandas' groupby over the same listings,
+whatever the wilaya codes.
+"""
+import numpy as np
+import pytest
+
+import locations
+
+def expected_cells(frame):
+    grouped = frame.groupby(["brand", "model", "wilaya"], observed=True)["price"]
+    return grouped.agg(["size", "median"]).rename(columns={"size": "count"})
+
+def actual_cells(stats):
+    return stats.cells.set_index(["brand", "model", "wilaya"])[["count", "median"]]
+
+@pytest.mark.parametrize("shift", [0, 284], ids=["codes", "codes above 255"])
+def test_cells_match_groupby(cleaned_with_missing, shift):
+    # Wilaya 16 becomes 300 when shifted (a code a uint8 cannot hold)
+    wilaya = cleaned_with_missing["wilaya"].astype("float64")
+    frame = cleaned_with_missing.assign(wilaya=wilaya + np.where(wilaya == 16, shift, 0))
+    actual = actual_cells(locations.LocationStats(frame))
+    expected = expected_cells(frame)
+    expected.index = expected.index.set_levels(expected.index.levels[2].astype(np.int64), level=2)
+    expected = expected.loc[actual.index]
+    assert len(actual) == len(expected_cells(frame))
+    np.testing.assert_array_equal(actual["count"], expected["count"])
+    np.testing.assert_allclose(actual["median"], expected["median"])
+    assert (actual.index.get_level_values("wilaya") == 300).any() == bool(shift)
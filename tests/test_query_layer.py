@@ -0,0 +1,27 @@
+"""
+The SQL query layer's pages against the whole result of the same query.
+"""
+import pandas as pd
+import pytest
+
+import utils
+from synthetic import synthetic_frame, write_synthetic_db
+
+# Listings in the table
+ROWS = 20_000
+
+@pytest.fixture(scope="module")
+def db_path(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp("query_layer") / "cars_db.sqlite")
+    write_synthetic_db(path, synthetic_frame(ROWS))
+    return path
+
+@pytest.mark.parametrize("filters", [{}, {"brand": "RENAULT"}, {"price_range": (300, 900), "years": [2015, 2016]}], ids=["everything", "brand", "price and years"])
+def test_pages_make_up_the_listings(db_path, filters):
+    listings = utils.query_listings(db_path, **filters)
+    assert utils.query_stats(db_path, **filters)["count"] == len(listings)
+    limit = len(listings) // 3 + 1
+    pages = [utils.query_listings(db_path, limit=limit, offset=offset, **filters) for offset in range(0, len(listings) + limit, limit)]
+    assert [len(page) for page in pages] == [limit, limit, len(listings) - 2 * limit, 0]
+    # The pages' categories are their own values, compare the values
+    pd.testing.assert_frame_equal(pd.concat(pages[:-1], ignore_index=True).astype(object), listings.reset_index(drop=True).astype(object))
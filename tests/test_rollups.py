@@ -0,0 +1,141 @@
+"""
+The rollup's summaries against pandas over the same listings, its update and
+the rollup read back from disk against a build, the size of its cubes and its
+speed against filtering the frame and grouping it.
+"""
+import time
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import rollups
+
+def windows(cleaned):
+    last = cleaned["date"].max()
+    month = (last - pd.DateOffset(months=1), last)
+    prices = tuple(cleaned["price"].quantile([0.1, 0.9]).round().astype(int))
+    return {
+        "everything": (None, None),
+        "last month": (month, None),
+        "last month, price window": (month, prices),
+        "price window": (None, prices),
+        "a single day": ((last, last), None),
+    }
+
+def in_window(frame, date_range, price_range):
+    if date_range is not None:
+        frame = frame[frame["date"].between(*map(pd.Timestamp, date_range))]
+    if price_range is not None:
+        frame = frame[frame["price"].between(*price_range)]
+    return frame
+
+def build(frame):
+    rollup = rollups.Rollup(summary_entries=0)
+    rollup.update(frame, "test")
+    return rollup
+
+@pytest.fixture(scope="module")
+def rollup(cleaned):
+    return build(cleaned)
+
+@pytest.mark.parametrize("cube", ["pair", "wilaya"])
+def test_far_fewer_cells_than_listings(rollup, cleaned, cube):
+    assert len(rollup.cubes[cube]) < len(cleaned) / 3
+
+@pytest.mark.parametrize("by", rollups.SUMMARY_BY)
+@pytest.mark.parametrize("window", ["everything", "last month", "last month, price window", "price window", "a single day"])
+def test_summary_matches_frame_summary(rollup, cleaned, by, window):
+    date_range, price_range = windows(cleaned)[window]
+    expected = rollups.frame_summary(in_window(cleaned, date_range, price_range), by)
+    pd.testing.assert_frame_equal(rollup.summary(by, date_range, price_range), expected, check_dtype=False, check_categorical=False)
+
+def test_aggregate_matches_groupby(rollup, cleaned):
+    date_range, price_range = windows(cleaned)["last month, price window"]
+    listings = in_window(cleaned, date_range, price_range)
+    grouped = listings.assign(price_sq=listings["price"].astype(float) ** 2, mileage_sq=listings["mileage"].astype(float) ** 2).groupby("brand", observed=True)
+    expected = grouped.agg(count=("price", "size"), price_sum=("price", "sum"), price_sq_sum=("price_sq", "sum"), price_min=("price", "min"),
+                           price_max=("price", "max"), mileage_sum=("mileage", "sum"), mileage_sq_sum=("mileage_sq", "sum"))
+    actual = rollup.aggregate("brand", date_range, price_range)
+    assert set(actual.index) == set(expected.index.astype(str))
+    expected = expected.set_axis(expected.index.astype(str)).loc[actual.index]
+    np.testing.assert_allclose(actual.to_numpy(dtype=float), expected.to_numpy(dtype=float), rtol=1e-9)
+
+def next_version(cleaned):
+    # The listings but last week's, and the next version: a week of new
+    # listings, 1% repriced and 1% removed
+    last_week = cleaned["date"] > cleaned["date"].max() - pd.Timedelta(days=7)
+    rng = np.random.default_rng(0)
+    updated = cleaned.copy()
+    changed = rng.choice(len(updated), len(updated) // 100, replace=False)
+    updated.loc[changed, "price"] = (updated.loc[changed, "price"] * 1.1).astype(updated["price"].dtype)
+    updated = updated.drop(rng.choice(len(updated), len(updated) // 100, replace=False)).reset_index(drop=True)
+    return cleaned[~last_week].reset_index(drop=True), updated
+
+def assert_same_rollup(rollup, expected, frame):
+    for by in rollups.SUMMARY_BY:
+        for window in windows(frame).values():
+            pd.testing.assert_frame_equal(rollup.summary(by, *window), expected.summary(by, *window))
+            # Values are in order of appearance
+            actual, wanted = (stats.aggregate(by, *window).sort_index() for stats in [rollup, expected])
+            pd.testing.assert_index_equal(actual.index, wanted.index)
+            np.testing.assert_allclose(actual.to_numpy(dtype=float), wanted.to_numpy(dtype=float), rtol=1e-9)
+
+def test_update_matches_build(cleaned):
+    previous, updated = next_version(cleaned)
+    rollup = build(previous)
+    rollup.update(updated, "next")
+    assert_same_rollup(rollup, build(updated), updated)
+
+def test_read_back_from_disk(cleaned, tmp_path):
+    previous, updated = next_version(cleaned)
+    path = str(tmp_path / "cars.sqlite")
+    rollups.Rollup(path=path).update(previous, "previous")
+    assert set(rollups.rollup_paths(path).values()) == {str(file) for file in tmp_path.iterdir()}
+    # The same version is read back without aggregating the listings again
+    stored = rollups.Rollup(summary_entries=0, path=path)
+    stored.update(updated.iloc[:0], "previous")
+    assert_same_rollup(stored, build(previous), previous)
+    # A new version updates the rollup read back
+    stored = rollups.Rollup(summary_entries=0, path=path)
+    stored.update(updated, "next")
+    assert_same_rollup(stored, build(updated), updated)
+
+def test_missing_wilayas(cleaned_with_missing):
+    rollup = build(cleaned_with_missing)
+    for by in ["wilaya", "brand"]:
+        expected = rollups.frame_summary(cleaned_with_missing, by)
+        pd.testing.assert_frame_equal(rollup.summary(by), expected, check_dtype=False, check_categorical=False)
+
+def test_unknown_dimension(rollup):
+    with pytest.raises(ValueError):
+        rollup.summary("year")
+
+def best_time(fn, repeat=5):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+@pytest.mark.parametrize("window", ["everything", "last month, price window", "price window"])
+def test_faster_than_pandas(rollup, cleaned, window):
+    date_range, price_range = windows(cleaned)[window]
+    pandas = best_time(lambda: [rollups.frame_summary(in_window(cleaned, date_range, price_range), by) for by in rollups.SUMMARY_BY])
+    rolled_up = best_time(lambda: [rollup.summary(by, date_range, price_range) for by in rollups.SUMMARY_BY])
+    assert rolled_up < pandas, f"{window}: rollup {rolled_up * 1000:.1f} ms, pandas {pandas * 1000:.1f} ms"
+
+@pytest.mark.parametrize("implementation", ["pandas", "rollup"])
+@pytest.mark.parametrize("window", ["everything", "last month, price window"])
+def test_benchmark(benchmark, rollup, cleaned, rows, window, implementation):
+    benchmark.group = f"brand and model summaries, {window}, {rows} rows"
+    date_range, price_range = windows(cleaned)[window]
+    if implementation == "pandas":
+        benchmark(lambda: [rollups.frame_summary(in_window(cleaned, date_range, price_range), by) for by in rollups.SUMMARY_BY])
+    else:
+        benchmark(lambda: [rollup.summary(by, date_range, price_range) for by in rollups.SUMMARY_BY])
+
+def test_benchmark_build(benchmark, cleaned, rows):
+    benchmark.group = f"rollup build, {rows} rows"
+    benchmark(build, cleaned)
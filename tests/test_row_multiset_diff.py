@@ -0,0 +1,41 @@
+"""
+utils.row_multiset_diff, which the incremental stores (fair prices, trends,
+correlations) update their sums with, against a count of the rows.
+"""
+import collections
+
+import numpy as np
+import pandas as pd
+
+import utils
+
+def counts(frame):
+    return collections.Counter(map(tuple, frame.to_numpy().tolist()))
+
+def test_new_repriced_and_removed_rows():
+    old = pd.DataFrame({"day": [1, 1, 2, 3, 3], "price": [10, 10, 20, 30, 40]})
+    # One of the two identical rows removed, a row repriced, a row added
+    new = pd.DataFrame({"day": [1, 2, 3, 3, 4], "price": [10, 25, 30, 40, 50]})
+    removed, added, hashes = utils.row_multiset_diff(old, new)
+    assert counts(removed) - counts(added) == counts(old) - counts(new) == collections.Counter({(1, 10): 1, (2, 20): 1})
+    assert counts(added) - counts(removed) == counts(new) - counts(old) == collections.Counter({(2, 25): 1, (4, 50): 1})
+    # Rows whose count did not change are left out
+    assert not {(3, 30), (3, 40)} & (set(counts(removed)) | set(counts(added)))
+    np.testing.assert_array_equal(hashes, pd.util.hash_pandas_object(new, index=False).to_numpy())
+
+def test_first_version_and_given_hashes(cleaned):
+    rows = cleaned[["date", "price", "mileage"]]
+    removed, added, hashes = utils.row_multiset_diff(None, rows)
+    assert removed.empty and added is rows
+    # The same rows in another order: nothing changed
+    shuffled = rows.sample(frac=1, random_state=0)
+    removed, added, _ = utils.row_multiset_diff(rows, shuffled, hashes)
+    assert removed.empty and added.empty
+
+def test_sums_follow_the_diff(cleaned):
+    rows = cleaned[["date", "price"]]
+    updated = rows.copy()
+    updated.loc[::100, "price"] += 1
+    updated = pd.concat([updated.iloc[500:], rows.head(50)])
+    removed, added, _ = utils.row_multiset_diff(rows, updated)
+    assert rows["price"].sum() - removed["price"].sum() + added["price"].sum() == updated["price"].sum()
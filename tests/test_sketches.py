@@ -0,0 +1,201 @@
+"""
+The quantile sketches against pandas' quantiles over the same listings (the
+rank of each estimate within SKETCH_EPSILON of the requested one), their
+incremental update against a build, and the boxplots drawn from them against
+matplotlib's statistics and seaborn's render time.
+"""
+import io
+import time
+
+import numpy as np
+import pandas as pd
+import pytest
+from matplotlib.cbook import boxplot_stats
+from matplotlib.figure import Figure
+
+import sketches
+
+QS = [0.05, 0.25, 0.5, 0.75, 0.95]
+
+def build(frame, version="test"):
+    store = sketches.SketchStore(sketches.SKETCH_EPSILON)
+    store.update(frame, version)
+    return store
+
+@pytest.fixture(scope="module")
+def store(cleaned):
+    return build(cleaned)
+
+def selections(cleaned):
+    top_brand = cleaned["brand"].value_counts().index[0]
+    top_model = cleaned.loc[cleaned["brand"] == top_brand, "model"].value_counts().index[0]
+    prices = tuple(cleaned["price"].quantile([0.1, 0.9]))
+    return {
+        "every listing": {},
+        "unaligned dates": {"date_range": ("2021-01-17", "2022-06-03")},
+        "top brand": {"brand": top_brand, "date_range": ("2022-01-01", "2023-12-31")},
+        "top model": {"brand": top_brand, "model": top_model},
+        "some years": {"brand": [top_brand], "year": [2015, 2016, 2017]},
+        "price window": {"price_range": prices},
+    }
+
+def listings(cleaned, selection):
+    # The listings a selection describes, with pandas
+    keep = pd.Series(True, index=cleaned.index)
+    for column, value in selection.items():
+        if column == "date_range":
+            keep &= cleaned["date"].between(*map(pd.Timestamp, value))
+        elif column == "price_range":
+            keep &= cleaned["price"].between(*value)
+        else:
+            keep &= cleaned[column].isin(value if isinstance(value, list) else [value])
+    return cleaned[keep]
+
+def rank_error(values, estimate, q):
+    # Distance from q to the ranks (as fractions) the estimate takes among the values
+    values = np.sort(values.dropna().to_numpy(dtype=float))
+    low, high = np.searchsorted(values, estimate, "left"), np.searchsorted(values, estimate, "right")
+    return max(low / len(values) - q, q - high / len(values), 0)
+
+@pytest.mark.parametrize("metric", sketches.METRICS)
+@pytest.mark.parametrize("name", ["every listing", "unaligned dates", "top brand", "top model", "some years", "price window"])
+def test_rank_error_within_epsilon(cleaned, store, metric, name):
+    selection = selections(cleaned)[name]
+    if metric != "price" and "price_range" in selection:
+        pytest.skip("a price window is only applied to the price sketches")
+    values = listings(cleaned, selection)[metric]
+    estimates = sketches.sketch_quantiles(store.select(metric, **selection), QS)
+    for q, estimate in zip(QS, estimates):
+        assert rank_error(values, estimate, q) <= sketches.SKETCH_EPSILON + 1 / len(values), q
+
+def test_large_selections_are_summarized(cleaned, store):
+    centroids = store.select("price")
+    assert centroids["weight"].sum() == len(cleaned)
+    assert len(centroids) < len(cleaned) / 4
+
+def test_small_selection_is_exact(cleaned, store):
+    model = cleaned["model"].value_counts().index[-1]
+    values = listings(cleaned, {"model": model})["price"]
+    centroids = store.select("price", model=model)
+    assert (centroids["weight"] == 1).all()
+    np.testing.assert_allclose(sketches.sketch_quantiles(centroids, QS), values.quantile(QS))
+
+def test_year_counts_are_exact(cleaned, store):
+    brand = cleaned["brand"].value_counts().index[0]
+    centroids = store.select("year", brand=brand)
+    counts = centroids.groupby("value")["weight"].sum()
+    expected = cleaned.loc[cleaned["brand"] == brand, "year"].value_counts()
+    pd.testing.assert_series_equal(counts.sort_index(), expected.sort_index().astype(counts.dtype), check_names=False, check_index_type=False)
+
+def test_grouped_by_a_dimension(cleaned, store):
+    brands = cleaned["brand"].value_counts().index[:3].tolist()
+    centroids = store.select("price", by="year", brand=brands)
+    selected = cleaned[cleaned["brand"].isin(brands)]
+    for year, values in selected.groupby("year", observed=True)["price"]:
+        estimates = sketches.sketch_quantiles(centroids[centroids["year"] == year], QS)
+        for q, estimate in zip(QS, estimates):
+            assert rank_error(values, estimate, q) <= sketches.SKETCH_EPSILON + 1 / len(values), (year, q)
+
+def test_missing_years(cleaned_with_missing):
+    store = build(cleaned_with_missing)
+    missing = cleaned_with_missing[cleaned_with_missing["year"].isna()]
+    centroids = store.select("price", year=[None])
+    np.testing.assert_allclose(sketches.sketch_quantiles(centroids, QS), missing["price"].quantile(QS))
+    # A listing of unknown year has no year to count
+    assert store.select("year")["weight"].sum() == cleaned_with_missing["year"].notna().sum()
+
+def test_other_version(store):
+    assert store.select("price", version="another") is None
+    assert store.select("price", version="test") is not None
+
+def test_price_window_of_another_metric(store):
+    with pytest.raises(ValueError):
+        store.select("mileage", price_range=(0, 1))
+
+def test_update_matches_build(cleaned):
+    # A new version: a week of new listings, 1% repriced and 1% removed
+    last_week = cleaned["date"] > cleaned["date"].max() - pd.Timedelta(days=7)
+    rng = np.random.default_rng(0)
+    updated = cleaned.copy()
+    changed = rng.choice(len(updated), len(updated) // 100, replace=False)
+    updated.loc[changed, "price"] = (updated.loc[changed, "price"] * 1.1).astype(updated["price"].dtype)
+    updated = updated.drop(rng.choice(len(updated), len(updated) // 100, replace=False)).reset_index(drop=True)
+    store = build(cleaned[~last_week])
+    store.update(updated, "next")
+    rebuilt = build(updated)
+    for selection in selections(cleaned).values():
+        for metric in sketches.METRICS if "price_range" not in selection else ["price"]:
+            got, expected = (sketches_of.select(metric, **selection) for sketches_of in [store, rebuilt])
+            got, expected = (frame.sort_values(list(frame.columns), ignore_index=True) for frame in [got, expected])
+            pd.testing.assert_frame_equal(got, expected)
+
+@pytest.mark.parametrize("column", ["price", "mileage", "year"])
+@pytest.mark.parametrize("name", ["every listing", "top brand", "some years"])
+def test_box_stats_of_values_match_pandas_quantiles(cleaned, column, name):
+    values = listings(cleaned, selections(cleaned)[name])[column]
+    stats = sketches.box_stats(sketches.exact_centroids(values))
+    expected = values.quantile([0.25, 0.5, 0.75]).to_numpy(dtype=float)
+    np.testing.assert_allclose([stats["q1"], stats["med"], stats["q3"]], expected, rtol=1e-12)
+
+@pytest.mark.parametrize("column", ["price", "mileage"])
+def test_box_stats_of_values_match_matplotlib(cleaned, column):
+    values = cleaned[column]
+    (expected,) = boxplot_stats(values.dropna().to_numpy(dtype=float))
+    stats = sketches.box_stats(sketches.exact_centroids(values), "label")
+    for name in ["q1", "med", "q3", "whislo", "whishi"]:
+        assert stats[name] == pytest.approx(expected[name], rel=1e-12), name
+    assert stats["label"] == "label"
+
+def test_box_stats_of_no_values(cleaned):
+    stats = sketches.box_stats(sketches.exact_centroids(cleaned["price"].iloc[:0]))
+    assert np.isnan(stats["med"])
+
+def render(draw, *args, **kwargs):
+    fig = Figure(figsize=(12, 6))
+    draw(fig.subplots(), *args, **kwargs)
+    fig.savefig(io.BytesIO(), format="png")
+
+@pytest.mark.parametrize("query", [None, {}], ids=["values", "sketches"])
+def test_boxplot_by_year_draws_each_year(cleaned, store, monkeypatch, query):
+    monkeypatch.setattr(sketches, "get_sketches", lambda: store)
+    data = cleaned[["year", "price"]]
+    fig = Figure()
+    ax = fig.subplots()
+    sketches.draw_boxplot(ax, data, "price", "year", query=query)
+    years = data["year"].dropna().unique().tolist()
+    assert [label.get_text() for label in ax.get_xticklabels()] == [str(year) for year in years]
+
+def best_time(fn, repeat=3):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+def test_faster_than_seaborn(cleaned, store, monkeypatch):
+    if len(cleaned) <= sketches.EXACT_MAX_ROWS:
+        pytest.skip("seaborn draws every value at this size")
+    monkeypatch.setattr(sketches, "get_sketches", lambda: store)
+    data = cleaned[["year", "price"]]
+    seaborn = best_time(lambda: render(sketches.draw_boxplot, data, "price", "year", exact=True), repeat=1)
+    summarized = best_time(lambda: render(sketches.draw_boxplot, data, "price", "year", query={}))
+    assert summarized < seaborn, f"sketches {summarized * 1000:.1f} ms, seaborn {seaborn * 1000:.1f} ms"
+
+@pytest.mark.parametrize("exact", [True, False], ids=["pandas", "sketches"])
+def test_benchmark_quantiles(benchmark, cleaned, store, rows, exact):
+    benchmark.group = f"quantiles of every listing, {rows} rows"
+    if exact:
+        benchmark(cleaned["price"].quantile, QS)
+    else:
+        benchmark(lambda: sketches.sketch_quantiles(store.select("price"), QS))
+
+def test_benchmark_build(benchmark, cleaned, rows):
+    benchmark.group = f"sketches, {rows} rows"
+    benchmark.pedantic(build, (cleaned,), rounds=1)
+
+@pytest.mark.parametrize("exact", [True, False], ids=["seaborn", "sketches"])
+def test_benchmark_boxplot(benchmark, cleaned, store, rows, monkeypatch, exact):
+    monkeypatch.setattr(sketches, "get_sketches", lambda: store)
+    benchmark.group = f"price by year boxplot, {rows} rows"
+    benchmark(render, sketches.draw_boxplot, cleaned[["year", "price"]], "price", "year", query={}, exact=exact)
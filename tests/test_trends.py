@@ -0,0 +1,45 @@
+"""
+The trend series against pandas over the same listings, with missing keys.
+"""
+import numpy as np
+import pandas as pd
+
+import trends
+
+def build(frame):
+    store = trends.TrendStore(trends.EWMA_HALF_LIVES)
+    store.update(frame, "test")
+    return store
+
+def test_missing_keys(cleaned_with_missing):
+    listings = cleaned_with_missing
+    store = build(listings)
+    # Every listing is in the market, only the ones with a wilaya in a wilaya's series
+    assert store.daily("market", None)["listings"].sum() == len(listings)
+    wilayas = store.values("wilaya")
+    assert sum(store.daily("wilaya", wilaya)["listings"].sum() for wilaya in wilayas) == listings["wilaya"].notna().sum()
+    assert set(wilayas) == set(listings["wilaya"].dropna().tolist())
+
+def test_daily_matches_groupby(cleaned_with_missing):
+    listings = cleaned_with_missing
+    store = build(listings)
+    brand = listings["brand"].value_counts().index[0]
+    selected = listings[listings["brand"] == brand]
+    expected = selected.groupby(selected["date"].dt.normalize())["price"].agg(["size", "mean", "median"])
+    daily = store.daily("brand", brand).loc[expected.index]
+    np.testing.assert_array_equal(daily["listings"], expected["size"])
+    np.testing.assert_allclose(daily["mean price"], expected["mean"])
+    np.testing.assert_allclose(daily["median price"], expected["median"])
+
+def test_update_matches_build(cleaned_with_missing):
+    # A new version: a week of new listings and 1% repriced
+    listings = cleaned_with_missing
+    last_week = listings["date"] > listings["date"].max() - pd.Timedelta(days=7)
+    updated = listings.copy()
+    changed = np.random.default_rng(0).choice(len(updated), len(updated) // 100, replace=False)
+    updated.loc[changed, "price"] = (updated.loc[changed, "price"] * 1.1).astype(updated["price"].dtype)
+    store = build(listings[~last_week])
+    store.update(updated, "next")
+    rebuilt = build(updated)
+    for level, value in [("market", None), ("wilaya", store.values("wilaya")[0]), ("model", store.values("model")[0])]:
+        pd.testing.assert_frame_equal(store.daily(level, value), rebuilt.daily(level, value), check_exact=False)
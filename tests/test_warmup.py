@@ -0,0 +1,36 @@
+"""
+The warm-up's threads: started once per process, and stopped and joined by
+stop_warmup (and at exit).
+"""
+import atexit
+
+import pytest
+
+import warmup
+
+@pytest.fixture
+def idle_warmup(monkeypatch):
+    # Polls once an hour: no refresh, no task during the test
+    monkeypatch.setattr(warmup, "WARMUP", True)
+    monkeypatch.setattr(warmup, "WARMUP_POLL", 3600)
+    warmup.stop_warmup()
+    yield
+    warmup.stop_warmup()
+
+def test_started_once(idle_warmup):
+    first = warmup.start_warmup()
+    assert warmup.start_warmup() is first
+    assert all(thread.is_alive() for thread in [*first._threads, first._poller])
+
+def test_stop_joins_threads(idle_warmup, monkeypatch):
+    unregistered = []
+    monkeypatch.setattr(atexit, "unregister", unregistered.append)
+    started = warmup.start_warmup()
+    warmup.stop_warmup()
+    assert not any(thread.is_alive() for thread in [*started._threads, started._poller])
+    assert unregistered == [started.stop]
+    assert warmup.start_warmup() is not started
+
+def test_off(idle_warmup, monkeypatch):
+    monkeypatch.setattr(warmup, "WARMUP", False)
+    assert warmup.start_warmup() is None
@@ -0,0 +1,271 @@
+"""
+Market trends: daily series of listing volume and price for the whole market
+and per brand, model and wilaya, with rolling windows, EWMA and weekly medians.
+
+Every series is a column of dense day x series matrices covering the days of
+the dataset: listings, price sum and median price, plus the EWMA of the
+listings and of the price sum for each of EWMA_HALF_LIVES. When the dataset
+version changes, only the added, removed and modified listings are added to
+(or subtracted from) the days they fall on, and the EWMA is carried forward
+from the first of these days; the medians of the touched days and weeks are
+the only values computed from the listings again. A query reads one column of
+each matrix: rolling windows are differences of its cumulative sums, so their
+cost depends on the number of days, not of listings.
+"""
+import threading
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from utils import get_incremental_loader, row_multiset_diff
+
+# Series kinds and the columns identifying a series of each kind (the market
+# is a single series)
+LEVELS = {
+    "market": [],
+    "brand": ["brand"],
+    "model": ["brand", "model"],
+    "wilaya": ["wilaya"],
+}
+
+# Half-lives of the maintained EWMA, in days
+EWMA_HALF_LIVES = (7, 30)
+
+# Default rolling window, in days
+ROLLING_WINDOW = 30
+
+EPOCH = pd.Timestamp("1970-01-01")
+
+# 1970-01-05 (day 4) was a Monday: weeks start on Mondays
+_FIRST_MONDAY = 4
+
+@st.cache_resource
+def _shared_trends(db_path):
+    return TrendStore(EWMA_HALF_LIVES)
+
+def get_trends():
+    """
+    The process-wide trend series, brought up to date with the incremental loader.
+    """
+    loader = get_incremental_loader()
+    cleaned = loader.refresh()
+    trends = _shared_trends(loader.db_path)
+    trends.update(cleaned, loader.version)
+    return trends
+
+class TrendStore:
+    """
+    `series` maps (level, value) to a column of the matrices, e.g.
+    ("model", ("RENAULT", "CLIO")) or ("market", None); rows are the days from
+    `first_day` (days since 1970-01-01) on, and the weeks of these days for
+    the weekly medians.
+    """
+
+    def __init__(self, half_lives):
+        self.half_lives = tuple(half_lives)
+        self.version = None
+        self.rows = None
+        self.hashes = None
+        self.series = {}
+        self.first_day = None
+        self.count = np.zeros((0, 0), dtype=np.int32)
+        self.price_sum = np.zeros((0, 0))
+        self.median = np.zeros((0, 0), dtype=np.float32)
+        self.weekly_median = np.zeros((0, 0), dtype=np.float32)
+        self.ewma = {half_life: (np.zeros((0, 0)), np.zeros((0, 0))) for half_life in self.half_lives}
+        self._lock = threading.Lock()
+
+    def update(self, cleaned, version):
+        with self._lock:
+            if version == self.version:
+                return
+            rows = self._trend_rows(cleaned)
+            subtracted, counted, hashes = row_multiset_diff(self.rows, rows, self.hashes)
+
+            start = self._resize(rows["day"].min(), rows["day"].max())
+            self._accumulate(subtracted, -1)
+            self._accumulate(counted, 1)
+            touched = np.union1d(subtracted["day"].to_numpy(), counted["day"].to_numpy())
+            if len(touched):
+                self._medians(rows, touched)
+                start = min(start, touched[0] - self.first_day)
+            self._carry_ewma(start)
+            self.rows = rows
+            self.hashes = hashes
+            self.version = version
+
+    def _trend_rows(self, cleaned):
+        # Day, price and series of each listing; new series get a column
+        rows = pd.DataFrame({
+            "day": cleaned["date"].to_numpy().astype("datetime64[D]").astype(np.int64),
+            "price": cleaned["price"].to_numpy(dtype=np.int64),
+        })
+        for level, columns in LEVELS.items():
+            if not columns:
+                rows[level] = self._series_ids(level, [None])[0]
+                continue
+            grouped = cleaned.groupby(columns[0] if len(columns) == 1 else columns, observed=True, sort=False)
+            # Listings with a missing key are in no series (-1; ngroup gives NaN)
+            codes = grouped.ngroup().fillna(-1).to_numpy(dtype=np.int64)
+            ids = self._series_ids(level, grouped.size().index)
+            rows[level] = np.where(codes >= 0, ids[np.maximum(codes, 0)], -1)
+        return rows
+
+    def _series_ids(self, level, values):
+        ids = np.empty(len(values), dtype=np.int64)
+        for i, value in enumerate(values):
+            ids[i] = self.series.setdefault((level, _key(value)), len(self.series))
+        return ids
+
+    def _resize(self, first_day, last_day):
+        # Grow the matrices to the days of the dataset and to every series; returns
+        # the first row whose EWMA must be computed again
+        first_day, last_day = int(first_day), int(last_day)
+        if self.first_day is not None:
+            first_day = min(first_day, self.first_day)
+            last_day = max(last_day, self.first_day + len(self.count) - 1)
+        shape = (last_day - first_day + 1, len(self.series))
+        if self.first_day is not None and shape == self.count.shape:
+            return len(self.count)
+        offset = 0 if self.first_day is None else self.first_day - first_day
+        week_offset = 0 if self.first_day is None else _week(self.first_day) - _week(first_day)
+        weeks = (_week(last_day) - _week(first_day) + 1, len(self.series))
+
+        def grown(matrix, shape, offset, fill=0):
+            result = np.full(shape, fill, dtype=matrix.dtype)
+            result[offset:offset + matrix.shape[0], :matrix.shape[1]] = matrix
+            return result
+
+        start = len(self.count) if offset == 0 else 0
+        self.count = grown(self.count, shape, offset)
+        self.price_sum = grown(self.price_sum, shape, offset)
+        self.median = grown(self.median, shape, offset, np.nan)
+        self.weekly_median = grown(self.weekly_median, weeks, week_offset, np.nan)
+        self.ewma = {half_life: (grown(counts, shape, offset), grown(sums, shape, offset))
+                     for half_life, (counts, sums) in self.ewma.items()}
+        self.first_day = first_day
+        return start
+
+    def _accumulate(self, rows, sign):
+        if rows.empty:
+            return
+        cells, prices = _cells(rows, rows["day"].to_numpy() - self.first_day, self.count.shape[1])
+        size = self.count.size
+        self.count += (sign * np.bincount(cells, minlength=size)).reshape(self.count.shape).astype(np.int32)
+        self.price_sum += (sign * np.bincount(cells, weights=prices, minlength=size)).reshape(self.count.shape)
+
+    def _medians(self, rows, touched):
+        # Median price of the touched days and weeks, from their listings
+        days = rows["day"].to_numpy()
+        _set_medians(self.median, rows, days - self.first_day, touched - self.first_day)
+        first_week = _week(self.first_day)
+        _set_medians(self.weekly_median, rows, _week(days) - first_week, np.unique(_week(touched)) - first_week)
+
+    def _carry_ewma(self, start):
+        # EWMA of the listings and of the price sum of every series from row `start` on
+        for half_life, (counts, sums) in self.ewma.items():
+            decay = 0.5 ** (1 / half_life)
+            count, total = (counts[start - 1], sums[start - 1]) if start else (0.0, 0.0)
+            for day in range(start, len(self.count)):
+                count = counts[day] = decay * count + self.count[day]
+                total = sums[day] = decay * total + self.price_sum[day]
+
+    def values(self, level, brand=None):
+        """
+        Sorted values of the `level` series with listings (for the models,
+        only the ones of `brand` when given).
+        """
+        listed = self.count.sum(axis=0) > 0
+        values = [value for (kind, value), column in self.series.items() if kind == level and listed[column]]
+        if brand is not None:
+            values = [value for value in values if value[0] == brand]
+        return sorted(values)
+
+    def dates(self):
+        return EPOCH + pd.to_timedelta(np.arange(self.first_day, self.first_day + len(self.count)), "D")
+
+    def daily(self, level, value, window=ROLLING_WINDOW, half_life=EWMA_HALF_LIVES[0]):
+        """
+        Daily series of one series (e.g. "model", ("RENAULT", "CLIO")): listings,
+        mean and median price of each day, listings per day and mean price over
+        the last `window` days, and their EWMA (`half_life` must be one of the
+        maintained half-lives). Prices are NaN where there is no listing.
+        """
+        column = self.series[(level, _key(value))]
+        count, total = self.count[:, column], self.price_sum[:, column]
+        cumulative_count = np.concatenate([[0], np.cumsum(count)])
+        cumulative_total = np.concatenate([[0], np.cumsum(total)])
+        end = np.arange(1, len(count) + 1)
+        start = np.maximum(end - window, 0)
+        rolling_count = cumulative_count[end] - cumulative_count[start]
+        rolling_total = cumulative_total[end] - cumulative_total[start]
+        ewma_count, ewma_total = (matrix[:, column] for matrix in self.ewma[half_life])
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return pd.DataFrame({
+                "listings": count,
+                "mean price": np.where(count > 0, total / count, np.nan),
+                "median price": self.median[:, column],
+                "rolling listings": rolling_count / (end - start),
+                "rolling mean price": np.where(rolling_count > 0, rolling_total / rolling_count, np.nan),
+                "ewma listings": ewma_count * (1 - 0.5 ** (1 / half_life)),
+                "ewma price": np.where(ewma_count > 0, ewma_total / ewma_count, np.nan),
+            }, index=self.dates())
+
+    def weekly(self, level, value):
+        """
+        Weekly series of one series: listings, mean and median price of each
+        week (starting on Mondays).
+        """
+        column = self.series[(level, _key(value))]
+        first_week = _week(self.first_day)
+        weeks = _week(np.arange(self.first_day, self.first_day + len(self.count))) - first_week
+        count = np.bincount(weeks, weights=self.count[:, column], minlength=len(self.weekly_median))
+        total = np.bincount(weeks, weights=self.price_sum[:, column], minlength=len(self.weekly_median))
+        mondays = np.arange(first_week, first_week + len(self.weekly_median)) * 7 + _FIRST_MONDAY
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return pd.DataFrame({
+                "listings": count.astype(np.int64),
+                "mean price": np.where(count > 0, total / count, np.nan),
+                "median price": self.weekly_median[:, column],
+            }, index=EPOCH + pd.to_timedelta(mondays, "D"))
+
+    def seasonality(self, level, value):
+        """
+        Listings per day and mean price of one series per month of the year,
+        over every year of the history.
+        """
+        column = self.series[(level, _key(value))]
+        months = self.dates().month.to_numpy() - 1
+        days = np.bincount(months, minlength=12)
+        count = np.bincount(months, weights=self.count[:, column], minlength=12)
+        total = np.bincount(months, weights=self.price_sum[:, column], minlength=12)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return pd.DataFrame({
+                "listings per day": np.where(days > 0, count / days, np.nan),
+                "mean price": np.where(count > 0, total / count, np.nan),
+            }, index=pd.Index(range(1, 13), name="month"))
+
+def _cells(rows, periods, width):
+    # Flat (period, series) cell and price of each listing, once for every
+    # level it has a series in
+    cells = np.concatenate([periods * width + rows[level].to_numpy() for level in LEVELS])
+    prices = np.tile(rows["price"].to_numpy(), len(LEVELS))
+    valid = np.concatenate([rows[level].to_numpy() >= 0 for level in LEVELS])
+    return cells[valid], prices[valid]
+
+def _set_medians(matrix, rows, periods, touched):
+    matrix[touched] = np.nan
+    selected = np.isin(periods, touched)
+    cells, prices = _cells(rows[selected], periods[selected], matrix.shape[1])
+    medians = pd.Series(prices).groupby(cells).median()
+    matrix.ravel()[medians.index.to_numpy()] = medians.to_numpy()
+
+def _week(day):
+    # Week of a day (days since 1970-01-01), weeks starting on Mondays
+    return (day - _FIRST_MONDAY) // 7
+
+def _key(value):
+    # Plain Python values, so the page's selections find their series
+    if isinstance(value, tuple):
+        return tuple(_key(part) for part in value)
+    return value.item() if isinstance(value, np.generic) else value
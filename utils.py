@@ -1,56 +1,508 @@
 import sqlite3
+import threading
+import os
+import json
+import numpy as np
 import pandas as pd
-import io
+import pyarrow as pa
+import pyarrow.compute as pc
 import streamlit as st
 import datetime
 
+from instrumentation import Rerun, section
+from db import BUSY_TIMEOUT, fetch_all, pooled_connection, read_sql
+
+# Frames derived from the shared dataset (filters, added columns) copy data only
+# when they are modified, never the shared frame itself
+pd.set_option("mode.copy_on_write", True)
+
+# Path to the SQLite file written by the scraper (js/scraper.js)
+DB_PATH = "cars_db.sqlite"
+
+COLUMNS = ["link", "title", "price", "engine", "fuel", "mileage", "color", "gearbox", "paper", "brand", "year", "model", "finition", "location", "wilaya", "date"]
+
+# Typed schema of the listings (see apply_schema): strings repeated across
+# listings are categoricals, the (almost) unique ones are Arrow strings and the
+# integers use the smallest type that holds the scraped values
+CATEGORY_COLUMNS = ["brand", "model", "fuel", "gearbox", "color", "engine", "paper", "finition", "location"]
+STRING_COLUMNS = ["link", "title"]
+INTEGER_COLUMNS = {"price": "int32", "mileage": "int32", "year": "int16", "wilaya": "uint8"}
+ARROW_STRING = pd.StringDtype("pyarrow")
+
+# Upper bound of the memory used by the cleaned listings, per row (checked by
+# tests/benchmarks/test_memory.py)
+MEMORY_BUDGET_PER_ROW = 128
+
+def apply_schema(frame):
+    """
+    Return `frame` with its listing columns converted to the typed schema and
+    'date' parsed. Columns that already have their type are left untouched.
+    Integer columns with missing values become float32, and columns whose
+    values do not fit their type are kept as they are.
+    """
+    frame = frame.copy(deep=False)
+    for column in frame.columns:
+        values = frame[column]
+        if column in CATEGORY_COLUMNS and not isinstance(values.dtype, pd.CategoricalDtype):
+            frame[column] = values.astype("category")
+        elif column in STRING_COLUMNS and values.dtype != ARROW_STRING:
+            frame[column] = values.astype(ARROW_STRING)
+        elif column in INTEGER_COLUMNS and values.dtype != INTEGER_COLUMNS[column]:
+            frame[column] = _downcast(values, INTEGER_COLUMNS[column])
+        elif column == "date" and not pd.api.types.is_datetime64_dtype(values):
+            frame[column] = pd.to_datetime(values, errors="coerce")
+    return frame
+
+def _downcast(values, dtype):
+    if values.isna().any():
+        return values.astype("float32")
+    info = np.iinfo(dtype)
+    if len(values) and (values.min() < info.min or values.max() > info.max):
+        return values
+    return values.astype(dtype)
+
+def memory_report(frame):
+    """
+    Type and memory usage (strings included) of every column of `frame`.
+    """
+    usage = frame.memory_usage(index=False, deep=True)
+    report = pd.DataFrame({
+        "dtype": frame.dtypes.astype(str),
+        "MB": usage / 1e6,
+        "bytes per row": usage / max(len(frame), 1),
+    })
+    report.loc["total"] = ["", usage.sum() / 1e6, usage.sum() / max(len(frame), 1)]
+    return report
+
 # Connect to SQLite database and load data
-@st.cache_data
 def load_data_from_db():
-    # Adjust the path to your SQLite file
-    conn = sqlite3.connect("cars_db.sqlite")  
-    query = "SELECT link, title, price, engine, fuel, mileage, color, gearbox, paper, brand, year, model, finition, location, wilaya, date FROM cars"
-    data = pd.read_sql(query, conn)
-    conn.close()
-    return data
+    """
+    Return the raw listings. Only rows changed since the previous call are
+    read from SQLite (see IncrementalLoader).
+    """
+    loader = get_incremental_loader()
+    loader.refresh()
+    return loader.raw.reset_index()
+
+def load_cleaned_data():
+    """
+    Return a view of the shared cleaned listings (see get_dataset). Only the
+    rows that changed since the previous call are read and cleaned again.
+    """
+    return get_dataset().view()
+
+def get_dataset():
+    """
+    The process-wide Dataset for the current version of the listings.
+    """
+    loader = get_incremental_loader()
+    cleaned = loader.refresh()
+    return _dataset_for(loader.version, cleaned)
+
+@st.cache_resource(max_entries=1)
+def _dataset_for(version, _cleaned):
+    return Dataset(_cleaned, version)
+
+class Dataset:
+    """
+    The cleaned listings of one dataset version, with the derived columns the
+    pages need, shared by every page and session of the server process.
+    Pages get shallow views: with copy-on-write, filtering a view or adding a
+    column to it never copies nor alters the shared frame.
+    """
+
+    def __init__(self, cleaned, version):
+        frame = cleaned.copy(deep=False)
+        # Number of days since 1970-01-01
+        frame['date_int'] = (frame['date'] - pd.Timestamp('1970-01-01')) // pd.Timedelta('1D')
+        self.frame = frame
+        self.version = version
+
+    def view(self):
+        return self.frame.copy(deep=False)
+
+    def __len__(self):
+        return len(self.frame)
+
+def start_rerun(page):
+    """
+    Call at the top of a page; pass the result to show_rerun_stats at the end.
+    The sections of the page are recorded in the returned Rerun (see
+    instrumentation.py). The first rerun of the process starts the background
+    warm-up of the shared caches (see warmup.py).
+    """
+    from warmup import start_warmup
+
+    rerun = Rerun(page)
+    warmup = start_warmup()
+    rerun.warmup = None if warmup is None else (warmup, warmup.begin_render())
+    return rerun
+
+def session_memory(frames):
+    """
+    Bytes held by the frames in `frames` (e.g. a page's globals()) that are not
+    shared with the process-wide dataset. Categorical columns are counted as
+    their codes (the categories are shared) and object columns as their
+    pointer arrays.
+    """
+    dataset = get_dataset().frame
+    shared = [array for column in dataset.columns for array in _buffers(dataset[column])]
+    total = 0
+    seen = set()
+    for frame in frames.values() if isinstance(frames, dict) else frames:
+        if not isinstance(frame, pd.DataFrame) or id(frame) in seen:
+            continue
+        seen.add(id(frame))
+        for column in frame.columns:
+            for values in _buffers(frame[column]):
+                if not any(np.may_share_memory(values, array) for array in shared):
+                    total += values.nbytes
+    return total
+
+def _buffers(column):
+    # The arrays holding a column's data, without materializing it
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        return [column.array.codes]
+    if column.dtype == ARROW_STRING:
+        return [np.frombuffer(buffer, dtype=np.uint8) for buffer in pa.array(column.array).buffers() if buffer is not None]
+    return [np.asarray(column)]
+
+def show_rerun_stats(rerun, frames):
+    """
+    Show the time of this rerun and the memory owned by this session's frames,
+    then log its sections and record it as a first render for the warm-up
+    metrics (both shown when the debug panel is on).
+    """
+    session_bytes = session_memory(frames)
+    elapsed = rerun.elapsed
+    st.sidebar.caption(f"Rerun: {elapsed * 1000:.0f} ms · session data: {session_bytes / 1e6:.1f} MB")
+    rerun.finish(session_bytes)
+    if rerun.warmup is not None:
+        from warmup import show_report
+
+        warmup, begun = rerun.warmup
+        warmup.end_render(rerun.page, get_incremental_loader().version, elapsed, begun)
+        if st.session_state.get("debug_panel"):
+            show_report(warmup)
+
+@st.cache_resource
+def get_incremental_loader():
+    # One loader per server process, shared by every page and session
+    return IncrementalLoader(DB_PATH)
+
+class IncrementalLoader:
+    """
+    Keeps the last loaded frame in memory and, on refresh, only fetches the rows
+    whose `updatedAt` (maintained by Sequelize) is at or past the last watermark.
+    Changed rows are merged by `link` and only those rows are cleaned again.
+    On a cold start the frames are memory-mapped from the Arrow snapshot
+    (see write_snapshot) instead of being read again from SQLite.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.watermark = None
+        self._links_at_watermark = set()
+        self._db_mtime = None
+        self.raw = None
+        self.prepared = None
+        self.cleaned = None
+        self._year = datetime.datetime.now().year
+        self._lock = threading.Lock()
+
+    def refresh(self):
+        with self._lock:
+            current_year = datetime.datetime.now().year
+            mtime = db_mtime(self.db_path)
+            if self.raw is not None and mtime == self._db_mtime and current_year == self._year:
+                # Nothing was written to the database since the last refresh
+                return self.cleaned
+            if self.raw is None:
+                with section("read snapshot") as timing:
+                    self._load_snapshot()
+                    timing.output(self.raw)
+
+            with section("read changed rows") as timing:
+                delta = self._fetch_changed_rows()
+                timing.output(delta)
+            # Rows sitting exactly on the watermark were already merged last time
+            delta = delta[~((delta["updatedAt"] == self.watermark) & delta["link"].isin(self._links_at_watermark))]
+            self._db_mtime = mtime
+            if self.raw is not None and current_year != self._year:
+                # The mileage fix-up depends on the current year: clean every row again
+                self._year = current_year
+                self.prepared = apply_schema(clean_rows(self.raw, has_brand_and_model(self.raw)))
+            elif self.raw is not None and delta.empty:
+                return self.cleaned
+
+            delta = delta.drop_duplicates(subset="link", keep="last")
+            if not delta.empty:
+                self.watermark = delta["updatedAt"].max()
+                self._links_at_watermark = set(delta.loc[delta["updatedAt"] == self.watermark, "link"])
+            delta = apply_schema(delta.drop(columns=["updatedAt"])).set_index("link")
+
+            # Re-clean only the changed rows
+            with section("clean changed rows", delta) as timing:
+                changed = apply_schema(clean_rows(delta, has_brand_and_model(delta)))
+                timing.output(changed)
+
+            if self.raw is None:
+                self.raw = delta
+                self.prepared = changed
+            else:
+                # Merge the changed rows by link (the scraper never deletes listings)
+                self.raw = concat_typed([self.raw[~self.raw.index.isin(delta.index)], delta])
+                self.prepared = concat_typed([self.prepared[~self.prepared.index.isin(delta.index)], changed])
+
+            # The minimum-count filters depend on the whole table, so they are
+            # evaluated again over the raw rows (cheap compared to a full clean)
+            with section("minimum-count filters", self.prepared) as timing:
+                present = has_brand_and_model(self.raw)
+                kept = self.raw.index[_min_count_mask(self.raw, present)]
+                passes = self.prepared.index.isin(kept)
+                self.cleaned = apply_schema(_drop_unused_categories(self.prepared[passes].reset_index()))
+                timing.output(self.cleaned)
+
+            with section("write snapshot"):
+                write_snapshot(self.db_path, self.raw, self.prepared, passes, {
+                    "watermark": self.watermark,
+                    "links_at_watermark": sorted(self._links_at_watermark),
+                    "year": self._year,
+                })
+            return self.cleaned
+
+    @property
+    def version(self):
+        """
+        Identifies the current cleaned dataset: it changes whenever new rows are
+        merged or the rows are cleaned again for a new year.
+        """
+        return f"{self.watermark}/{self._year}"
+
+    def _load_snapshot(self):
+        snapshot = read_snapshot(self.db_path)
+        if snapshot is None:
+            return
+        raw, prepared, passes, meta = snapshot
+        if meta["year"] != self._year:
+            return
+        self.raw = apply_schema(raw).set_index("link")
+        self.prepared = apply_schema(prepared).set_index("link")
+        self.cleaned = apply_schema(_drop_unused_categories(prepared[passes].reset_index(drop=True)))
+        self.watermark = meta["watermark"]
+        self._links_at_watermark = set(meta["links_at_watermark"])
+
+    def _fetch_changed_rows(self):
+        query = f"SELECT {', '.join(COLUMNS)}, updatedAt FROM cars"
+        params = ()
+        if self.watermark is not None:
+            # >= so rows written in the same millisecond as the watermark are not missed
+            query += " WHERE updatedAt >= ?"
+            params = (self.watermark,)
+        return read_sql(self.db_path, query, params)
+
+def concat_typed(frames):
+    """
+    pd.concat that keeps categorical columns categorical: their categories are
+    merged first (pandas falls back to object strings when they differ), and
+    sorted, as apply_schema leaves the categories of a full load.
+    """
+    frames = list(frames)
+    for column in CATEGORY_COLUMNS:
+        if all(column in frame and isinstance(frame[column].dtype, pd.CategoricalDtype) for frame in frames):
+            categories = pd.api.types.union_categoricals([frame[column] for frame in frames], sort_categories=True).categories
+            frames = [frame.assign(**{column: frame[column].cat.set_categories(categories)}) for frame in frames]
+    return pd.concat(frames)
+
+def _drop_unused_categories(frame):
+    # So that value_counts, groupby and plots only see the listed values
+    for column in frame.columns:
+        if isinstance(frame[column].dtype, pd.CategoricalDtype):
+            frame[column] = frame[column].cat.remove_unused_categories()
+    return frame
+
+def db_mtime(db_path):
+    """
+    Last modification time of the SQLite file (and its WAL file, if any).
+    """
+    mtimes = [os.path.getmtime(path) for path in (db_path, db_path + "-wal") if os.path.exists(path)]
+    return max(mtimes) if mtimes else None
+
+# Columnar snapshot of the listings, stored next to the SQLite file
+SNAPSHOT_VERSION = 2
+
+def snapshot_paths(db_path):
+    base = os.path.splitext(db_path)[0]
+    return base + ".raw.arrow", base + ".clean.arrow"
+
+def write_snapshot(db_path, raw, prepared, passes, meta):
+    """
+    Write the raw and row-cleaned listings as Arrow IPC files so the next cold
+    start can memory-map them. `passes` flags the prepared rows that also pass
+    the minimum-count filters, i.e. the cleaned dataset.
+    """
+    meta = dict(meta, version=SNAPSHOT_VERSION, db_mtime=db_mtime(db_path))
+    prepared = prepared.reset_index()
+    prepared["passes_min_counts"] = passes
+    for path, frame in zip(snapshot_paths(db_path), (raw.reset_index(), prepared)):
+        write_arrow(path, frame, meta)
+
+def read_snapshot(db_path):
+    """
+    Memory-map the snapshot written by write_snapshot.
+    Returns (raw, prepared, passes, meta), or None when there is no usable snapshot.
+    """
+    frames = []
+    metas = []
+    for path in snapshot_paths(db_path):
+        snapshot = read_arrow(path)
+        if snapshot is None or snapshot[1]["version"] != SNAPSHOT_VERSION:
+            return None
+        frames.append(snapshot[0])
+        metas.append(snapshot[1])
+    if metas[0] != metas[1]:
+        # The two files come from different refreshes
+        return None
+    raw, prepared = frames
+    passes = prepared.pop("passes_min_counts").to_numpy()
+    return raw, prepared, passes, metas[0]
+
+def write_arrow(path, frame, meta):
+    """
+    Atomically write a frame and its JSON metadata as an Arrow IPC file.
+    Repeated values in the CATEGORY_COLUMNS are dictionary-encoded.
+    """
+    table = pa.Table.from_pandas(frame, preserve_index=False)
+    for column in CATEGORY_COLUMNS:
+        index = table.schema.get_field_index(column)
+        if index >= 0 and pa.types.is_string(table.field(index).type):
+            table = table.set_column(index, column, pc.dictionary_encode(table.column(column)))
+    table = table.replace_schema_metadata({"snapshot": json.dumps(meta)})
+    tmp_path = path + ".tmp"
+    with pa.OSFile(tmp_path, "wb") as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(tmp_path, path)
+
+def read_arrow(path):
+    """
+    Memory-map a file written by write_arrow. Returns (frame, meta), or None
+    when the file does not exist. Dictionary-encoded columns are read as
+    categoricals and the other strings as Arrow strings.
+    """
+    if not os.path.exists(path):
+        return None
+    table = pa.ipc.open_file(pa.memory_map(path)).read_all()
+    meta = json.loads(table.schema.metadata[b"snapshot"])
+    strings = {pa.string(): ARROW_STRING, pa.large_string(): ARROW_STRING}
+    return table.to_pandas(types_mapper=strings.get), meta
+
+# Minimum number of listings a model, then a brand, needs to be kept
+MIN_LISTINGS = 20
+
+# Unwanted prices
+BAD_PRICES = np.array([
+    123,
+    111, 1111, 11111,
+    222, 2222, 22222,
+    333, 3333, 33333,
+    444, 4444, 44444,
+    55, 555, 5555, 55555,
+    66, 666, 6666, 66666,
+    77, 777, 7777, 77777,
+    88, 888, 8888, 88888,
+    99, 999, 9999, 99999
+])
 
 # Clean the data
 def clean_data(data):
-    # Drop rows where 'brand' or 'model' is empty (NaN or empty string)
-    cleaned_data = data.dropna(subset=['brand', 'model'])  # Drop rows where brand or model is NaN
-    cleaned_data = cleaned_data[cleaned_data['brand'].str.strip() != '']  # Remove rows with empty string in 'brand'
-    cleaned_data = cleaned_data[cleaned_data['model'].str.strip() != '']  # Remove rows with empty string in 'model'
+    """
+    Every filter is evaluated as a boolean mask over the whole frame and the
+    kept rows are copied once at the end.
+    """
+    keep = has_brand_and_model(data)
+    keep &= _min_count_mask(data, keep)
+    return clean_rows(data, keep)
 
-    # Remove rows where the number of occurrences of a brand is less than 20
-    cleaned_data = cleaned_data.groupby('model').filter(lambda x: len(x) >= 20)
-    cleaned_data = cleaned_data.groupby('brand').filter(lambda x: len(x) >= 20)
+def has_brand_and_model(data):
+    """
+    Mask of the rows whose 'brand' and 'model' are filled (neither missing
+    nor blank), the first of clean_data's filters.
+    """
+    return _is_filled(data['brand']) & _is_filled(data['model'])
+
+def factorize(column):
+    """
+    Codes (-1 when missing) and distinct values of a column, as pd.factorize;
+    categoricals already have them, so nothing is hashed.
+    """
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        return column.cat.codes.to_numpy(), column.cat.categories
+    return pd.factorize(column)
+
+def row_multiset_diff(old, new, old_hashes=None):
+    """
+    The rows of `old` and of `new` (frames of the same columns) whose value
+    appears more or fewer times in `new` than in `old`, as (removed, added,
+    hashes of `new`'s rows). Statistics that are sums over the rows, whichever
+    listing a row belongs to, only change by these rows: a repriced listing
+    is one row removed and one added. `old` is None before the first
+    version; pass the hashes returned with it so it is not hashed again.
+    """
+    hashes = pd.util.hash_pandas_object(new, index=False).to_numpy()
+    if old is None:
+        return new.iloc[:0], new, hashes
+    if old_hashes is None:
+        old_hashes = pd.util.hash_pandas_object(old, index=False).to_numpy()
+    codes, _ = pd.factorize(np.concatenate([old_hashes, hashes]))
+    net = np.bincount(codes, weights=np.repeat([-1.0, 1.0], [len(old_hashes), len(hashes)]))
+    changed = net != 0
+    return old[changed[codes[:len(old_hashes)]]], new[changed[codes[len(old_hashes):]]], hashes
+
+def _is_filled(column):
+    # Strip each distinct value once instead of once per row
+    codes, uniques = factorize(column)
+    filled = np.append(np.asarray(uniques.str.strip() != '', dtype=bool), False)
+    return filled[codes]
+
+def _min_count_mask(data, keep):
+    # Remove rows whose model, then whose brand, has less than MIN_LISTINGS listings
+    keep = keep & (_group_sizes(data['model'], keep) >= MIN_LISTINGS)
+    keep = keep & (_group_sizes(data['brand'], keep) >= MIN_LISTINGS)
+    return keep
+
+def _group_sizes(column, keep):
+    # Number of kept rows sharing each row's value (0 for the rows not kept)
+    codes, uniques = factorize(column)
+    codes = np.where(keep, codes, -1)
+    counts = np.append(np.bincount(codes[codes >= 0], minlength=len(uniques)), 0)
+    return counts[codes]
+
+def clean_rows(data, keep):
+    """
+    The rows of `data` selected by the `keep` mask that pass clean_data's
+    row-level filters, fixed as clean_data fixes them: each row is kept or
+    fixed independently of the others (unlike the minimum-count filters).
+    """
+    keep = keep.copy()
+    rows = np.flatnonzero(keep)
 
     # Convert 'date' column to datetime
-    cleaned_data['date'] = pd.to_datetime(cleaned_data['date'])
+    dates = pd.to_datetime(data['date'].iloc[rows])
 
     # Filter the data where the 'date' is greater than 2020-01-01
-    cleaned_data = cleaned_data[cleaned_data['date'] > '2020-01-01']
-
-    cleaned_data = cleaned_data[cleaned_data['price']>49]
-
-    cleaned_data = cleaned_data[cleaned_data['mileage']>=0]
-
-    # Define the list of unwanted prices
-    bad_prices = [
-        123, 
-        111, 1111, 11111,
-        222, 2222, 22222,
-        333, 3333, 33333,
-        444, 4444, 44444,
-        55, 555, 5555, 55555,
-        66, 666, 6666, 66666,
-        77, 777, 7777, 77777,
-        88, 888, 8888, 88888,
-        99, 999, 9999, 99999
-    ]
+    keep[rows] = (dates > '2020-01-01').to_numpy()
+
+    price = data['price'].to_numpy()
+    keep &= price > 49
+    keep &= data['mileage'].to_numpy() >= 0
 
-    # Remove rows where price is in that list
-    cleaned_data = cleaned_data[~cleaned_data['price'].isin(bad_prices)]
+    # Remove rows where price is in the BAD_PRICES list
+    keep &= ~np.isin(price, BAD_PRICES)
+
+    # The only copy of the frame
+    cleaned_data = data.take(np.flatnonzero(keep))
+    cleaned_data['date'] = dates.array[keep[rows]]
 
     # Current year
     current_year = datetime.datetime.now().year
@@ -58,16 +510,163 @@ def clean_data(data):
     # If mileage < 1000 and year != current year → multiply mileage * 1000
     cleaned_data.loc[(cleaned_data["mileage"] < 1000) & (cleaned_data["year"] != current_year), "mileage"] *= 1000
 
-    # Convert all model names to uppercase
-    cleaned_data["model"] = cleaned_data["model"].str.upper()
-    
+    # Convert all model names to uppercase (each distinct name once)
+    codes, uniques = factorize(cleaned_data["model"])
+    cleaned_data["model"] = np.asarray(uniques.str.upper(), dtype=object)[codes]
+
     return cleaned_data
 
+# Query layer: the sidebar selections become parameterized WHERE clauses so
+# that SQLite only returns the rows a page actually shows
+
+INDEXES = {
+    "cars_date_price": "date, price",
+    "cars_brand_model_year": "brand, model, year",
+    "cars_wilaya": "wilaya",
+    "cars_updated_at": "updatedAt",
+}
+
+@st.cache_resource
+def ensure_indexes(db_path):
+    """
+    Create the indexes used by the query layer and the incremental loader
+    (once per server process).
+    """
+    conn = sqlite3.connect(db_path, timeout=BUSY_TIMEOUT)
+    try:
+        for name, columns in INDEXES.items():
+            conn.execute(f"CREATE INDEX IF NOT EXISTS {name} ON cars({columns})")
+        # Sampled statistics so the planner can choose between the indexes
+        conn.execute("PRAGMA analysis_limit=1000")
+        conn.execute("ANALYZE")
+        conn.commit()
+    except sqlite3.OperationalError:
+        # Read-only or locked database: the queries still work, only slower
+        pass
+    finally:
+        conn.close()
+
+@st.cache_data
+def eligible_values(db_path, mtime):
+    """
+    The raw models and brands that pass the minimum-count filters of clean_data.
+    A row passes them exactly when its model and its brand are both listed, so
+    the filters can be written as two IN clauses.
+    """
+    counts = read_sql(db_path, "SELECT brand, model, COUNT(*) AS n FROM cars GROUP BY brand, model")
+    counts = counts[has_brand_and_model(counts)]
+    model_sizes = counts.groupby("model")["n"].transform("sum")
+    counts = counts[model_sizes.to_numpy() >= MIN_LISTINGS]
+    brand_sizes = counts.groupby("brand")["n"].transform("sum")
+    models = counts["model"].unique().tolist()
+    brands = counts.loc[brand_sizes.to_numpy() >= MIN_LISTINGS, "brand"].unique().tolist()
+    return models, brands
+
+def build_where(eligible, date_range=None, price_range=None, brand=None, model=None, years=None):
+    """
+    Translate clean_data's rules and the sidebar selections into a WHERE clause.
+    `model` is the uppercase name shown in the widgets; it is matched against
+    every raw spelling of that model.
+    Returns (where, params).
+    """
+    models, brands = eligible
+    if brand is not None:
+        brands = [b for b in brands if b == brand]
+    if model is not None:
+        models = [m for m in models if isinstance(m, str) and m.upper() == model]
+
+    clauses = [
+        f"brand IN ({', '.join('?' * len(brands))})",
+        f"model IN ({', '.join('?' * len(models))})",
+        "date > '2020-01-01'",
+        "price > 49",
+        "mileage >= 0",
+        f"price NOT IN ({', '.join(str(p) for p in BAD_PRICES)})",
+    ]
+    params = [*brands, *models]
+    if date_range is not None:
+        clauses.append("date >= ? AND date <= ?")
+        params += [str(date_range[0]), str(date_range[1])]
+    if price_range is not None:
+        clauses.append("price >= ? AND price <= ?")
+        params += [int(price_range[0]), int(price_range[1])]
+    if years is not None:
+        clauses.append(f"year IN ({', '.join('?' * len(years))})")
+        params += [int(y) for y in years]
+    return " AND ".join(clauses), params
+
+def _where(db_path, filters):
+    ensure_indexes(db_path)
+    where, params = build_where(eligible_values(db_path, db_mtime(db_path)), **filters)
+    return db_mtime(db_path), where, tuple(params)
+
+def query_listings(db_path=DB_PATH, limit=None, offset=0, **filters):
+    """
+    Cleaned listings matching the filters (see build_where), read from SQLite:
+    all of them, or the `limit` listings after the first `offset` (in
+    database order). Each page is read and cached on its own.
+    """
+    return _read_listings(db_path, *_where(db_path, filters), limit, offset)
+
+def query_stats(db_path=DB_PATH, **filters):
+    """
+    Row count and date/price bounds of the cleaned listings matching the filters.
+    """
+    return _read_stats(db_path, *_where(db_path, filters))
+
+def query_distinct(column, db_path=DB_PATH, **filters):
+    """
+    Sorted distinct cleaned values of `column` for the listings matching the filters.
+    """
+    return _read_distinct(db_path, column, *_where(db_path, filters))
+
+def iter_listings(chunk_rows, db_path=DB_PATH, **filters):
+    """
+    Cleaned listings matching the filters (see build_where), read from SQLite
+    `chunk_rows` rows at a time, without building the whole DataFrame.
+    At least one (possibly empty) chunk is yielded.
+    """
+    _, where, params = _where(db_path, filters)
+    with pooled_connection(db_path) as conn:
+        chunks = pd.read_sql(f"SELECT {', '.join(COLUMNS)} FROM cars WHERE {where} ORDER BY id", conn, params=params, chunksize=chunk_rows)
+        empty = True
+        for chunk in chunks:
+            empty = False
+            yield clean_rows(chunk, np.ones(len(chunk), dtype=bool))
+        if empty:
+            yield pd.DataFrame(columns=COLUMNS)
+
+@st.cache_data(max_entries=256)
+def _read_listings(db_path, mtime, where, params, limit=None, offset=0):
+    # A negative LIMIT is no limit
+    data = read_sql(db_path, f"SELECT {', '.join(COLUMNS)} FROM cars WHERE {where} ORDER BY id LIMIT ? OFFSET ?",
+                    (*params, -1 if limit is None else limit, offset))
+    # The WHERE clause already applied the filters, this only fixes mileage and model
+    return _drop_unused_categories(apply_schema(clean_rows(data, np.ones(len(data), dtype=bool))))
+
+@st.cache_data(max_entries=256)
+def _read_stats(db_path, mtime, where, params):
+    row = fetch_all(db_path, f"SELECT COUNT(*), MIN(date), MAX(date), MIN(price), MAX(price) FROM cars WHERE {where}", params)[0]
+    return {
+        "count": row[0],
+        "min_date": pd.Timestamp(row[1]) if row[1] else None,
+        "max_date": pd.Timestamp(row[2]) if row[2] else None,
+        "min_price": row[3],
+        "max_price": row[4],
+    }
+
+@st.cache_data(max_entries=256)
+def _read_distinct(db_path, column, mtime, where, params):
+    if column not in COLUMNS:
+        raise ValueError(f"unknown column: {column}")
+    values = [row[0] for row in fetch_all(db_path, f"SELECT DISTINCT {column} FROM cars WHERE {where}", params)]
+    if column == "model":
+        values = [v.upper() for v in values if isinstance(v, str)]
+    return sorted(set(values))
+
 def convert_df_to_excel(df):
     """
-    Convert a DataFrame to an Excel file stored in memory for download.
+    Convert a DataFrame to an Excel file for download (streamed in chunks, see export.py).
     """
-    output = io.BytesIO()
-    with pd.ExcelWriter(output, engine='openpyxl') as writer:
-        df.to_excel(writer, index=False, sheet_name="Car Data")
-    return output.getvalue()
\ No newline at end of file
+    from export import export_bytes, frame_chunks
+    return export_bytes(frame_chunks(df), "xlsx")
\ No newline at end of file
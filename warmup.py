@@ -0,0 +1,384 @@
+"""
+Background warm-up of the shared caches after each data refresh.
+
+Without it, the first session after the scraper writes new listings (or after
+a restart) pays for reading and cleaning them, for bringing the shared stores
+up to date and for the charts most sessions then ask for. The first rerun of
+the server process starts a poller thread (see start_warmup, once per process
+as a cached resource) that refreshes the incremental loader every WARMUP_POLL
+seconds, the first time WARMUP_POLL seconds after that rerun so it does not
+slow it down. When the dataset version changes, tasks are queued for
+WARMUP_WORKERS threads, most useful first:
+
+- the cleaned dataset and the stores built from it (inverted index, rollup,
+  sketches, fair prices),
+- App.py's brand and model tables for its default window (the last month),
+  kept by the rollup,
+- the Models page's default drill-down of the WARMUP_TOP most listed models
+  of that window, whose charts are rendered into the chart cache (the
+  listings themselves are taken from the inverted index in a few
+  milliseconds, so they are not kept).
+
+Queued tasks are cancelled when a newer version appears (its warm-up starts
+over), and none is started once the warm-up of a version has run for
+WARMUP_BUDGET seconds. A running task cannot be interrupted, but a model's
+charts stop at the first one rendered after the cancellation. At exit (atexit)
+the threads are stopped and joined, so none is left running a task while the
+interpreter shuts down.
+
+Metrics: `runs` describes the last warm-ups, and `renders` the first rerun of
+each page after each version change (its time to first render, whether the
+warm-up of that version had finished, and the hits and misses of the chart
+cache and of the rollup's summary tables during the rerun; counted for the
+whole process, so other sessions' reruns are included). The debug panel of
+the pages shows both.
+"""
+import atexit
+import collections
+import logging
+import queue
+import threading
+import time
+import pandas as pd
+import streamlit as st
+
+from utils import get_dataset, get_incremental_loader
+
+# Off: no warm-up (the pages and the benchmarks' reference runs)
+WARMUP = True
+
+# Seconds between two refreshes of the loader by the poller
+WARMUP_POLL = 5.0
+
+# Threads running the warm-up tasks
+WARMUP_WORKERS = 2
+
+# Seconds after which no task of a version's warm-up is started
+WARMUP_BUDGET = 60.0
+
+# Models of the default window whose drill-down is warmed up
+WARMUP_TOP = 5
+
+# Warm-ups and first renders kept for the metrics
+RUNS_KEPT = 20
+RENDERS_KEPT = 200
+
+# Streamlit warns on every cached call from a thread outside a session
+STREAMLIT_LOGGERS = ["streamlit.runtime.scriptrunner_utils.script_run_context", "streamlit.runtime.caching.cache_data_api"]
+
+logger = logging.getLogger(__name__)
+
+# The Warmup started by _shared_warmup, for stop_warmup: st.cache_resource can
+# neither return a cached value without creating it nor release one through
+# a callback, so stopping the warm-up needs this reference
+_warmup = None
+
+def start_warmup():
+    """
+    The process-wide Warmup, started on the first call; None when WARMUP is off.
+    """
+    if not WARMUP:
+        return None
+    return _shared_warmup()
+
+@st.cache_resource(show_spinner=False)
+def _shared_warmup():
+    global _warmup
+    _warmup = Warmup(WARMUP_WORKERS, WARMUP_BUDGET, WARMUP_TOP, WARMUP_POLL)
+    _warmup.start()
+    return _warmup
+
+def stop_warmup():
+    """
+    Stop the process-wide Warmup, if any, and wait for its threads (the next
+    start_warmup starts another).
+    """
+    global _warmup
+    warmup, _warmup = _warmup, None
+    _shared_warmup.clear()
+    if warmup is not None:
+        warmup.stop()
+
+class Warmup:
+    """
+    `schedule(version)` queues the warm-up of a dataset version, cancelling
+    the tasks still queued for the previous one. The poller thread (`start`)
+    schedules every new version of the incremental loader. `stop` ends the
+    threads and waits for them; it is called at exit for a started Warmup.
+    """
+
+    def __init__(self, workers=WARMUP_WORKERS, budget=WARMUP_BUDGET, top=WARMUP_TOP, poll=WARMUP_POLL):
+        self.budget = budget
+        self.top = top
+        self.poll = poll
+        self.version = None
+        self.runs = collections.deque(maxlen=RUNS_KEPT)
+        self.renders = collections.deque(maxlen=RENDERS_KEPT)
+        self._rendered = set()
+        self._run = None
+        self._tasks = queue.Queue()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        # Daemon threads, as the interpreter would otherwise wait for them
+        # before running the atexit handler that stops them
+        self._threads = [threading.Thread(target=self._work, name=f"warmup-{number}", daemon=True) for number in range(workers)]
+        self._poller = threading.Thread(target=self._poll, name="warmup-poll", daemon=True)
+        for name in STREAMLIT_LOGGERS:
+            logging.getLogger(name).addFilter(_outside_warmup)
+
+    def start(self):
+        for thread in self._threads:
+            thread.start()
+        self._poller.start()
+        atexit.register(self.stop)
+
+    def stop(self):
+        if self._stop.is_set():
+            return
+        self._stop.set()
+        atexit.unregister(self.stop)
+        with self._lock:
+            # A model's charts stop at the next one (see _drill_down)
+            self._run = None
+            self._cancel_queued()
+        for _ in self._threads:
+            self._tasks.put(None)
+        for thread in [*self._threads, self._poller]:
+            if thread.is_alive() and thread is not threading.current_thread():
+                thread.join()
+
+    def schedule(self, version):
+        """
+        Queue the warm-up of `version`. Returns its record in `runs`.
+        """
+        with self._lock:
+            self.version = version
+            self._cancel_queued()
+            run = self._run = {"version": version, "started": time.monotonic(), "tasks": 0, "done": 0,
+                               "cancelled": 0, "over budget": 0, "failed": 0, "seconds": None}
+            self.runs.append(run)
+        tasks = [
+            ("dataset", get_dataset),
+            ("inverted index", _inverted_index),
+            ("rollup", _rollup),
+            ("default window summaries", self._summaries),
+            ("sketches", _sketches),
+            ("fair prices", _fair_prices),
+            ("top models", lambda: self._queue_drill_downs(run)),
+        ]
+        self._queue(run, tasks)
+        return run
+
+    def _queue(self, run, tasks):
+        with self._lock:
+            if run is not self._run or self._stop.is_set():
+                return
+            run["tasks"] += len(tasks)
+            for name, task in tasks:
+                self._tasks.put((run, name, task))
+
+    def idle(self):
+        """
+        Whether the last scheduled warm-up has finished (or was cancelled).
+        """
+        run = self._run
+        return run is None or run["seconds"] is not None
+
+    def _poll(self):
+        while not self._stop.wait(self.poll):
+            try:
+                loader = get_incremental_loader()
+                loader.refresh()
+                if loader.version != self.version:
+                    self.schedule(loader.version)
+            except Exception:
+                logger.exception("warm-up: refresh failed")
+
+    def _work(self):
+        while True:
+            item = self._tasks.get()
+            if item is None:
+                return
+            run, name, task = item
+            if run is not self._run or self._stop.is_set():
+                self._count(run, "cancelled")
+            elif time.monotonic() - run["started"] > self.budget:
+                self._count(run, "over budget")
+            else:
+                try:
+                    task()
+                    self._count(run, "done" if run is self._run else "cancelled")
+                except Exception:
+                    logger.exception("warm-up: %s failed", name)
+                    self._count(run, "failed")
+
+    def _count(self, run, outcome):
+        with self._lock:
+            _tally(run, outcome)
+
+    def _cancel_queued(self):
+        # With the lock held
+        while True:
+            try:
+                item = self._tasks.get_nowait()
+            except queue.Empty:
+                return
+            if item is not None:
+                _tally(item[0], "cancelled")
+
+    def _queue_drill_downs(self, run):
+        self._queue(run, [(f"drill-down {brand} {model}", self._drill_down(run, brand, model)) for brand, model in self._top_models()])
+
+    def _top_models(self):
+        # The (brand, model) pairs most listed in the default window
+        from inverted_index import get_inverted_index
+        from model_charts import day, default_window
+
+        index = get_inverted_index()
+        start, end = default_window(index)
+        listings = index.take(index.narrow(None, date_int=(day(start), day(end))))
+        counts = listings.groupby(["brand", "model"], observed=True).size()
+        return counts.sort_values(ascending=False, kind="stable").head(self.top).index.tolist()
+
+    def _summaries(self):
+        # App.py's brand and model tables for its default window and price range
+        dataset = get_dataset()
+        rollup = _rollup(dataset)
+        frame = dataset.frame
+        end = frame["date"].max()
+        window = ((end - pd.DateOffset(months=1)).date(), end.date())
+        in_window = frame["date"].between(pd.Timestamp(window[0]), pd.Timestamp(window[1]))
+        if not in_window.any():
+            return
+        prices = frame.loc[in_window, "price"]
+        for by in ["brand", "model"]:
+            rollup.summary(by, date_range=window, price_range=(int(prices.min()), int(prices.max())))
+
+    def _drill_down(self, run, brand, model):
+        # The Models page's listings and charts of one model, as a session
+        # selecting the brand then the model (every other filter left as is) gets them
+        def task():
+            from charts import render_chart
+            from inverted_index import get_inverted_index
+            from lod import FORCE_EXACT
+            from fair_price import get_fair_prices
+            from model_charts import chart_calls, default_listings, default_window, depreciation_curve, known, without_outliers
+
+            index = get_inverted_index()
+            start, end = default_window(index)
+            models_list, offered, narrowed = default_listings(index, brand, model, start, end)
+            if models_list.empty:
+                return
+            # The page's queries of the quantile sketches (every year selected)
+            mileage_query = None if narrowed else dict(version=index.version, date_range=(start, end), brand=brand, model=model)
+            price_query = None if narrowed else dict(mileage_query, price_range=None)
+            filtered_models_list = without_outliers(models_list, price_query, mileage_query)
+            calls = chart_calls(models_list, filtered_models_list, price_query, FORCE_EXACT)
+            fair_prices = get_fair_prices()
+            years, fuels, gearboxes = (known(offered.get(column, [])) for column in ['year', 'fuel', 'gearbox'])
+            if fair_prices.listings(brand, model) and years:
+                # The fair price inputs' defaults: the latest known year, the median mileage, the first known fuel and gearbox
+                age = max(end.year - int(years[-1]), 0)
+                fuel, gearbox = fuels[0] if fuels else None, gearboxes[0] if gearboxes else None
+                expected = fair_prices.expected_price(brand, model, age, int(models_list['mileage'].median()), fuel, gearbox)
+                calls.append((depreciation_curve, (fair_prices.depreciation(brand, model, fuel, gearbox), age, expected), dict(figsize=(10, 5))))
+            for draw, args, options in calls:
+                if run is not self._run:
+                    return
+                render_chart(draw, *args, **options)
+        return task
+
+    # -----------------------------------------------------------------
+    # First renders
+
+    def begin_render(self):
+        """
+        Counters at the start of a rerun, for end_render.
+        """
+        return time.monotonic(), cache_counts()
+
+    def end_render(self, page, version, seconds, begun):
+        """
+        Record the rerun of `page` that began with `begun` (see begin_render)
+        if it is the page's first one on `version`.
+        """
+        started, counts = begun
+        with self._lock:
+            if (page, version) in self._rendered:
+                return
+            self._rendered.add((page, version))
+            runs = list(self.runs)
+        run = next((run for run in reversed(runs) if run["version"] == version), None)
+        warmed = run is not None and run["seconds"] is not None and run["started"] + run["seconds"] <= started
+        ended = cache_counts()
+        self.renders.append({"page": page, "version": version, "seconds": seconds, "warmed": warmed,
+                             **{name: ended[name] - counts[name] for name in counts}})
+
+    def report(self):
+        """
+        The last warm-ups, and the first renders per page with and without a
+        finished warm-up (median seconds, hit rates), as frames.
+        """
+        with self._lock:
+            runs = pd.DataFrame(list(self.runs)).drop(columns="started", errors="ignore")
+        renders = pd.DataFrame(list(self.renders))
+        if renders.empty:
+            return runs, renders
+        totals = renders.groupby(["page", "warmed"]).sum(numeric_only=True)
+        report = renders.groupby(["page", "warmed"])["seconds"].agg(["size", "median"]).rename(columns={"size": "renders", "median": "median seconds"})
+        report["chart hit rate"] = totals["chart hits"] / (totals["chart hits"] + totals["chart misses"])
+        report["summary hit rate"] = totals["summary hits"] / (totals["summary hits"] + totals["summary misses"])
+        return runs, report
+
+def show_report(warmup):
+    """
+    The warm-up metrics in the sidebar (see Warmup.report).
+    """
+    runs, renders = warmup.report()
+    with st.sidebar.expander("Cache warm-up"):
+        st.write("Last warm-ups:")
+        st.dataframe(runs, hide_index=True, use_container_width=True)
+        st.write("Time to first render after a data refresh:")
+        st.dataframe(renders, use_container_width=True)
+
+def cache_counts():
+    """
+    Hits and misses of the chart cache and of the rollup's summary tables.
+    """
+    from charts import _chart_cache
+    from rollups import _shared_rollup
+
+    charts = _chart_cache()
+    rollup = _shared_rollup(get_incremental_loader().db_path)
+    return {"chart hits": charts.hits, "chart misses": charts.misses,
+            "summary hits": rollup.summary_hits, "summary misses": rollup.summary_misses}
+
+def _tally(run, outcome):
+    # Count a task of `run`, which ends with its last task
+    run[outcome] += 1
+    if run["done"] + run["cancelled"] + run["over budget"] + run["failed"] == run["tasks"]:
+        run["seconds"] = time.monotonic() - run["started"]
+
+def _inverted_index():
+    from inverted_index import get_inverted_index
+
+    return get_inverted_index()
+
+def _rollup(dataset=None):
+    from rollups import get_rollup
+
+    return get_rollup(dataset)
+
+def _sketches():
+    from sketches import get_sketches
+
+    return get_sketches()
+
+def _fair_prices():
+    from fair_price import get_fair_prices
+
+    return get_fair_prices()
+
+def _outside_warmup(record):
+    # Logging filter: drops the records of the warm-up's threads
+    return not threading.current_thread().name.startswith("warmup")